@@ -0,0 +1,150 @@
+import asyncio
+import contextvars
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import JsonResponse
+from googleapiclient.errors import HttpError
+
+from .authentication import InvalidIdTokenError, get_id_token, verify_id_token
+from .availability import fetch_availability_index_async
+from .booking_queue import BOOKING_WRITE_BEHIND
+from .cache import availability_cache
+from .calendar_service import calendar_id
+from .metrics import time_availability_compute
+from .precompute import get_precomputed_slots
+from .views import (SLOT_TYPES, initialise_service, get_slot_type_parameter, get_search_window_parameters, generate_available_slots_of_slot_type,
+                    check_booking_data, place_booking, get_available_slots_response, get_not_modified_response, SlotUnavailableError,
+                    UPSTREAM_ERRORS, get_upstream_error_response)
+
+# Variable: Maximum number of Google Calendar API calls the async views run at the same time
+UPSTREAM_MAX_WORKERS = getattr(settings, 'GCAL_UPSTREAM_MAX_WORKERS', 8)
+
+# Variable: Number of days fetched by each concurrent call when searching for available slots
+ASYNC_CHUNK_DAYS = getattr(settings, 'GCAL_ASYNC_CHUNK_DAYS', 7)
+
+# Variable: Bounded thread pool that runs the blocking Google Calendar API calls
+# The threads share the pooled HTTP transport of the service
+upstream_executor = ThreadPoolExecutor(max_workers=UPSTREAM_MAX_WORKERS, thread_name_prefix='gcal-upstream')
+
+# Function: Run a blocking Google Calendar API call on the upstream thread pool
+# The call runs in a copy of the current context, so that its timings are reported in the Server-Timing header of the request
+async def run_upstream(func, *args):
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(upstream_executor, context.run, run_with_fresh_connections, func, *args)
+
+# Function: Run a function on a thread of the pool, closing database connections that are past their lifetime first,
+# the same way Django does at the start and end of each request
+def run_with_fresh_connections(func, *args):
+    close_old_connections()
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+# Function: Find available slots of a slot type, fetching the search window in concurrent chunks (for GET request only)
+# The Google Calendar service is only built (on first use) here, when the slots are computed
+# Returns None if the events cannot be fetched
+async def find_available_slots_async(calendar_id, slot_type, display_start_date, horizon_days):
+    service = await run_upstream(initialise_service)
+
+    try:
+        availability_index = await fetch_availability_index_async(service, calendar_id, display_start_date, horizon_days,
+                                                                  run_upstream, ASYNC_CHUNK_DAYS)
+
+    except HttpError as error:
+        print(f'An error occurred: {error}')
+        return None
+
+    # The events are fetched on the upstream thread pool, so only the slot search is timed here
+    with time_availability_compute('available_slots'):
+        return generate_available_slots_of_slot_type(availability_index, slot_type, display_start_date)
+
+# View: Async version of get_available_slots, for ASGI deployments
+async def get_available_slots_async(request):
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+    try:
+        slot_type = get_slot_type_parameter(request.GET)
+        display_start_date, horizon_days = get_search_window_parameters(request.GET)
+
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+
+    search_dates = [display_start_date + timedelta(days=day) for day in range(horizon_days)]
+    key_parts = ('available_slots', slot_type, display_start_date.isoformat(), horizon_days)
+
+    if slot_type in SLOT_TYPES:
+        precomputed_slots = await run_upstream(get_precomputed_slots, calendar_id, [slot_type], display_start_date, horizon_days)
+        if precomputed_slots is not None:
+            return get_available_slots_response(request, key_parts, precomputed_slots['%g' % slot_type],
+                                                lambda slots: JsonResponse(slots, safe=False))
+
+    slots_tag = await sync_to_async(availability_cache.get_cached_tag, thread_sensitive=False)(calendar_id, search_dates, key_parts)
+    response = get_not_modified_response(request, key_parts, slots_tag)
+    if response is not None:
+        return response
+
+    # Shares the cached slots (and ETags) of get_available_slots
+    available_slots = await availability_cache.aget_or_compute(
+        calendar_id, search_dates, key_parts,
+        lambda: find_available_slots_async(calendar_id, slot_type, display_start_date, horizon_days), serve_last_known=True)
+
+    if available_slots is None:
+        return JsonResponse([], safe=False)
+
+    return get_available_slots_response(request, key_parts, available_slots, lambda slots: JsonResponse(slots, safe=False))
+
+# View: Async version of book_slot, for ASGI deployments
+async def book_slot_async(request):
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+    # Only signed-in users can book, like book_slot
+    id_token = get_id_token(request)
+    if id_token is None:
+        return JsonResponse({'error': 'Authorization header missing'}, status=401)
+
+    try:
+        claims = await run_upstream(verify_id_token, id_token)
+
+    except InvalidIdTokenError:
+        return JsonResponse({'error': 'Invalid user ID token'}, status=401)
+
+    # Extract booking information from POST request
+    try:
+        request_data = json.loads(request.body)
+
+    except ValueError:
+        return JsonResponse({'error': 'The request body must be JSON'}, status=400)
+
+    try:
+        check_booking_data(request_data)
+
+    except ValueError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+
+    service = await run_upstream(initialise_service)
+
+    # The capacity is reserved in the ledger and the event is inserted on a thread of the pool,
+    # as the days of the booking stay locked in a database transaction while its availability is checked
+    try:
+        created_event = await run_upstream(place_booking, service, request_data, claims['uid'])
+
+    except SlotUnavailableError as error:
+        return JsonResponse({'error': str(error)}, status=409)
+
+    except UPSTREAM_ERRORS as error:
+        return get_upstream_error_response(error, JsonResponse)
+
+    # With write-behind booking, the booking is only accepted here
+    return JsonResponse(created_event, status=202 if BOOKING_WRITE_BEHIND else 200)
+
+# Like the DRF views, the async views are exempt from CSRF checks
+get_available_slots_async.csrf_exempt = True
+book_slot_async.csrf_exempt = True
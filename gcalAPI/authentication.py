@@ -0,0 +1,101 @@
+import hashlib
+import threading
+import time
+
+from cachetools import TLRUCache
+from django.conf import settings
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+from rest_framework.exceptions import AuthenticationFailed
+
+from .firebase_app import get_firebase_app
+from .metrics import FIREBASE_VERIFY_SECONDS, observe_timing
+
+# Variable: Maximum number of verified Firebase ID tokens kept in memory
+TOKEN_CACHE_MAX_ENTRIES = getattr(settings, 'GCAL_AUTH_TOKEN_CACHE_SIZE', 1024)
+
+# Class: Claims of verified Firebase ID tokens, each kept until the token expires (exp), evicting the least recently used when full
+# The public certificates used to verify the tokens are already cached by the Firebase Admin SDK, following their Cache-Control max-age.
+class VerifiedTokenCache:
+    def __init__(self, max_entries):
+        self._cache = TLRUCache(maxsize=max_entries, ttu=lambda key, claims, now: claims['exp'], timer=time.time)
+        self._lock = threading.Lock()
+
+    def _key(self, id_token):
+        return hashlib.sha256(id_token.encode()).hexdigest()
+
+    def get(self, id_token):
+        with self._lock:
+            return self._cache.get(self._key(id_token))
+
+    def set(self, id_token, claims):
+        with self._lock:
+            self._cache[self._key(id_token)] = claims
+
+# Variable: Verified token cache shared by the process
+verified_token_cache = VerifiedTokenCache(TOKEN_CACHE_MAX_ENTRIES)
+
+# Class: Error raised when a Firebase ID token is not valid (or cannot be verified)
+class InvalidIdTokenError(Exception):
+    pass
+
+# Function: Verify a Firebase ID token, only checking the signature the first time the token is seen
+# Returns the claims of the token. Raises InvalidIdTokenError if the token is not valid.
+def verify_id_token(id_token):
+    start = time.perf_counter()
+    claims = verified_token_cache.get(id_token)
+    if claims is not None:
+        observe_timing(FIREBASE_VERIFY_SECONDS, 'firebase', time.perf_counter() - start, result='cached')
+        return claims
+
+    app = get_firebase_app()
+    from firebase_admin import auth
+
+    try:
+        claims = auth.verify_id_token(id_token, app=app)
+
+    except (ValueError, auth.InvalidIdTokenError, auth.CertificateFetchError) as error:
+        observe_timing(FIREBASE_VERIFY_SECONDS, 'firebase', time.perf_counter() - start, result='invalid')
+        raise InvalidIdTokenError(str(error)) from error
+
+    observe_timing(FIREBASE_VERIFY_SECONDS, 'firebase', time.perf_counter() - start, result='verified')
+    verified_token_cache.set(id_token, claims)
+    return claims
+
+# Function: Get the Firebase ID token from the Authorization header of a request ("Bearer <token>")
+# Returns None if there is no token
+def get_id_token(request):
+    auth_header = get_authorization_header(request).split()
+    if len(auth_header) != 2 or auth_header[0].lower() != b'bearer':
+        return None
+    return auth_header[1].decode()
+
+# Class: User signed in with Firebase, identified by the uid of their ID token
+class FirebaseUser:
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, claims):
+        self.uid = claims['uid']
+        self.claims = claims
+
+    def __str__(self):
+        return self.uid
+
+# Class: DRF authentication with a Firebase ID token in the Authorization header
+# request.user is a FirebaseUser and request.auth holds the claims of the token
+class FirebaseAuthentication(BaseAuthentication):
+    def authenticate(self, request):
+        id_token = get_id_token(request)
+        if id_token is None:
+            return None
+
+        try:
+            claims = verify_id_token(id_token)
+
+        except InvalidIdTokenError:
+            raise AuthenticationFailed('Invalid user ID token')
+
+        return FirebaseUser(claims), claims
+
+    def authenticate_header(self, request):
+        return 'Bearer'
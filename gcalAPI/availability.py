@@ -0,0 +1,329 @@
+import asyncio
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+
+from .events import (AFTERNOON_PART, EPOCH_ORDINAL, FULL_DAY_PART, MORNING_PART,
+                     get_sgt_day_number, parse_isoformat_string, to_compact_event, to_epoch_seconds)
+from .ledger import get_ledger_busy_periods, list_ledger_events, merge_ledger_events
+from .mirror import get_events
+from .utils import SGT_tz
+
+# Variable: Maximum number of bookings (resources) that can share the same slot
+MAX_RESOURCES = 4
+
+# Variable: Booking slots evaluated for each day
+# Half-day slots start at either 9AM or 2:30PM and last for 4 hours. Full-day slots start at 9AM and last for 9 hours.
+BOOKING_SLOTS = {
+    'morning': {'start_time': time(hour=9), 'duration': timedelta(hours=4)},
+    'afternoon': {'start_time': time(hour=14, minute=30), 'duration': timedelta(hours=4)},
+    'full_day': {'start_time': time(hour=9), 'duration': timedelta(hours=9)},
+}
+
+# Variable: Time the last morning of an x.5-day booking ends
+X_AND_HALF_DAYS_END_TIME = time(hour=12, minute=30)
+
+# Variable: Default number of days from today before the search window starts, and the number of days searched
+DEFAULT_LEAD_DAYS = 4
+DEFAULT_HORIZON_DAYS = 14
+
+# Variable: Calendars of the resources (crews), when each resource has its own calendar
+# If empty, capacity is counted from the events in a single calendar, up to MAX_RESOURCES bookings per slot
+RESOURCE_CALENDAR_IDS = getattr(settings, 'GCAL_RESOURCE_CALENDAR_IDS', [])
+
+# Variable: Maximum number of days that can be searched in one request
+MAX_HORIZON_DAYS = getattr(settings, 'GCAL_MAX_HORIZON_DAYS', 90)
+
+# Variable: Maximum number of days from today before the search window can start
+MAX_LEAD_DAYS = getattr(settings, 'GCAL_MAX_LEAD_DAYS', 365)
+
+# Function: Count the remaining capacity in the morning and afternoon of a full-day slot
+# Events shorter than 5 hours take up the morning or afternoon, longer events take up the whole day
+def count_full_day_capacity(event_details):
+    part_counts = [0, 0, 0, 0]
+    for existing_event in event_details:
+        part_counts[existing_event.part] += 1
+
+    full_day_count = part_counts[FULL_DAY_PART]
+    return MAX_RESOURCES - full_day_count - part_counts[MORNING_PART], MAX_RESOURCES - full_day_count - part_counts[AFTERNOON_PART]
+
+# Function: Get SGT start and end datetime of a booking slot on a given date
+def get_slot_period(start_date, booking_slot):
+    slot_start = SGT_tz.localize(datetime.combine(start_date, booking_slot['start_time']))
+    slot_end = slot_start + booking_slot['duration']
+    return slot_start, slot_end
+
+# Function: Get the search window (time_min, time_max) covering every slot from start_date for no_of_days days
+def get_search_window(start_date, no_of_days, booking_slots=BOOKING_SLOTS):
+    first_slot_periods = [get_slot_period(start_date, booking_slot) for booking_slot in booking_slots.values()]
+    last_slot_periods = [get_slot_period(start_date + timedelta(days=no_of_days - 1), booking_slot) for booking_slot in booking_slots.values()]
+    time_min = min(slot_start for slot_start, slot_end in first_slot_periods)
+    time_max = max(slot_end for slot_start, slot_end in last_slot_periods)
+    return time_min, time_max
+
+# Class: Availability of every slot in a window of days, evaluated in memory from a single events.list call
+class AvailabilityIndex:
+    def __init__(self, event_details, start_date, no_of_days, booking_slots=BOOKING_SLOTS):
+        self.start_date = start_date
+        self.no_of_days = no_of_days
+        self.booking_slots = booking_slots
+        self.start_day_number = start_date.toordinal() - EPOCH_ORDINAL
+
+        # Bucket the existing events by day and by slot, comparing times in seconds since the epoch
+        self.dates = [start_date + timedelta(days=day) for day in range(no_of_days)]
+        self.slot_periods = {}
+        for date in self.dates:
+            self.slot_periods[date] = {}
+            for slot_name, booking_slot in booking_slots.items():
+                slot_start, slot_end = get_slot_period(date, booking_slot)
+                self.slot_periods[date][slot_name] = (to_epoch_seconds(slot_start), to_epoch_seconds(slot_end))
+
+        self.buckets = self._create_buckets()
+        for existing_event in event_details:
+            self._add_to_buckets(self.buckets, existing_event.start, existing_event.end, existing_event)
+
+    # Function: Create an empty bucket for every slot of every day
+    def _create_buckets(self):
+        return {date: {slot_name: [] for slot_name in self.booking_slots} for date in self.slot_periods}
+
+    # Function: Add an item to the bucket of every slot overlapping the period from period_start to period_end
+    # period_start and period_end are in seconds since the epoch
+    def _add_to_buckets(self, buckets, period_start, period_end, item):
+        # Only the days the period spans (and the day before, for slots past midnight) can have an overlapping slot
+        first_day = max(get_sgt_day_number(period_start) - 1 - self.start_day_number, 0)
+        last_day = min(get_sgt_day_number(period_end) - self.start_day_number, self.no_of_days - 1)
+        for day in range(first_day, last_day + 1):
+            date = self.dates[day]
+            for slot_name, (slot_start, slot_end) in self.slot_periods[date].items():
+                if period_end > slot_start and period_start < slot_end:
+                    buckets[date][slot_name].append(item)
+
+    # Function: Stream all events in the window from one (paginated) call, or from the local mirror, into the index
+    @classmethod
+    def fetch(cls, service, calendar_id, start_date, no_of_days, booking_slots=BOOKING_SLOTS):
+        time_min, time_max = get_search_window(start_date, no_of_days, booking_slots)
+        event_details = get_booked_events(service, calendar_id, time_min.isoformat(), time_max.isoformat())
+        return cls(event_details, start_date, no_of_days, booking_slots)
+
+    # Function: Get the number of bookings a half-day slot can still take
+    def get_half_day_capacity(self, date, slot_name):
+        return MAX_RESOURCES - len(self.buckets[date][slot_name])
+
+    # Function: Get the number of bookings the morning and afternoon of a full-day slot can still take
+    def get_full_day_capacity(self, date, slot_name='full_day'):
+        return count_full_day_capacity(self.buckets[date][slot_name])
+
+    # Function: Check if half-day slot ('morning' or 'afternoon') is available on a given date
+    def is_half_day_slot_available(self, date, slot_name):
+        # Exclude all Sundays
+        if date.weekday() == 6:
+            return False
+
+        return self.get_half_day_capacity(date, slot_name) > 0
+
+    # Function: Check if full-day slot is available on a given date
+    def is_full_day_slot_available(self, date, slot_name='full_day'):
+        # Exclude all Sundays
+        if date.weekday() == 6:
+            return False
+
+        morning_capacity, afternoon_capacity = self.get_full_day_capacity(date, slot_name)
+        return morning_capacity > 0 and afternoon_capacity > 0
+
+    # Function: Check if the full-day slots of no_of_days consecutive days from first_date are available,
+    # followed by the morning half-day slot of the next day if ends_with_morning_slot
+    def are_consecutive_slots_available(self, first_date, no_of_days, ends_with_morning_slot=False):
+        are_full_day_slots_available = [self.is_full_day_slot_available(first_date + timedelta(days=day)) for day in range(no_of_days)]
+        if not all(are_full_day_slots_available):
+            return False
+
+        return not ends_with_morning_slot or self.is_half_day_slot_available(first_date + timedelta(days=no_of_days), 'morning')
+
+# Class: Availability of every slot when each resource (crew) has its own calendar, from a single freebusy.query call
+# A slot is available when at least one resource calendar has no busy period overlapping it.
+# A multi-day slot is booked in one resource calendar as one event, so one resource has to be free for all its days
+# and the nights in between (see AvailabilitySnapshot.find_free_resource_calendar_id).
+class FreeBusyIndex(AvailabilityIndex):
+    def __init__(self, busy_periods_by_calendar, start_date, no_of_days, booking_slots=BOOKING_SLOTS):
+        super().__init__([], start_date, no_of_days, booking_slots)
+        self.resource_calendar_ids = list(busy_periods_by_calendar)
+
+        # Periods from the end of the full-day slot of each day (but the last) to its start on the next day
+        self.overnight_periods = {}
+        if 'full_day' in booking_slots:
+            for date, next_date in zip(self.dates, self.dates[1:]):
+                self.overnight_periods[date] = (self.slot_periods[date]['full_day'][1], self.slot_periods[next_date]['full_day'][0])
+
+        # Resource calendars that are free during each slot, and overnight after each day
+        self.free_calendar_ids = self._create_buckets()
+        self.overnight_free_calendar_ids = {date: [] for date in self.overnight_periods}
+        for resource_calendar_id, busy_periods in busy_periods_by_calendar.items():
+            busy_buckets = self._create_buckets()
+            for busy_start, busy_end in busy_periods:
+                self._add_to_buckets(busy_buckets, busy_start, busy_end, (busy_start, busy_end))
+
+            for date, slot_busy_periods in busy_buckets.items():
+                for slot_name, busy_periods_in_slot in slot_busy_periods.items():
+                    if not busy_periods_in_slot:
+                        self.free_calendar_ids[date][slot_name].append(resource_calendar_id)
+
+            for date, (overnight_start, overnight_end) in self.overnight_periods.items():
+                if not any(busy_end > overnight_start and busy_start < overnight_end for busy_start, busy_end in busy_periods):
+                    self.overnight_free_calendar_ids[date].append(resource_calendar_id)
+
+    # Function: Query the busy periods of every resource calendar in the window with one call and build the index
+    @classmethod
+    def fetch(cls, service, resource_calendar_ids, start_date, no_of_days, booking_slots=BOOKING_SLOTS):
+        time_min, time_max = get_search_window(start_date, no_of_days, booking_slots)
+        busy_periods_by_calendar = query_busy_periods(service, resource_calendar_ids, time_min.isoformat(), time_max.isoformat())
+        return cls(busy_periods_by_calendar, start_date, no_of_days, booking_slots)
+
+    def get_half_day_capacity(self, date, slot_name):
+        return len(self.free_calendar_ids[date][slot_name])
+
+    def get_full_day_capacity(self, date, slot_name='full_day'):
+        free_resource_count = len(self.free_calendar_ids[date][slot_name])
+        return free_resource_count, free_resource_count
+
+    # Function: Check if one resource is free for the full-day slots of no_of_days consecutive days from first_date
+    # and the nights in between, followed by the night and the morning half-day slot of the next day if ends_with_morning_slot
+    def are_consecutive_slots_available(self, first_date, no_of_days, ends_with_morning_slot=False):
+        if not super().are_consecutive_slots_available(first_date, no_of_days, ends_with_morning_slot):
+            return False
+
+        free_calendar_ids = set(self.resource_calendar_ids)
+        for day in range(no_of_days):
+            date = first_date + timedelta(days=day)
+            free_calendar_ids.intersection_update(self.free_calendar_ids[date]['full_day'])
+            if day < no_of_days - 1 or ends_with_morning_slot:
+                free_calendar_ids.intersection_update(self.overnight_free_calendar_ids.get(date, []))
+
+        if ends_with_morning_slot:
+            free_calendar_ids.intersection_update(self.free_calendar_ids[first_date + timedelta(days=no_of_days)]['morning'])
+        return bool(free_calendar_ids)
+
+# Function: Iterate over the events between time_min and time_max, including the bookings holding capacity in the ledger
+def get_booked_events(service, calendar_id, time_min, time_max):
+    return merge_ledger_events(get_events(service, calendar_id, time_min, time_max), list_ledger_events(calendar_id, time_min, time_max))
+
+# Function: List the events between time_min and time_max, like get_booked_events, reading every page before returning
+def list_booked_events(service, calendar_id, time_min, time_max):
+    return list(get_booked_events(service, calendar_id, time_min, time_max))
+
+# Function: Get the busy periods of each resource calendar between time_min and time_max with one freebusy.query call
+# Busy periods are in seconds since the epoch
+# Calendars that return errors are treated as busy for the whole period
+def query_calendar_busy_periods(service, resource_calendar_ids, time_min, time_max):
+    response = service.freebusy().query(body={
+        'timeMin': time_min,
+        'timeMax': time_max,
+        'timeZone': 'Asia/Singapore',
+        'items': [{'id': resource_calendar_id} for resource_calendar_id in resource_calendar_ids],
+    }).execute()
+
+    busy_periods_by_calendar = {}
+    for resource_calendar_id in resource_calendar_ids:
+        calendar_busy = response.get('calendars', {}).get(resource_calendar_id, {})
+        if calendar_busy.get('errors'):
+            busy_periods_by_calendar[resource_calendar_id] = [(parse_isoformat_string(time_min)[0], parse_isoformat_string(time_max)[0])]
+        else:
+            busy_periods_by_calendar[resource_calendar_id] = [(parse_isoformat_string(busy_period['start'])[0], parse_isoformat_string(busy_period['end'])[0])
+                                                              for busy_period in calendar_busy.get('busy', [])]
+    return busy_periods_by_calendar
+
+# Function: Get the busy periods of each resource calendar between time_min and time_max, like query_calendar_busy_periods,
+# including the periods held by bookings in the ledger
+def query_busy_periods(service, resource_calendar_ids, time_min, time_max):
+    busy_periods_by_calendar = query_calendar_busy_periods(service, resource_calendar_ids, time_min, time_max)
+    for resource_calendar_id, ledger_busy_periods in get_ledger_busy_periods(resource_calendar_ids, time_min, time_max).items():
+        busy_periods_by_calendar[resource_calendar_id].extend(ledger_busy_periods)
+    return busy_periods_by_calendar
+
+# Function: Fetch the availability of every slot in the window
+# Uses freebusy.query over the resource calendars when GCAL_RESOURCE_CALENDAR_IDS is set, otherwise counts the events in calendar_id
+def fetch_availability_index(service, calendar_id, start_date, no_of_days, booking_slots=BOOKING_SLOTS):
+    if RESOURCE_CALENDAR_IDS:
+        return FreeBusyIndex.fetch(service, RESOURCE_CALENDAR_IDS, start_date, no_of_days, booking_slots)
+
+    return AvailabilityIndex.fetch(service, calendar_id, start_date, no_of_days, booking_slots)
+
+# Function: Fetch the availability of every slot in the window, like fetch_availability_index,
+# but split into chunks of chunk_days days that are fetched concurrently with run_upstream(func, *args)
+# (see async_views.run_upstream, which also keeps the database connections of its threads fresh)
+async def fetch_availability_index_async(service, calendar_id, start_date, no_of_days, run_upstream, chunk_days=7, booking_slots=BOOKING_SLOTS):
+    chunk_windows = [get_search_window(start_date + timedelta(days=day), min(chunk_days, no_of_days - day), booking_slots)
+                     for day in range(0, no_of_days, chunk_days)]
+    # Each chunk runs up to the start of the next one, so that the nights between chunks are fetched too
+    # (a multi-day slot needs its resource to be free overnight)
+    search_windows = [(time_min, next_time_min) for (time_min, _), (next_time_min, _) in zip(chunk_windows, chunk_windows[1:])] + chunk_windows[-1:]
+
+    if RESOURCE_CALENDAR_IDS:
+        chunk_busy_periods = await asyncio.gather(*[
+            run_upstream(query_busy_periods, service, RESOURCE_CALENDAR_IDS, time_min.isoformat(), time_max.isoformat())
+            for time_min, time_max in search_windows])
+        busy_periods_by_calendar = {resource_calendar_id: [busy_period for busy_periods in chunk_busy_periods for busy_period in busy_periods[resource_calendar_id]]
+                                    for resource_calendar_id in RESOURCE_CALENDAR_IDS}
+        return FreeBusyIndex(busy_periods_by_calendar, start_date, no_of_days, booking_slots)
+
+    chunk_event_details = await asyncio.gather(*[
+        run_upstream(list_booked_events, service, calendar_id, time_min.isoformat(), time_max.isoformat())
+        for time_min, time_max in search_windows])
+
+    # Events overlapping two chunks are returned for both, so only keep one copy of each
+    event_details = list({existing_event.id: existing_event for event_details in chunk_event_details for existing_event in event_details}.values())
+    return AvailabilityIndex(event_details, start_date, no_of_days, booking_slots)
+
+# Class: Events (or busy periods of the resource calendars) in a window, fetched with one call,
+# against which any number of slots in the window can be evaluated in memory
+class AvailabilitySnapshot:
+    def __init__(self, calendar_id, time_min, time_max, event_details, busy_periods_by_calendar=None):
+        self.calendar_id = calendar_id
+        self.time_min = time_min
+        self.time_max = time_max
+        self.event_details = list(event_details)
+        self.busy_periods_by_calendar = busy_periods_by_calendar
+
+    # Function: Fetch the events in Google Calendar between time_min and time_max, or the busy periods of the resource calendars
+    # when GCAL_RESOURCE_CALENDAR_IDS is set
+    # The bookings held in the ledger are not included, as they can change until the days are locked (see add_ledger_bookings)
+    @classmethod
+    def fetch(cls, service, calendar_id, time_min, time_max):
+        if RESOURCE_CALENDAR_IDS:
+            return cls(calendar_id, time_min, time_max, [], query_calendar_busy_periods(service, RESOURCE_CALENDAR_IDS, time_min, time_max))
+
+        return cls(calendar_id, time_min, time_max, get_events(service, calendar_id, time_min, time_max))
+
+    # Function: Add the bookings held in the ledger in the window of the snapshot
+    # Only reads the database, so that it can be called while the days of a booking are locked in the ledger
+    def add_ledger_bookings(self):
+        if self.busy_periods_by_calendar is not None:
+            for resource_calendar_id, ledger_busy_periods in get_ledger_busy_periods(RESOURCE_CALENDAR_IDS, self.time_min, self.time_max).items():
+                self.busy_periods_by_calendar[resource_calendar_id].extend(ledger_busy_periods)
+        else:
+            self.event_details = list(merge_ledger_events(self.event_details, list_ledger_events(self.calendar_id, self.time_min, self.time_max)))
+
+    # Function: Get the availability of every slot in no_of_days days from start_date, like fetch_availability_index
+    def get_availability_index(self, start_date, no_of_days, booking_slots=BOOKING_SLOTS):
+        if self.busy_periods_by_calendar is not None:
+            return FreeBusyIndex(self.busy_periods_by_calendar, start_date, no_of_days, booking_slots)
+
+        return AvailabilityIndex(self.event_details, start_date, no_of_days, booking_slots)
+
+    # Function: Find a resource calendar that is free for the whole period from start_time to end_time
+    # Returns None if every resource is busy
+    def find_free_resource_calendar_id(self, start_time, end_time):
+        period_start = parse_isoformat_string(start_time)[0]
+        period_end = parse_isoformat_string(end_time)[0]
+        for resource_calendar_id, busy_periods in self.busy_periods_by_calendar.items():
+            if not any(busy_end > period_start and busy_start < period_end for busy_start, busy_end in busy_periods):
+                return resource_calendar_id
+        return None
+
+    # Function: Add a booking from start_time to end_time (SGT ISOFormat strings), so that the capacity it takes up
+    # is seen by the slots evaluated after it
+    def add_booking(self, booking_calendar_id, start_time, end_time):
+        if self.busy_periods_by_calendar is not None:
+            self.busy_periods_by_calendar[booking_calendar_id].append((parse_isoformat_string(start_time)[0], parse_isoformat_string(end_time)[0]))
+        else:
+            self.event_details.append(to_compact_event({'id': 'snapshot-booking-%d' % len(self.event_details),
+                                                        'start': {'dateTime': start_time}, 'end': {'dateTime': end_time}}))
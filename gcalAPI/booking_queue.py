@@ -0,0 +1,110 @@
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from googleapiclient.errors import HttpError
+
+from .events import insert_booking_event
+from .ledger import confirm_booking, release_booking
+from .models import BookingTask
+
+# Variable: Whether book_slot only reserves the booking and queues its event, instead of inserting the event itself
+BOOKING_WRITE_BEHIND = getattr(settings, 'GCAL_BOOKING_WRITE_BEHIND', False)
+
+# Variable: Number of times the worker tries to insert the event of a booking before releasing it
+BOOKING_QUEUE_MAX_ATTEMPTS = getattr(settings, 'GCAL_BOOKING_QUEUE_MAX_ATTEMPTS', 8)
+
+# Variable: Delay (in seconds) before the first retry, doubled after every failed attempt
+BOOKING_QUEUE_RETRY_DELAY = getattr(settings, 'GCAL_BOOKING_QUEUE_RETRY_DELAY', 5)
+
+# Variable: Number of seconds a worker has to insert the events it claimed before other workers can claim them
+BOOKING_QUEUE_LEASE = 120
+
+# Function: Queue the insert of the event of a reserved booking
+# The ID of the event is the idempotency key of the task, so inserting it again after a timeout cannot create a second event
+def enqueue_booking(booking, event_request):
+    idempotency_key = uuid.uuid4().hex
+    return BookingTask.objects.create(booking=booking, calendar_id=booking.calendar_id,
+                                      event_request={**event_request, 'id': idempotency_key},
+                                      idempotency_key=idempotency_key, next_attempt=timezone.now())
+
+# Function: Claim up to batch_size tasks that are due, so that other workers skip them while their events are inserted
+def claim_tasks(batch_size):
+    now = timezone.now()
+
+    with transaction.atomic():
+        due_tasks = BookingTask.objects.filter(status=BookingTask.PENDING, next_attempt__lte=now).order_by('next_attempt')
+        if connection.features.has_select_for_update_skip_locked:
+            due_tasks = due_tasks.select_for_update(skip_locked=True)
+
+        tasks = list(due_tasks.select_related('booking')[:batch_size])
+        BookingTask.objects.filter(pk__in=[task.pk for task in tasks]).update(next_attempt=now + timedelta(seconds=BOOKING_QUEUE_LEASE))
+
+    return tasks
+
+# Function: Insert the event of a queued booking in Google Calendar, and confirm the booking in the ledger
+# Failed inserts are retried with exponential backoff. After BOOKING_QUEUE_MAX_ATTEMPTS attempts, the booking is released.
+# Returns True if the event was inserted
+def process_task(service, calendar_id, task):
+    try:
+        insert_booking_event(service, task.calendar_id, task.event_request)
+
+    except HttpError as error:
+        # 409: the event was inserted by an earlier attempt
+        if error.resp.status != 409:
+            return retry_task(calendar_id, task, error)
+
+    except Exception as error:
+        return retry_task(calendar_id, task, error)
+
+    with transaction.atomic():
+        confirm_booking(task.booking, task.idempotency_key)
+        task.status = BookingTask.DONE
+        task.attempts += 1
+        task.save(update_fields=['status', 'attempts'])
+
+    # The booking may have been updated while its event was being inserted
+    event_request = BookingTask.objects.values_list('event_request', flat=True).get(pk=task.pk)
+    if event_request != task.event_request:
+        try:
+            service.events().patch(calendarId=task.calendar_id, eventId=task.idempotency_key, body=event_request).execute()
+
+        except HttpError as error:
+            print('An error occurred: %s' % error)
+
+    return True
+
+# Function: Record a failed insert, and schedule the next attempt or release the booking
+# Returns False
+def retry_task(calendar_id, task, error):
+    task.attempts += 1
+    task.last_error = str(error)
+
+    with transaction.atomic():
+        if task.attempts >= BOOKING_QUEUE_MAX_ATTEMPTS:
+            task.status = BookingTask.FAILED
+            release_booking(calendar_id, task.booking)
+        else:
+            task.next_attempt = timezone.now() + timedelta(seconds=BOOKING_QUEUE_RETRY_DELAY * 2 ** (task.attempts - 1))
+        task.save(update_fields=['status', 'attempts', 'last_error', 'next_attempt'])
+
+    return False
+
+# Function: Insert the events of the queued bookings that are due
+# Returns the number of events inserted and the number of failed attempts
+def drain_booking_queue(service, calendar_id, batch_size=20):
+    inserted_count = 0
+    failed_count = 0
+
+    while True:
+        tasks = claim_tasks(batch_size)
+        if not tasks:
+            return inserted_count, failed_count
+
+        for task in tasks:
+            if process_task(service, calendar_id, task):
+                inserted_count += 1
+            else:
+                failed_count += 1
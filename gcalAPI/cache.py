@@ -0,0 +1,304 @@
+import asyncio
+import hashlib
+import json
+import threading
+import time
+import uuid
+
+from asgiref.sync import sync_to_async
+from cachetools import TTLCache
+from django.conf import settings
+from django.core.cache import caches
+
+from .utils import get_dates_between
+
+# Variable: Availability cache settings, see GCAL_AVAILABILITY_CACHE in settings.py
+CACHE_SETTINGS = {
+    'BACKEND': 'local',
+    'TTL': 60,
+    'MAX_ENTRIES': 1024,
+    'CACHE_ALIAS': 'default',
+    'LAST_KNOWN_TTL': 3600,
+    'SHARED_LOCK': False,
+    'SHARED_LOCK_TIMEOUT': 30,
+    'VERSION_TTL': 86400,
+    **getattr(settings, 'GCAL_AVAILABILITY_CACHE', {}),
+}
+
+# Function: Get a tag of a result, the same for equal results (e.g. to build the ETag of a response)
+def get_value_tag(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+# Class: Cache backend in local memory with a TTL, evicting the least recently used entries when full
+class LocalMemoryBackend:
+    def __init__(self, ttl, max_entries):
+        self._cache = TTLCache(maxsize=max_entries, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        with self._lock:
+            return {key: self._cache[key] for key in keys if key in self._cache}
+
+    def set_many(self, data):
+        with self._lock:
+            self._cache.update(data)
+
+    # Function: Set the keys that are not set yet, leaving the others as they are
+    def add_many(self, data):
+        with self._lock:
+            for key, value in data.items():
+                if key not in self._cache:
+                    self._cache[key] = value
+
+# Class: Cache backend using Django's cache framework, so that the cache can be shared across workers
+class DjangoCacheBackend:
+    def __init__(self, ttl, cache_alias):
+        self.ttl = ttl
+        self._cache = caches[cache_alias]
+
+    def get_many(self, keys):
+        return self._cache.get_many(keys)
+
+    def set_many(self, data):
+        self._cache.set_many(data, timeout=self.ttl)
+
+    # Function: Set the keys that are not set yet, leaving the others as they are (even if set by another worker)
+    def add_many(self, data):
+        for key, value in data.items():
+            self._cache.add(key, value, timeout=self.ttl)
+
+    # Function: Set a key only if it is not set yet, across every worker sharing the cache
+    # Returns True if the key was set
+    def add(self, key, value, timeout):
+        return self._cache.add(key, value, timeout=timeout)
+
+    def delete(self, key):
+        self._cache.delete(key)
+
+# Variable: Number of seconds between checks for the result of a computation running in another worker
+SHARED_LOCK_POLL_INTERVAL = 0.05
+
+# Class: Single-flight execution of a function per key, across the threads of the process
+# While the function runs for a key, other calls with the same key wait for it and share its result (or its exception).
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = {'done': threading.Event(), 'value': None, 'error': None}
+
+        if not is_leader:
+            call['done'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['value']
+
+        try:
+            call['value'] = func()
+            return call['value']
+
+        except Exception as error:
+            call['error'] = error
+            raise
+
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['done'].set()
+
+# Class: Single-flight execution of a coroutine function per key, across the coroutines of the event loop
+class AsyncSingleFlight:
+    def __init__(self):
+        self._tasks = {}
+
+    async def do(self, key, coroutine_function):
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(coroutine_function())
+            self._tasks[key] = task
+            task.add_done_callback(lambda done_task: self._tasks.pop(key) if self._tasks.get(key) is done_task else None)
+
+        # A client disconnecting only cancels its own wait, not the computation shared with the others
+        return await asyncio.shield(task)
+
+# Class: Cache of availability results, invalidated per calendar and day
+# Every entry records the version of each day it was computed from. Invalidating a day gives it a new version,
+# so only the entries covering that day stop matching. Every entry also records a tag of its value (see get_value_tag).
+# The versions are kept in version_backend (by default the same backend), whose TTL should be longer than the entries'.
+# The last known value of each entry is also kept in last_known_backend, whatever the versions of its days,
+# to be served when the value cannot be computed (e.g. while the Google Calendar API is unavailable).
+# Concurrent misses of the same entry are coalesced: only one of them computes the value, and the others get its result.
+# With shared_lock_timeout, the computation is also coalesced across workers, through a lock in the shared backend.
+class AvailabilityCache:
+    def __init__(self, backend, last_known_backend=None, key_prefix='availability', shared_lock_timeout=None, version_backend=None):
+        self.backend = backend
+        self.version_backend = version_backend if version_backend is not None else backend
+        self.last_known_backend = last_known_backend
+        self.key_prefix = key_prefix
+        self.shared_lock_timeout = shared_lock_timeout
+        self._single_flight = SingleFlight()
+        self._async_single_flight = AsyncSingleFlight()
+
+    def _version_key(self, calendar_id, date):
+        return '%s:version:%s:%s' % (self.key_prefix, calendar_id, date.isoformat())
+
+    def _entry_key(self, calendar_id, key_parts):
+        key_hash = hashlib.md5(repr(key_parts).encode()).hexdigest()
+        return '%s:%s:%s' % (self.key_prefix, calendar_id, key_hash)
+
+    def _last_known_key(self, entry_key):
+        return '%s:last_known:%s' % (self.key_prefix, entry_key)
+
+    def _lock_key(self, entry_key):
+        return '%s:lock:%s' % (self.key_prefix, entry_key)
+
+    # Function: Get the current version of each day
+    # A day without a version (never seen, expired or evicted) gets a new one, so older entries can never match it.
+    # New versions are only added if still missing and then read back, so concurrent misses agree on the versions
+    # (and share one computation).
+    def _get_versions(self, calendar_id, dates):
+        version_keys = [self._version_key(calendar_id, date) for date in dates]
+        versions = self.version_backend.get_many(version_keys)
+
+        new_versions = {version_key: uuid.uuid4().hex for version_key in version_keys if version_key not in versions}
+        if new_versions:
+            self.version_backend.add_many(new_versions)
+            versions.update(new_versions)
+            versions.update(self.version_backend.get_many(list(new_versions)))
+
+        return [versions[version_key] for version_key in version_keys]
+
+    # Function: Look up a cached entry computed from the given days
+    # Returns the current versions of the days, the entry key and the entry if it is still valid
+    def _get_entry(self, calendar_id, dates, key_parts):
+        versions = self._get_versions(calendar_id, dates)
+        entry_key = self._entry_key(calendar_id, key_parts)
+
+        return versions, entry_key, self._get_valid_entry(entry_key, versions)
+
+    # Function: Get a cached entry if it was computed from the given versions of its days
+    def _get_valid_entry(self, entry_key, versions):
+        entry = self.backend.get_many([entry_key]).get(entry_key)
+        if entry is not None and entry[0] != versions:
+            entry = None
+        return entry
+
+    # Function: Wait until the entry is computed by another worker, or take the lock on computing it
+    # Returns the entry if another worker computed it, or None once the lock is taken
+    def _wait_for_shared_lock(self, entry_key, versions):
+        lock_key = self._lock_key(entry_key)
+        while True:
+            # The lock expires after shared_lock_timeout seconds, in case the worker holding it dies
+            if self.backend.add(lock_key, uuid.uuid4().hex, self.shared_lock_timeout):
+                entry = self._get_valid_entry(entry_key, versions)
+                if entry is None:
+                    return None
+
+                # Computed just before the lock was taken
+                self.backend.delete(lock_key)
+                return entry
+
+            entry = self._get_valid_entry(entry_key, versions)
+            if entry is not None:
+                return entry
+
+            time.sleep(SHARED_LOCK_POLL_INTERVAL)
+
+    # Function: Compute an entry once across workers, or wait for the worker computing it
+    def _compute_entry(self, entry_key, versions, compute, serve_last_known):
+        if self.shared_lock_timeout is None:
+            return self._store_value(entry_key, versions, compute(), serve_last_known)
+
+        entry = self._wait_for_shared_lock(entry_key, versions)
+        if entry is not None:
+            return entry[1]
+
+        try:
+            return self._store_value(entry_key, versions, compute(), serve_last_known)
+        finally:
+            self.backend.delete(self._lock_key(entry_key))
+
+    # Function: Async version of _compute_entry
+    async def _acompute_entry(self, entry_key, versions, compute, serve_last_known):
+        if self.shared_lock_timeout is not None:
+            entry = await sync_to_async(self._wait_for_shared_lock, thread_sensitive=False)(entry_key, versions)
+            if entry is not None:
+                return entry[1]
+
+        try:
+            value = await compute()
+            return await sync_to_async(self._store_value, thread_sensitive=False)(entry_key, versions, value, serve_last_known)
+        finally:
+            if self.shared_lock_timeout is not None:
+                await sync_to_async(self.backend.delete, thread_sensitive=False)(self._lock_key(entry_key))
+
+    # Function: Store a computed value, or get the last known value if it could not be computed (None)
+    def _store_value(self, entry_key, versions, value, serve_last_known):
+        if value is not None:
+            self.backend.set_many({entry_key: (versions, value, get_value_tag(value))})
+            if serve_last_known and self.last_known_backend is not None:
+                self.last_known_backend.set_many({self._last_known_key(entry_key): value})
+
+        elif serve_last_known and self.last_known_backend is not None:
+            last_known_key = self._last_known_key(entry_key)
+            value = self.last_known_backend.get_many([last_known_key]).get(last_known_key)
+
+        return value
+
+    # Function: Get a cached result computed from the given days, or compute and cache it
+    # Results of None (e.g. when the Google Calendar API returns an error) are not cached.
+    # With serve_last_known, the last known result is returned instead of None, however old it is (up to LAST_KNOWN_TTL):
+    # only use it for results that are displayed, never to check a booking.
+    def get_or_compute(self, calendar_id, dates, key_parts, compute, serve_last_known=False):
+        versions, entry_key, entry = self._get_entry(calendar_id, dates, key_parts)
+        if entry is not None:
+            return entry[1]
+
+        return self._single_flight.do((entry_key, tuple(versions)),
+                                      lambda: self._compute_entry(entry_key, versions, compute, serve_last_known))
+
+    # Function: Async version of get_or_compute, where compute is a coroutine function
+    async def aget_or_compute(self, calendar_id, dates, key_parts, compute, serve_last_known=False):
+        versions, entry_key, entry = await sync_to_async(self._get_entry, thread_sensitive=False)(calendar_id, dates, key_parts)
+        if entry is not None:
+            return entry[1]
+
+        return await self._async_single_flight.do((entry_key, tuple(versions)),
+                                                  lambda: self._acompute_entry(entry_key, versions, compute, serve_last_known))
+
+    # Function: Get the tag of a cached result computed from the given days, without computing the result
+    # Returns None if the result is not cached (or no longer valid)
+    def get_cached_tag(self, calendar_id, dates, key_parts):
+        versions, entry_key, entry = self._get_entry(calendar_id, dates, key_parts)
+        return entry[2] if entry is not None else None
+
+    # Function: Invalidate every cached result computed from the given days
+    def invalidate_days(self, calendar_id, dates):
+        self.version_backend.set_many({self._version_key(calendar_id, date): uuid.uuid4().hex for date in dates})
+
+    # Function: Invalidate every cached result computed from the days between two SGT ISOFormat strings
+    def invalidate_period(self, calendar_id, start_time, end_time):
+        self.invalidate_days(calendar_id, get_dates_between(start_time, end_time))
+
+# Function: Create the availability cache with the backend chosen in settings
+def create_availability_cache():
+    if CACHE_SETTINGS['BACKEND'] == 'django':
+        backend = DjangoCacheBackend(CACHE_SETTINGS['TTL'], CACHE_SETTINGS['CACHE_ALIAS'])
+        last_known_backend = DjangoCacheBackend(CACHE_SETTINGS['LAST_KNOWN_TTL'], CACHE_SETTINGS['CACHE_ALIAS'])
+        version_backend = DjangoCacheBackend(CACHE_SETTINGS['VERSION_TTL'], CACHE_SETTINGS['CACHE_ALIAS'])
+        if CACHE_SETTINGS['SHARED_LOCK']:
+            return AvailabilityCache(backend, last_known_backend, shared_lock_timeout=CACHE_SETTINGS['SHARED_LOCK_TIMEOUT'],
+                                     version_backend=version_backend)
+    else:
+        backend = LocalMemoryBackend(CACHE_SETTINGS['TTL'], CACHE_SETTINGS['MAX_ENTRIES'])
+        last_known_backend = LocalMemoryBackend(CACHE_SETTINGS['LAST_KNOWN_TTL'], CACHE_SETTINGS['MAX_ENTRIES'])
+        version_backend = LocalMemoryBackend(CACHE_SETTINGS['VERSION_TTL'], CACHE_SETTINGS['MAX_ENTRIES'])
+    return AvailabilityCache(backend, last_known_backend, version_backend=version_backend)
+
+# Variable: Availability cache shared by the process
+availability_cache = create_availability_cache()
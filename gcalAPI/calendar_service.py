@@ -0,0 +1,116 @@
+import os.path
+import threading
+from datetime import datetime, timedelta
+
+from .metrics import SERVICE_INIT_SECONDS, time_block
+from .transport import create_authorized_http, get_http_session
+from .upstream import get_guarded_request_class
+
+# The Google API client libraries are only imported when they are first used, to keep cold starts fast
+
+SCOPES = ['https://www.googleapis.com/auth/calendar']
+
+# Variable: Define calendar_id
+calendar_id = "" # Removed: calendar ID
+
+# Class: Google Calendar API service that is built once and shared by every request in the process
+# Credentials are kept in memory and refreshed before they expire. Every thread sends its requests through
+# one transport with a pool of keep-alive connections (see transport.py), so they do not pay a TLS handshake each.
+class CalendarServiceProvider:
+    def __init__(self, token_file='token.json', client_secrets_file='credentials.json', refresh_margin=timedelta(minutes=5)):
+        self.token_file = token_file
+        self.client_secrets_file = client_secrets_file
+        self.refresh_margin = refresh_margin
+
+        self._credentials = None
+        self._service = None
+        self._lock = threading.Lock()
+        self._http = None
+
+    # Function: Load credentials from token.json the first time, or let the user log in
+    def _load_credentials(self):
+        from google.oauth2.credentials import Credentials
+        from google_auth_oauthlib.flow import InstalledAppFlow
+
+        creds = None
+        # The file token.json stores the user's access and refresh tokens, and is
+        # created automatically when the authorization flow completes for the first time.
+        if os.path.exists(self.token_file):
+            creds = Credentials.from_authorized_user_file(self.token_file, SCOPES)
+
+        # If there are no (valid) credentials available, let the user log in.
+        if not creds or (not creds.valid and not creds.refresh_token):
+            flow = InstalledAppFlow.from_client_secrets_file(self.client_secrets_file, SCOPES)
+            creds = flow.run_local_server(port=0)
+            self._save_credentials(creds)
+
+        return creds
+
+    # Function: Save the credentials for the next run of the process
+    def _save_credentials(self, creds):
+        with open(self.token_file, 'w') as token:
+            token.write(creds.to_json())
+
+    # Function: Check if the credentials are invalid or will expire within the refresh margin
+    def _needs_refresh(self, creds):
+        if not creds.valid:
+            return True
+        return creds.expiry is not None and creds.expiry - self.refresh_margin <= datetime.utcnow()
+
+    # Function: Get the in-memory credentials, refreshing them proactively
+    # Only one thread refreshes at a time; the others wait for it and reuse the new token.
+    def get_credentials(self):
+        creds = self._credentials
+        if creds is not None and not self._needs_refresh(creds):
+            return creds
+
+        with self._lock:
+            if self._credentials is None:
+                self._credentials = self._load_credentials()
+
+            if self._needs_refresh(self._credentials):
+                from google.auth.transport.requests import Request
+
+                self._credentials.refresh(Request(get_http_session()))
+                self._save_credentials(self._credentials)
+
+            return self._credentials
+
+    # Function: Get the HTTP transport shared by every thread
+    def _get_http(self):
+        if self._http is None:
+            credentials = self.get_credentials()
+            with self._lock:
+                if self._http is None:
+                    self._http = create_authorized_http(credentials)
+        return self._http
+
+    # Function: Build every API request on the shared HTTP transport with fresh credentials
+    # The requests execute through the upstream guard (rate limiter, retries and circuit breaker)
+    def _build_request(self, http, *args, **kwargs):
+        self.get_credentials()
+        return get_guarded_request_class()(self._get_http(), *args, **kwargs)
+
+    # Function: Get the shared service, building it from the static discovery document on first use
+    def get_service(self):
+        if self._service is None:
+            with self._lock:
+                if self._service is None:
+                    with time_block(SERVICE_INIT_SECONDS, 'service_init'):
+                        import httplib2
+                        from googleapiclient.discovery import build
+
+                        self._service = build('calendar', 'v3', http=httplib2.Http(), requestBuilder=self._build_request,
+                                              static_discovery=True, cache_discovery=False)
+                    print('service created successfully')
+        return self._service
+
+    # Function: Use another service instead of building one (e.g. the fake service in fake_calendar.py for benchmarks)
+    # Returns the service used before
+    def set_service(self, service):
+        with self._lock:
+            previous_service, self._service = self._service, service
+        return previous_service
+
+# Variable: Service provider shared by the process
+calendar_service_provider = CalendarServiceProvider()
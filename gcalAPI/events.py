@@ -0,0 +1,205 @@
+import uuid
+from datetime import date, datetime, timezone
+from functools import lru_cache
+
+from django.conf import settings
+
+from .upstream import calendar_upstream
+
+# Variable: Number of events requested per page of events.list (the Google Calendar API allows up to 2500)
+EVENTS_PAGE_SIZE = getattr(settings, 'GCAL_EVENTS_PAGE_SIZE', 2500)
+
+# Variable: Maximum number of requests in one batch request (the Google Calendar API allows up to 50)
+BATCH_SIZE = 50
+
+# Variable: Fields of each event needed to evaluate availability
+EVENT_TIME_FIELDS = 'id,start(date,dateTime),end(date,dateTime)'
+
+# Variable: Key of the booking ID in the private extended properties of the event of a booking
+BOOKING_ID_PROPERTY = 'bookingId'
+
+# Variable: Offset of SGT from UTC in seconds (Singapore has no daylight saving time, so it is fixed)
+SGT_OFFSET = 8 * 60 * 60
+
+SECONDS_PER_DAY = 24 * 60 * 60
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# Variable: Number of distinct time strings whose parsed values are kept
+PARSED_TIME_CACHE_SIZE = 8192
+
+# Variable: Part of a full-day slot an event takes up
+NO_PART, MORNING_PART, AFTERNOON_PART, FULL_DAY_PART = range(4)
+
+SHORT_EVENT_DURATION = 5 * 60 * 60
+MORNING_END_TIME = 14 * 60 * 60
+
+# Class: Event with only what is needed to evaluate availability
+# start and end are in seconds since the epoch, and part is the part of a full-day slot it takes up
+class CompactEvent:
+    __slots__ = ('id', 'start', 'end', 'part')
+
+    def __init__(self, id, start, end, part):
+        self.id = id
+        self.start = start
+        self.end = end
+        self.part = part
+
+    def __repr__(self):
+        return 'CompactEvent(%r, %r, %r, %r)' % (self.id, self.start, self.end, self.part)
+
+# Function: Convert a date string returned from Google Calendar to seconds since the epoch at SGT midnight
+@lru_cache(maxsize=PARSED_TIME_CACHE_SIZE)
+def parse_date_string(date_string):
+    return (date.fromisoformat(date_string).toordinal() - EPOCH_ORDINAL) * SECONDS_PER_DAY - SGT_OFFSET
+
+# Function: Convert an ISOFormat string returned from Google Calendar to seconds since the epoch
+# Returns the actual time, and the time read as if the string were in UTC
+@lru_cache(maxsize=PARSED_TIME_CACHE_SIZE)
+def parse_isoformat_string(isoformat_string):
+    parsed = datetime.fromisoformat(isoformat_string)
+    utc_reading = ((parsed.toordinal() - EPOCH_ORDINAL) * SECONDS_PER_DAY
+                   + parsed.hour * 3600 + parsed.minute * 60 + parsed.second)
+    utc_offset = parsed.utcoffset()
+    return utc_reading - (utc_offset.days * SECONDS_PER_DAY + utc_offset.seconds if utc_offset else 0), utc_reading
+
+# Function: Get the part of a full-day slot an event takes up, from its start and end read as UTC
+# Events shorter than 5 hours take up the morning if they end before 2PM (SGT) or the afternoon if they end after 2PM,
+# longer events take up the whole day
+def get_event_part(utc_reading_start, utc_reading_end):
+    duration = utc_reading_end - utc_reading_start
+
+    if duration < SHORT_EVENT_DURATION:
+        end_time = (utc_reading_end + SGT_OFFSET) % SECONDS_PER_DAY
+        if end_time < MORNING_END_TIME:
+            return MORNING_PART
+        elif end_time > MORNING_END_TIME:
+            return AFTERNOON_PART
+    elif duration > SHORT_EVENT_DURATION:
+        return FULL_DAY_PART
+
+    return NO_PART
+
+# Function: Iterate over the pages of an events.list call, only requesting the next page when it is needed
+# Each page only contains the given fields of its events
+def iter_event_pages(service, item_fields, **list_parameters):
+    page_token = None
+
+    while True:
+        response = service.events().list(maxResults=EVENTS_PAGE_SIZE, pageToken=page_token,
+                                         fields='nextPageToken,nextSyncToken,items(%s)' % item_fields,
+                                         **list_parameters).execute()
+        yield response
+
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return
+
+# Function: Iterate over every event between time_min and time_max, with only the given fields
+def iter_events(service, calendar_id, time_min, time_max, item_fields=EVENT_TIME_FIELDS):
+    for response in iter_event_pages(service, item_fields, calendarId=calendar_id, timeMin=time_min, timeMax=time_max, singleEvents=True):
+        yield from response.get('items', [])
+
+# Function: Iterate over every event between time_min and time_max as compact events
+def iter_compact_events(service, calendar_id, time_min, time_max):
+    for existing_event in iter_events(service, calendar_id, time_min, time_max):
+        yield to_compact_event(existing_event)
+
+# Function: Add the event of a booking to Google Calendar and notify the attendees
+def insert_booking_event(service, booking_calendar_id, event_request):
+    send_notifications = True
+    send_updates = 'all'    
+    created_event = service.events().insert(
+        calendarId=booking_calendar_id,
+        sendNotifications=send_notifications,
+        sendUpdates=send_updates,
+        body=event_request
+    ).execute()
+
+    return created_event
+
+# Function: Tag the event of a booking with the booking ID, so that it can be found with a privateExtendedProperty query
+def tag_booking_event(event_request, booking_id):
+    return {**event_request, 'extendedProperties': {'private': {BOOKING_ID_PROPERTY: str(booking_id)}}}
+
+# Function: Find the ID of the event of a booking with a privateExtendedProperty query
+# Returns None if there is no such event
+def find_booking_event_id(service, calendar_id, booking_id):
+    response = service.events().list(calendarId=calendar_id, privateExtendedProperty='%s=%s' % (BOOKING_ID_PROPERTY, booking_id),
+                                     maxResults=1, fields='items(id)').execute()
+    items = response.get('items', [])
+    return items[0]['id'] if items else None
+
+# Function: Send requests to the Google Calendar API in batch requests of up to BATCH_SIZE requests each
+# Stops at the first batch request that cannot be sent. Each batch request counts for all its requests in the rate limiter,
+# and is only retried when the quota was exceeded, as it may contain inserts.
+# Returns the response to each request, with None in place of the requests that failed or were not sent, and the errors
+def execute_batch(service, requests):
+    responses = [None] * len(requests)
+    errors = []
+
+    def callback(request_id, response, exception):
+        if exception is not None:
+            errors.append(exception)
+        else:
+            responses[int(request_id)] = response
+
+    for batch_start in range(0, len(requests), BATCH_SIZE):
+        batch_end = min(batch_start + BATCH_SIZE, len(requests))
+        batch = service.new_batch_http_request(callback=callback)
+        for index in range(batch_start, batch_end):
+            batch.add(requests[index], request_id=str(index))
+
+        try:
+            calendar_upstream.call(batch.execute, cost=batch_end - batch_start, idempotent=False, method='batch')
+
+        except Exception as error:
+            errors.append(error)
+            break
+
+    return responses, errors
+
+# Function: Add the events of several bookings to Google Calendar with batch requests and notify the attendees,
+# all or none of them
+# booking_events is a list of (booking_calendar_id, event_request). If any event cannot be added,
+# the events that were added are deleted again and the error is raised.
+# Returns the created events
+def insert_booking_events(service, booking_events):
+    # Every event gets its ID here, so that the events can be deleted even if the responses to their inserts are lost
+    booking_events = [(booking_calendar_id, {'id': uuid.uuid4().hex, **event_request}) for booking_calendar_id, event_request in booking_events]
+
+    created_events, errors = execute_batch(service, [
+        service.events().insert(calendarId=booking_calendar_id, sendNotifications=True, sendUpdates='all', body=event_request)
+        for booking_calendar_id, event_request in booking_events])
+
+    if errors:
+        execute_batch(service, [
+            service.events().delete(calendarId=booking_calendar_id, eventId=event_request['id'], sendUpdates='all')
+            for booking_calendar_id, event_request in booking_events])
+        raise errors[0]
+
+    return created_events
+
+# Function: Convert an event returned from Google Calendar to a compact event
+# All-day events occupy the whole day in SGT
+def to_compact_event(existing_event):
+    event_start, event_end = existing_event['start'], existing_event['end']
+
+    if 'date' in event_start:
+        return CompactEvent(existing_event['id'], parse_date_string(event_start['date']), parse_date_string(event_end['date']), FULL_DAY_PART)
+
+    start, utc_reading_start = parse_isoformat_string(event_start['dateTime'])
+    end, utc_reading_end = parse_isoformat_string(event_end['dateTime'])
+    return CompactEvent(existing_event['id'], start, end, get_event_part(utc_reading_start, utc_reading_end))
+
+# Function: Get the period a compact event occupies as UTC datetimes
+def get_event_period(compact_event):
+    return (datetime.fromtimestamp(compact_event.start, tz=timezone.utc),
+            datetime.fromtimestamp(compact_event.end, tz=timezone.utc))
+
+# Function: Convert a datetime to seconds since the epoch
+def to_epoch_seconds(datetime_object):
+    return int(datetime_object.timestamp())
+
+# Function: Get the number of the SGT day (counted from the epoch) a time in seconds since the epoch falls on
+def get_sgt_day_number(epoch_seconds):
+    return (epoch_seconds + SGT_OFFSET) // SECONDS_PER_DAY
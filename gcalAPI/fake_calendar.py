@@ -0,0 +1,268 @@
+import copy
+import json
+import random
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from .events import parse_date_string, parse_isoformat_string
+from .utils import SGT_tz
+
+# Variable: Number of events returned per page of events.list when maxResults is not given (the default of the Google Calendar API)
+DEFAULT_PAGE_SIZE = 250
+
+# Function: Create the error the Google Calendar API returns with an HTTP status
+def make_http_error(status, message):
+    content = json.dumps({'error': {'code': status, 'message': message, 'errors': [{'message': message}]}}).encode()
+    return HttpError(httplib2.Response({'status': status}), content)
+
+# Function: Get the period of an event in seconds since the epoch, all-day events covering whole days in SGT
+def get_fake_event_period(existing_event):
+    if 'date' in existing_event['start']:
+        return parse_date_string(existing_event['start']['date']), parse_date_string(existing_event['end']['date'])
+    return parse_isoformat_string(existing_event['start']['dateTime'])[0], parse_isoformat_string(existing_event['end']['dateTime'])[0]
+
+# Class: Request to the fake service, executed like a googleapiclient HttpRequest
+class FakeRequest:
+    def __init__(self, service, method_id, run):
+        self.service = service
+        self.methodId = method_id
+        self._run = run
+
+    def execute(self, http=None, num_retries=0):
+        self.service.send_request()
+        return self.service.record_call(self.methodId, self._run)
+
+# Class: Batch request to the fake service, sending every request with one round trip
+class FakeBatchHttpRequest:
+    def __init__(self, service, callback=None):
+        self.service = service
+        self.callback = callback
+        self._requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        self._requests.append((request_id or str(len(self._requests)), request, callback or self.callback))
+
+    def execute(self, http=None):
+        self.service.send_request()
+        self.service.call_counts['batch'] += 1
+
+        for request_id, request, callback in self._requests:
+            try:
+                response, exception = self.service.record_call(request.methodId, request._run), None
+
+            except HttpError as error:
+                response, exception = None, error
+
+            if callback is not None:
+                callback(request_id, response, exception)
+
+# Class: events() resource of the fake service
+class FakeEventsResource:
+    def __init__(self, service):
+        self.service = service
+
+    def list(self, calendarId, timeMin=None, timeMax=None, singleEvents=None, maxResults=None, pageToken=None,
+             syncToken=None, privateExtendedProperty=None, showDeleted=False, fields=None, **kwargs):
+        def run():
+            calendar_events = self.service.get_calendar(calendarId)
+            if syncToken is not None:
+                if not syncToken.isdigit() or int(syncToken) > self.service.sequence:
+                    raise make_http_error(410, 'Sync token is no longer valid, a full sync is required.')
+                matched_events = [existing_event for existing_event in calendar_events.values() if existing_event['_sequence'] > int(syncToken)]
+            else:
+                matched_events = [existing_event for existing_event in calendar_events.values()
+                                  if showDeleted or existing_event.get('status') != 'cancelled']
+
+            if timeMin is not None or timeMax is not None:
+                window_start = parse_isoformat_string(timeMin)[0] if timeMin else float('-inf')
+                window_end = parse_isoformat_string(timeMax)[0] if timeMax else float('inf')
+                matched_events = [existing_event for existing_event in matched_events
+                                  if get_fake_event_period(existing_event)[1] > window_start and get_fake_event_period(existing_event)[0] < window_end]
+
+            if privateExtendedProperty is not None:
+                key, value = privateExtendedProperty.split('=', 1)
+                matched_events = [existing_event for existing_event in matched_events
+                                  if existing_event.get('extendedProperties', {}).get('private', {}).get(key) == value]
+
+            page_size = maxResults or DEFAULT_PAGE_SIZE
+            page_start = int(pageToken or 0)
+            page = matched_events[page_start:page_start + page_size]
+
+            response = {'items': [self.service.export_event(existing_event) for existing_event in page]}
+            if page_start + page_size < len(matched_events):
+                response['nextPageToken'] = str(page_start + page_size)
+            else:
+                response['nextSyncToken'] = str(self.service.sequence)
+            return response
+
+        return FakeRequest(self.service, 'calendar.events.list', run)
+
+    def get(self, calendarId, eventId, **kwargs):
+        def run():
+            return self.service.export_event(self.service.get_event(calendarId, eventId))
+
+        return FakeRequest(self.service, 'calendar.events.get', run)
+
+    def insert(self, calendarId, body, **kwargs):
+        def run():
+            calendar_events = self.service.get_calendar(calendarId)
+            event_id = body.get('id') or uuid.uuid4().hex
+            if event_id in calendar_events:
+                raise make_http_error(409, 'The requested identifier already exists.')
+            return self.service.save_event(calendarId, {'status': 'confirmed', **copy.deepcopy(body), 'id': event_id})
+
+        return FakeRequest(self.service, 'calendar.events.insert', run)
+
+    def update(self, calendarId, eventId, body, **kwargs):
+        def run():
+            self.service.get_event(calendarId, eventId)
+            return self.service.save_event(calendarId, {'status': 'confirmed', **copy.deepcopy(body), 'id': eventId})
+
+        return FakeRequest(self.service, 'calendar.events.update', run)
+
+    def patch(self, calendarId, eventId, body, **kwargs):
+        def run():
+            existing_event = self.service.get_event(calendarId, eventId)
+            return self.service.save_event(calendarId, {**existing_event, **copy.deepcopy(body), 'id': eventId})
+
+        return FakeRequest(self.service, 'calendar.events.patch', run)
+
+    def delete(self, calendarId, eventId, **kwargs):
+        def run():
+            existing_event = self.service.get_event(calendarId, eventId)
+            self.service.save_event(calendarId, {**existing_event, 'status': 'cancelled'})
+            return ''
+
+        return FakeRequest(self.service, 'calendar.events.delete', run)
+
+# Class: freebusy() resource of the fake service
+class FakeFreeBusyResource:
+    def __init__(self, service):
+        self.service = service
+
+    def query(self, body, **kwargs):
+        def run():
+            window_start = parse_isoformat_string(body['timeMin'])[0]
+            window_end = parse_isoformat_string(body['timeMax'])[0]
+
+            calendars = {}
+            for item in body.get('items', []):
+                if item['id'] not in self.service.calendars:
+                    calendars[item['id']] = {'errors': [{'domain': 'global', 'reason': 'notFound'}], 'busy': []}
+                    continue
+
+                busy_periods = sorted(get_fake_event_period(existing_event) for existing_event in self.service.calendars[item['id']].values()
+                                      if existing_event.get('status') != 'cancelled' and existing_event.get('transparency') != 'transparent')
+                calendars[item['id']] = {'busy': [{'start': datetime.fromtimestamp(max(start, window_start), tz=SGT_tz).isoformat(),
+                                                   'end': datetime.fromtimestamp(min(end, window_end), tz=SGT_tz).isoformat()}
+                                                  for start, end in busy_periods if end > window_start and start < window_end]}
+
+            return {'kind': 'calendar#freeBusy', 'timeMin': body['timeMin'], 'timeMax': body['timeMax'], 'calendars': calendars}
+
+        return FakeRequest(self.service, 'calendar.freebusy.query', run)
+
+# Class: In-process stand-in for the Google Calendar API service, for benchmarks and local development
+# Implements events().list/get/insert/update/patch/delete (with paging, sync tokens and privateExtendedProperty queries),
+# freebusy().query and batch requests. Every request (or batch request) waits latency seconds, and is counted in
+# request_count. call_counts counts the calls of each method, including the calls in batch requests.
+class FakeCalendarService:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calendars = {}
+        self.request_count = 0
+        self.call_counts = Counter()
+        self.sequence = 0
+
+    def events(self):
+        return FakeEventsResource(self)
+
+    def freebusy(self):
+        return FakeFreeBusyResource(self)
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatchHttpRequest(self, callback)
+
+    # Function: Add events to a calendar, e.g. fixtures from generate_fake_events
+    def load_events(self, calendar_id, fixture_events):
+        self.calendars.setdefault(calendar_id, {})
+        for fixture_event in fixture_events:
+            self.save_event(calendar_id, copy.deepcopy(fixture_event))
+
+    # Function: Reset the request counts, e.g. before measuring an endpoint
+    def reset_counts(self):
+        self.request_count = 0
+        self.call_counts.clear()
+
+    # Function: Count a round trip to the API, and wait for the configured latency
+    def send_request(self):
+        self.request_count += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def record_call(self, method_id, run):
+        self.call_counts[method_id] += 1
+        return run()
+
+    def get_calendar(self, calendar_id):
+        if calendar_id not in self.calendars:
+            raise make_http_error(404, 'Not Found')
+        return self.calendars[calendar_id]
+
+    def get_event(self, calendar_id, event_id):
+        existing_event = self.get_calendar(calendar_id).get(event_id)
+        if existing_event is None:
+            raise make_http_error(404, 'Not Found')
+        return existing_event
+
+    def save_event(self, calendar_id, existing_event):
+        self.sequence += 1
+        existing_event['_sequence'] = self.sequence
+        existing_event['updated'] = datetime.utcnow().isoformat() + 'Z'
+        self.calendars.setdefault(calendar_id, {})[existing_event['id']] = existing_event
+        return self.export_event(existing_event)
+
+    def export_event(self, existing_event):
+        return {key: copy.deepcopy(value) for key, value in existing_event.items() if key != '_sequence'}
+
+# Variable: Kinds of fixture events, with their start time and duration in hours (SGT), and their weight
+FAKE_EVENT_KINDS = [
+    ('morning', 9, 4, 4),
+    ('afternoon', 14.5, 4, 4),
+    ('full_day', 9, 9, 3),
+    ('short', 10, 1, 1),
+    ('all_day', None, None, 1),
+]
+
+# Function: Generate seeded fixture events over no_of_days days from start_date, events_per_day on average
+# A mix of morning, afternoon, full-day, short and all-day events, as they appear in the booking calendar
+def generate_fake_events(seed, start_date, no_of_days, events_per_day):
+    rnd = random.Random(seed)
+    kinds = [kind for kind in FAKE_EVENT_KINDS for weight in range(kind[3])]
+
+    fixture_events = []
+    for day in range(no_of_days):
+        event_date = start_date + timedelta(days=day)
+        event_count = int(events_per_day) + (1 if rnd.random() < events_per_day % 1 else 0)
+
+        for index in range(event_count):
+            kind_name, start_hour, duration, weight = rnd.choice(kinds)
+            event_id = 'fixture%d' % len(fixture_events)
+
+            if kind_name == 'all_day':
+                fixture_events.append({'id': event_id, 'summary': 'All-day event',
+                                       'start': {'date': event_date.isoformat()},
+                                       'end': {'date': (event_date + timedelta(days=1)).isoformat()}})
+                continue
+
+            event_start = SGT_tz.localize(datetime.combine(event_date, datetime.min.time())) + timedelta(hours=start_hour)
+            event_end = event_start + timedelta(hours=duration)
+            fixture_events.append({'id': event_id, 'summary': '[confirmed] Fixture: %s' % kind_name,
+                                   'start': {'dateTime': event_start.isoformat(), 'timeZone': 'Asia/Singapore'},
+                                   'end': {'dateTime': event_end.isoformat(), 'timeZone': 'Asia/Singapore'}})
+
+    return fixture_events
@@ -0,0 +1,31 @@
+import threading
+
+from django.conf import settings
+
+from .transport import TRANSPORT_SETTINGS, create_certificate_request
+
+# Variable: Service account key of the Firebase project
+FIREBASE_CREDENTIALS_FILE = getattr(settings, 'GCAL_FIREBASE_CREDENTIALS_FILE', 'service-account-private-key.json') # Removed: service-account-private-key.json
+
+_firebase_app = None
+_firebase_app_lock = threading.Lock()
+
+# Function: Get the Firebase app, initialising the Firebase Admin SDK on first use
+# firebase_admin is only imported here, so that processes serving endpoints without Firebase never load it
+def get_firebase_app():
+    global _firebase_app
+
+    if _firebase_app is None:
+        with _firebase_app_lock:
+            if _firebase_app is None:
+                import firebase_admin
+                from firebase_admin import auth, credentials
+
+                firebase_app = firebase_admin.initialize_app(credentials.Certificate(FIREBASE_CREDENTIALS_FILE))
+
+                # firebase_admin has no option for the HTTP session fetching the public keys of ID tokens,
+                # so its token verifier is given one with the connection pools of transport.py
+                auth._get_client(firebase_app)._token_verifier.request = create_certificate_request(
+                    firebase_app.options.get('httpTimeout', TRANSPORT_SETTINGS['TIMEOUT']))
+                _firebase_app = firebase_app
+    return _firebase_app
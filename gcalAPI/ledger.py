@@ -0,0 +1,132 @@
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+
+from .events import to_epoch_seconds
+from .models import Booking, BookingDay, BookingTask
+from .utils import get_dates_between
+
+# Variable: Number of seconds a booking holds capacity in the ledger after it is reserved or confirmed
+# It has to be longer than it takes for a new event to show up in the mirror (GCAL_MIRROR_MAX_AGE)
+# and the availability cache (GCAL_AVAILABILITY_CACHE['TTL'])
+LEDGER_HOLD_SECONDS = getattr(settings, 'GCAL_LEDGER_HOLD_SECONDS', 300)
+
+# Function: Lock the ledger rows of the given days of a calendar until the end of the transaction
+# Rows are locked in date order, so bookings with overlapping days cannot deadlock
+def lock_days(calendar_id, dates):
+    booking_days = BookingDay.objects.filter(calendar_id=calendar_id, date__in=dates)
+
+    # Databases without SELECT ... FOR UPDATE (SQLite) lock the whole database on the first write of a transaction
+    if not connection.features.has_select_for_update:
+        booking_days.update(version=F('version'))
+
+    for date in dates:
+        BookingDay.objects.get_or_create(calendar_id=calendar_id, date=date)
+
+    if connection.features.has_select_for_update:
+        list(booking_days.select_for_update().order_by('date'))
+
+# Function: Get the version of each of the given days of a calendar in the ledger
+def get_day_versions(calendar_id, dates):
+    versions = dict(BookingDay.objects.filter(calendar_id=calendar_id, date__in=dates).values_list('date', 'version'))
+    return tuple(versions.get(date, 0) for date in dates)
+
+# Function: Get the version of no_of_days days of a calendar from first_date in the ledger, taken together
+# Day versions only increase, so it changes whenever the capacity held on one of the days changes
+def get_period_version(calendar_id, first_date, no_of_days):
+    return BookingDay.objects.filter(calendar_id=calendar_id, date__gte=first_date,
+                                     date__lt=first_date + timedelta(days=no_of_days)).aggregate(version=Sum('version'))['version'] or 0
+
+# Function: Change the version of each of the given days of a calendar, after the capacity held on them changes
+def bump_day_versions(calendar_id, dates):
+    BookingDay.objects.filter(calendar_id=calendar_id, date__in=dates).update(version=F('version') + 1)
+
+# Function: Get the bookings holding capacity in the given calendars between time_min and time_max
+# Bookings waiting in the booking queue hold capacity until their event is inserted, however long that takes
+def get_held_bookings(calendar_ids, time_min, time_max):
+    is_held = (Q(capacity_updated__gte=timezone.now() - timedelta(seconds=LEDGER_HOLD_SECONDS))
+               | Q(capacity_status=Booking.RESERVED, task__status=BookingTask.PENDING))
+    return Booking.objects.filter(is_held,
+                                  calendar_id__in=calendar_ids,
+                                  capacity_status__in=[Booking.RESERVED, Booking.CONFIRMED],
+                                  end__gt=datetime.fromisoformat(time_min),
+                                  start__lt=datetime.fromisoformat(time_max))
+
+# Function: List the bookings holding capacity in a calendar between time_min and time_max
+# Returns compact events
+def list_ledger_events(calendar_id, time_min, time_max):
+    return [booking.to_compact_event() for booking in get_held_bookings([calendar_id], time_min, time_max)]
+
+# Function: Get the periods in each resource calendar held by bookings between time_min and time_max
+# Periods are in seconds since the epoch
+def get_ledger_busy_periods(resource_calendar_ids, time_min, time_max):
+    busy_periods_by_calendar = {resource_calendar_id: [] for resource_calendar_id in resource_calendar_ids}
+    for booking in get_held_bookings(resource_calendar_ids, time_min, time_max):
+        busy_periods_by_calendar[booking.calendar_id].append((to_epoch_seconds(booking.start), to_epoch_seconds(booking.end)))
+    return busy_periods_by_calendar
+
+# Function: Iterate over the events from Google Calendar, followed by the bookings in the ledger that are not among them yet
+def merge_ledger_events(event_details, ledger_events):
+    event_ids = set()
+    for existing_event in event_details:
+        event_ids.add(existing_event.id)
+        yield existing_event
+
+    for ledger_event in ledger_events:
+        if ledger_event.id not in event_ids:
+            yield ledger_event
+
+# Function: Reserve capacity for several bookings at once, all or none of them
+# booked_slots is a list of (start_time, end_time, booking_fields), with start_time and end_time as SGT ISOFormat strings.
+# The days of every booking are locked while find_booking_calendar_ids checks the availability of the slots,
+# so concurrent bookings of the same days are checked one at a time, each seeing the capacity reserved by the others.
+# find_booking_calendar_ids runs with the days locked (on SQLite, the whole database), so it must not call Google Calendar:
+# it checks events fetched beforehand against the bookings held in the ledger (see AvailabilitySnapshot.add_ledger_bookings).
+# find_booking_calendar_ids returns the calendar to book each slot in, or None if any slot is not available.
+# Returns the reserved bookings, or None if any slot is not available
+def reserve_bookings(calendar_id, booked_slots, find_booking_calendar_ids):
+    dates = sorted({date for start_time, end_time, booking_fields in booked_slots for date in get_dates_between(start_time, end_time)})
+
+    with transaction.atomic():
+        lock_days(calendar_id, dates)
+
+        booking_calendar_ids = find_booking_calendar_ids()
+        if booking_calendar_ids is None:
+            return None
+
+        bookings = [Booking.objects.create(calendar_id=booking_calendar_id,
+                                           start=datetime.fromisoformat(start_time), end=datetime.fromisoformat(end_time),
+                                           start_raw=start_time, end_raw=end_time,
+                                           capacity_status=Booking.RESERVED, capacity_updated=timezone.now(),
+                                           **booking_fields)
+                    for booking_calendar_id, (start_time, end_time, booking_fields) in zip(booking_calendar_ids, booked_slots)]
+        bump_day_versions(calendar_id, dates)
+
+    return bookings
+
+# Function: Reserve capacity for a booking from start_time to end_time (SGT ISOFormat strings), like reserve_bookings
+# find_booking_calendar_id returns the calendar to book in, or None if the slot is not available.
+# Returns the reserved booking, or None if the slot is not available
+def reserve_booking(calendar_id, start_time, end_time, find_booking_calendar_id, **booking_fields):
+    def find_booking_calendar_ids():
+        booking_calendar_id = find_booking_calendar_id()
+        return None if booking_calendar_id is None else [booking_calendar_id]
+
+    bookings = reserve_bookings(calendar_id, [(start_time, end_time, booking_fields)], find_booking_calendar_ids)
+    return None if bookings is None else bookings[0]
+
+# Function: Confirm a reserved booking once its event is inserted in Google Calendar
+def confirm_booking(booking, event_id):
+    booking.event_id = event_id
+    booking.capacity_status = Booking.CONFIRMED
+    booking.capacity_updated = timezone.now()
+    booking.save(update_fields=['event_id', 'capacity_status', 'capacity_updated'])
+
+# Function: Release the capacity reserved for a booking, when its event could not be inserted in Google Calendar
+def release_booking(calendar_id, booking):
+    with transaction.atomic():
+        Booking.objects.filter(pk=booking.pk).update(capacity_status=Booking.RELEASED, capacity_updated=timezone.now())
+        bump_day_versions(calendar_id, get_dates_between(booking.start_raw, booking.end_raw))
@@ -0,0 +1,116 @@
+import statistics
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from gcalAPI import views
+from gcalAPI.authentication import FirebaseUser
+from gcalAPI.availability import DEFAULT_HORIZON_DAYS, DEFAULT_LEAD_DAYS
+from gcalAPI.cache import availability_cache
+from gcalAPI.calendar_service import calendar_id, calendar_service_provider
+from gcalAPI.fake_calendar import FakeCalendarService, generate_fake_events
+
+# Variable: Average number of events per day in the calendars benchmarked, from sparse to saturated
+DEFAULT_EVENTS_PER_DAY = '0,1,2,4,8'
+
+class Command(BaseCommand):
+    help = ('Benchmark /available_slots (every slot type), /available_slots/all and /book_slot against an in-process fake '
+            'Google Calendar, reporting upstream requests, wall time and peak memory allocated by each request')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events-per-day', default=DEFAULT_EVENTS_PER_DAY,
+                            help='Comma-separated calendar sizes, in average events per day (default: %s).' % DEFAULT_EVENTS_PER_DAY)
+        parser.add_argument('--days', type=int, default=60,
+                            help='Number of days of fixture events, starting today.')
+        parser.add_argument('--latency', type=float, default=0.0,
+                            help='Seconds each request to the fake Google Calendar takes.')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Number of timed runs of each request (the median is reported).')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Seed of the fixture events.')
+
+    def handle(self, *args, **options):
+        # The bookings made by the benchmark are kept in a throwaway test database
+        old_database_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        previous_service = None
+
+        try:
+            self.stdout.write('%-9s %-26s %9s %11s %11s' % ('events/d', 'request', 'upstream', 'median ms', 'peak KiB'))
+
+            for events_per_day in [float(size) for size in options['events_per_day'].split(',')]:
+                service = FakeCalendarService(latency=options['latency'])
+                service.load_events(calendar_id, generate_fake_events(options['seed'], datetime.now().date(), options['days'], events_per_day))
+                previous_service = calendar_service_provider.set_service(service)
+
+                for request_name, send_request in self.get_requests(service):
+                    self.report(events_per_day, request_name, service, send_request, options['repeat'])
+
+        finally:
+            if previous_service is not None:
+                calendar_service_provider.set_service(previous_service)
+            connection.creation.destroy_test_db(old_database_name, verbosity=0)
+
+    # Function: List the requests to benchmark, as (name, function sending the request)
+    def get_requests(self, service):
+        factory = APIRequestFactory()
+
+        requests = [('available_slots %s' % slot_type, lambda slot_type=slot_type: views.get_available_slots(factory.get('/available_slots', {'slot_type': slot_type})))
+                    for slot_type in ['0.5', '1', '1.5', '2', '2.5', '3', '3.5']]
+        requests.append(('available_slots/all', lambda: views.get_all_available_slots(factory.get('/available_slots/all'))))
+        # Each run books another of the half-day slots available before the benchmark
+        available_slots = iter(views.get_available_slots(factory.get('/available_slots', {'slot_type': '0.5'})).data)
+        requests.append(('book_slot 0.5', lambda: self.book_slot(factory, next(available_slots, None))))
+        return requests
+
+    # Function: Book a half-day slot through the book_slot view
+    def book_slot(self, factory, available_slot):
+        if available_slot is None:
+            return None
+
+        request = factory.post('/book_slot', {
+            'slot_type': 0.5,
+            'selectedTimeslot': available_slot,
+            'selectedOptions': {},
+            'status': 'confirmed',
+            'customer_name': 'Benchmark',
+            'product_name': 'Benchmark booking',
+            'totalPrice': 0,
+        }, format='json')
+        force_authenticate(request, user=FirebaseUser({'uid': 'benchmark'}))
+        return views.book_slot(request)
+
+    # Function: Time a request repeatedly with an empty availability cache, then measure its allocations once
+    def report(self, events_per_day, request_name, service, send_request, repeat):
+        timings = []
+        for run in range(repeat):
+            self.clear_availability_cache()
+            service.reset_counts()
+            start = time.perf_counter()
+            response = send_request()
+            timings.append(time.perf_counter() - start)
+
+            # e.g. no slot left to book in a saturated calendar
+            if response is None:
+                self.stdout.write('%-9g %-26s %9s' % (events_per_day, request_name, 'skipped'))
+                return
+        request_count = service.request_count
+
+        self.clear_availability_cache()
+        tracemalloc.start()
+        try:
+            send_request()
+            current_size, peak_size = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.stdout.write('%-9g %-26s %9d %11.2f %11.1f' % (events_per_day, request_name, request_count,
+                                                             statistics.median(timings) * 1000, peak_size / 1024))
+
+    # Function: Invalidate the cached availability of every day searched, so that each run computes it again
+    def clear_availability_cache(self):
+        first_date = datetime.now().date()
+        availability_cache.invalidate_days(calendar_id, [first_date + timedelta(days=day) for day in range(DEFAULT_LEAD_DAYS + DEFAULT_HORIZON_DAYS + 2)])
@@ -0,0 +1,43 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.core.management.base import BaseCommand
+
+# Variable: Modules that are slow to import, and should only be loaded when a request needs them
+HEAVY_MODULES = ['firebase_admin', 'googleapiclient.discovery', 'google_auth_oauthlib', 'numpy']
+
+# Variable: Script run in a fresh interpreter, timing django.setup() and the loading of the URLconf (and so every view module)
+STARTUP_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+import django
+django.setup()
+from django.urls import get_resolver
+get_resolver().url_patterns
+elapsed = time.perf_counter() - start
+print(json.dumps({'seconds': elapsed, 'loaded': [module for module in %r if module in sys.modules]}))
+''' % (HEAVY_MODULES,)
+
+class Command(BaseCommand):
+    help = 'Measure the cold start of the app: the time for a new process to set up Django and load every view'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5,
+                            help='Number of fresh processes to start.')
+
+    def handle(self, *args, **options):
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'porouswayGcalAPI.settings')}
+
+        timings = []
+        for run in range(options['runs']):
+            output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], env=env, check=True,
+                                    capture_output=True, text=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            timings.append(result['seconds'])
+
+        self.stdout.write('Cold start over %d runs: min %.3fs, median %.3fs, max %.3fs'
+                          % (len(timings), min(timings), statistics.median(timings), max(timings)))
+        self.stdout.write('Heavy modules loaded at startup: %s' % (', '.join(result['loaded']) or 'none'))
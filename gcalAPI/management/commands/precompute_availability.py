@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from gcalAPI.calendar_service import calendar_id, calendar_service_provider
+from gcalAPI.precompute import PRECOMPUTE_SETTINGS, claim_refresh, precompute_availability
+
+class Command(BaseCommand):
+    help = ('Precompute the available slots of every slot type over the next GCAL_PRECOMPUTE["DAYS"] days, '
+            'served by /available_slots when GCAL_PRECOMPUTE["ENABLED"]')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Keep precomputing every INTERVAL seconds. Should be shorter than GCAL_PRECOMPUTE["MAX_AGE"] (%s).'
+                                 % PRECOMPUTE_SETTINGS['MAX_AGE'])
+
+    def handle(self, *args, **options):
+        service = calendar_service_provider.get_service()
+
+        while True:
+            # Skipped while a web process refreshes the snapshot
+            if claim_refresh(calendar_id):
+                precomputed_slot_count = precompute_availability(service, calendar_id)
+                if precomputed_slot_count is None:
+                    self.stderr.write('Could not fetch the events, the snapshot was not updated')
+                else:
+                    self.stdout.write('Precomputed %d available slots' % precomputed_slot_count)
+
+            if options['interval'] is None:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from gcalAPI.booking_queue import drain_booking_queue
+from gcalAPI.calendar_service import calendar_id, calendar_service_provider
+
+class Command(BaseCommand):
+    help = 'Insert the Google Calendar events of the bookings queued with write-behind booking (GCAL_BOOKING_WRITE_BEHIND)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Keep processing the queue every INTERVAL seconds.')
+        parser.add_argument('--batch-size', type=int, default=20,
+                            help='Number of queued bookings claimed at a time.')
+
+    def handle(self, *args, **options):
+        service = calendar_service_provider.get_service()
+
+        while True:
+            inserted_count, failed_count = drain_booking_queue(service, calendar_id, options['batch_size'])
+            self.stdout.write('Inserted %d events, %d attempts failed' % (inserted_count, failed_count))
+
+            if options['interval'] is None:
+                return
+            time.sleep(options['interval'])
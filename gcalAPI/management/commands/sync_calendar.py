@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+from googleapiclient.errors import HttpError
+
+from gcalAPI.calendar_service import calendar_id, calendar_service_provider
+from gcalAPI.mirror import MIRROR_MAX_AGE, sync_calendar
+
+class Command(BaseCommand):
+    help = 'Sync the local mirror of Google Calendar events using incremental sync'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Keep syncing every INTERVAL seconds. Should be shorter than GCAL_MIRROR_MAX_AGE (%s).' % MIRROR_MAX_AGE)
+
+    def handle(self, *args, **options):
+        service = calendar_service_provider.get_service()
+
+        while True:
+            try:
+                changed_event_count = sync_calendar(service, calendar_id)
+                self.stdout.write('Synced %d changed events' % changed_event_count)
+
+            except HttpError as error:
+                self.stderr.write('An error occurred: %s' % error)
+
+            if options['interval'] is None:
+                return
+            time.sleep(options['interval'])
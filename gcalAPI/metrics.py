@@ -0,0 +1,249 @@
+import contextvars
+import hashlib
+import hmac
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from rest_framework.authentication import get_authorization_header
+
+# Variable: Settings of the /metrics endpoint, see GCAL_METRICS in settings.py
+METRICS_SETTINGS = {
+    'ENABLED': False,
+    'TOKEN': '',
+    'CALENDAR_LABELS': {},
+    **getattr(settings, 'GCAL_METRICS', {}),
+}
+
+# Variable: Upper bounds (in seconds) of the buckets of every histogram
+HISTOGRAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Function: Format the labels of a sample in the Prometheus text format
+def format_labels(label_names, label_values, extra_labels=()):
+    labels = list(zip(label_names, label_values)) + list(extra_labels)
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                             for name, value in labels)
+
+# Class: Counter with labels, in the Prometheus data model
+class Counter:
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        label_values = tuple(labels[label_name] for label_name in self.label_names)
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.documentation), '# TYPE %s counter' % self.name]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append('%s%s %s' % (self.name, format_labels(self.label_names, label_values), value))
+        return lines
+
+# Class: Histogram with labels, in the Prometheus data model
+# Each series keeps the count of observations in each bucket (not cumulative), their sum and their count
+class Histogram:
+    def __init__(self, name, documentation, label_names=(), buckets=HISTOGRAM_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        label_values = tuple(labels[label_name] for label_name in self.label_names)
+        with self._lock:
+            series = self._values.get(label_values)
+            if series is None:
+                series = self._values[label_values] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+
+            for index, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    series['buckets'][index] += 1
+                    break
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.documentation), '# TYPE %s histogram' % self.name]
+        with self._lock:
+            for label_values, series in sorted(self._values.items()):
+                cumulative_count = 0
+                for upper_bound, bucket_count in zip(self.buckets, series['buckets']):
+                    cumulative_count += bucket_count
+                    lines.append('%s_bucket%s %d' % (self.name, format_labels(self.label_names, label_values, [('le', upper_bound)]), cumulative_count))
+                lines.append('%s_bucket%s %d' % (self.name, format_labels(self.label_names, label_values, [('le', '+Inf')]), series['count']))
+                lines.append('%s_sum%s %s' % (self.name, format_labels(self.label_names, label_values), series['sum']))
+                lines.append('%s_count%s %d' % (self.name, format_labels(self.label_names, label_values), series['count']))
+        return lines
+
+# Variable: Metrics of the process, exposed on /metrics
+# Each worker process has its own metrics, so Prometheus should scrape every worker (or the sum will only cover one)
+UPSTREAM_REQUESTS = Counter('gcal_upstream_requests_total', 'Google Calendar API calls, by method, calendar and HTTP status',
+                            ['method', 'calendar', 'status'])
+UPSTREAM_SECONDS = Histogram('gcal_upstream_request_seconds', 'Duration of Google Calendar API calls, including retries', ['method'])
+UPSTREAM_RETRIES = Counter('gcal_upstream_retries_total', 'Retries of Google Calendar API calls', ['method'])
+UPSTREAM_RESPONSE_BYTES = Counter('gcal_upstream_response_bytes_total', 'Bytes received from the Google Calendar API', ['method'])
+SERVICE_INIT_SECONDS = Histogram('gcal_service_init_seconds', 'Duration of building the Google Calendar API service')
+FIREBASE_VERIFY_SECONDS = Histogram('gcal_firebase_verify_seconds', 'Duration of Firebase ID token verifications, by result', ['result'])
+AVAILABILITY_COMPUTE_SECONDS = Histogram('gcal_availability_compute_seconds',
+                                         'Time spent computing availability in Python, excluding the Google Calendar API calls', ['kind'])
+HTTP_REQUEST_SECONDS = Histogram('gcal_http_request_seconds', 'Duration of HTTP requests, by route, method and status',
+                                 ['route', 'method', 'status'])
+
+METRICS = [UPSTREAM_REQUESTS, UPSTREAM_SECONDS, UPSTREAM_RETRIES, UPSTREAM_RESPONSE_BYTES, SERVICE_INIT_SECONDS,
+           FIREBASE_VERIFY_SECONDS, AVAILABILITY_COMPUTE_SECONDS, HTTP_REQUEST_SECONDS]
+
+# Class: Timings of the work done for one HTTP request, reported in its Server-Timing header
+# Work can be recorded from several threads (e.g. the upstream thread pool of the async views)
+class RequestTimings:
+    def __init__(self):
+        self._timings = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            duration, count = self._timings.get(name, (0.0, 0))
+            self._timings[name] = (duration + seconds, count + 1)
+
+    # Function: Format the timings as the value of a Server-Timing header (durations in milliseconds)
+    def to_header(self, total_seconds):
+        with self._lock:
+            entries = ['%s;dur=%.1f;desc="%d"' % (name, duration * 1000, count) for name, (duration, count) in self._timings.items()]
+        entries.append('total;dur=%.1f' % (total_seconds * 1000))
+        return ', '.join(entries)
+
+# Variable: Timings of the HTTP request being handled, if any
+request_timings = contextvars.ContextVar('request_timings', default=None)
+
+# Variable: Time spent in Google Calendar API calls by each thread, to exclude it from the compute time
+_thread_state = threading.local()
+
+def add_request_timing(name, seconds):
+    timings = request_timings.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+def get_thread_upstream_seconds():
+    return getattr(_thread_state, 'upstream_seconds', 0.0)
+
+# Function: Get the label of a calendar in the metrics: its alias in CALENDAR_LABELS, or a hash of its ID,
+# so that calendar IDs are not published
+def get_calendar_label(calendar_id):
+    if not calendar_id:
+        return ''
+    return METRICS_SETTINGS['CALENDAR_LABELS'].get(calendar_id) or 'sha256:%s' % hashlib.sha256(calendar_id.encode()).hexdigest()[:12]
+
+# Function: Time a Google Calendar API call
+# Yields a dict in which the caller sets the HTTP status of the call and its number of retries
+@contextmanager
+def time_upstream_call(method, calendar_id):
+    upstream_call = {'status': 'error', 'retries': 0}
+    start = time.perf_counter()
+    try:
+        yield upstream_call
+
+    finally:
+        seconds = time.perf_counter() - start
+        _thread_state.upstream_seconds = get_thread_upstream_seconds() + seconds
+
+        UPSTREAM_REQUESTS.inc(method=method, calendar=get_calendar_label(calendar_id), status=upstream_call['status'])
+        UPSTREAM_SECONDS.observe(seconds, method=method)
+        if upstream_call['retries']:
+            UPSTREAM_RETRIES.inc(upstream_call['retries'], method=method)
+        add_request_timing('upstream', seconds)
+
+# Function: Time the computation of availability, excluding the Google Calendar API calls made by the same thread meanwhile
+@contextmanager
+def time_availability_compute(kind):
+    start = time.perf_counter()
+    upstream_start = get_thread_upstream_seconds()
+    try:
+        yield
+
+    finally:
+        seconds = time.perf_counter() - start - (get_thread_upstream_seconds() - upstream_start)
+        AVAILABILITY_COMPUTE_SECONDS.observe(seconds, kind=kind)
+        add_request_timing('compute', seconds)
+
+# Function: Record the duration of some work in a histogram, and in the Server-Timing header as timing_name
+def observe_timing(histogram, timing_name, seconds, **labels):
+    histogram.observe(seconds, **labels)
+    add_request_timing(timing_name, seconds)
+
+# Function: Time a block of work with observe_timing
+@contextmanager
+def time_block(histogram, timing_name, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+
+    finally:
+        observe_timing(histogram, timing_name, time.perf_counter() - start, **labels)
+
+# Class: Middleware timing every request, and adding a Server-Timing header with the time spent calling
+# the Google Calendar API (upstream), computing availability (compute), building the service (service_init),
+# verifying Firebase ID tokens (firebase) and in total. Works with both sync and async views.
+class ServerTimingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self._acall(request)
+
+        timings, token, start = self._start()
+        try:
+            response = self.get_response(request)
+        finally:
+            request_timings.reset(token)
+        return self._finish(request, response, timings, start)
+
+    async def _acall(self, request):
+        timings, token, start = self._start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_timings.reset(token)
+        return self._finish(request, response, timings, start)
+
+    def _start(self):
+        timings = RequestTimings()
+        return timings, request_timings.set(timings), time.perf_counter()
+
+    def _finish(self, request, response, timings, start):
+        total_seconds = time.perf_counter() - start
+        resolver_match = getattr(request, 'resolver_match', None)
+        HTTP_REQUEST_SECONDS.observe(total_seconds, route=resolver_match.route if resolver_match else 'unmatched',
+                                     method=request.method, status=response.status_code)
+        response['Server-Timing'] = timings.to_header(total_seconds)
+        return response
+
+# View: Metrics of the process in the Prometheus text format
+# Only mounted when ENABLED, and only served with the bearer TOKEN when one is set
+def metrics_view(request):
+    if METRICS_SETTINGS['TOKEN']:
+        auth_header = get_authorization_header(request).split()
+        if (len(auth_header) != 2 or auth_header[0].lower() != b'bearer'
+                or not hmac.compare_digest(auth_header[1], METRICS_SETTINGS['TOKEN'].encode())):
+            return JsonResponse({'error': 'Invalid metrics token'}, status=401)
+
+    lines = [line for metric in METRICS for line in metric.render()]
+    return HttpResponse('\n'.join(lines) + '\n', content_type='text/plain; version=0.0.4; charset=utf-8')
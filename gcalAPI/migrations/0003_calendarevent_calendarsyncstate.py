@@ -0,0 +1,43 @@
+# Generated by Django 4.1.7 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gcalAPI', '0002_booking'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CalendarEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('calendar_id', models.CharField(max_length=200)),
+                ('event_id', models.CharField(max_length=200)),
+                ('start', models.DateTimeField()),
+                ('end', models.DateTimeField()),
+                ('start_raw', models.CharField(max_length=50)),
+                ('end_raw', models.CharField(max_length=50)),
+                ('all_day', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CalendarSyncState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('calendar_id', models.CharField(max_length=200, unique=True)),
+                ('sync_token', models.CharField(blank=True, max_length=500)),
+                ('last_synced', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='calendarevent',
+            index=models.Index(fields=['calendar_id', 'start', 'end'], name='calendar_event_range_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='calendarevent',
+            constraint=models.UniqueConstraint(fields=('calendar_id', 'event_id'), name='unique_calendar_event'),
+        ),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 4.1.7 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gcalAPI', '0003_calendarevent_calendarsyncstate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookingDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('calendar_id', models.CharField(max_length=200)),
+                ('date', models.DateField()),
+                ('version', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='booking',
+            name='customer_contact_no',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='calendar_id',
+            field=models.CharField(blank=True, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='event_id',
+            field=models.CharField(blank=True, max_length=200),
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='start',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='end',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='start_raw',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='end_raw',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='capacity_status',
+            field=models.CharField(blank=True, choices=[('reserved', 'Reserved'), ('confirmed', 'Confirmed'), ('released', 'Released')], max_length=20),
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='capacity_updated',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(fields=['calendar_id', 'capacity_status', 'start', 'end'], name='booking_capacity_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='bookingday',
+            constraint=models.UniqueConstraint(fields=('calendar_id', 'date'), name='unique_booking_day'),
+        ),
+    ]
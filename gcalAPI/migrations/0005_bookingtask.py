@@ -0,0 +1,32 @@
+# Generated by Django 4.1.7 on 2026-10-18 15:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gcalAPI', '0004_booking_capacity_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookingTask',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('calendar_id', models.CharField(max_length=200)),
+                ('event_request', models.JSONField()),
+                ('idempotency_key', models.CharField(max_length=64, unique=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('attempts', models.IntegerField(default=0)),
+                ('next_attempt', models.DateTimeField()),
+                ('last_error', models.TextField(blank=True)),
+                ('booking', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='task', to='gcalAPI.booking')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='bookingtask',
+            index=models.Index(fields=['status', 'next_attempt'], name='booking_task_queue_idx'),
+        ),
+    ]
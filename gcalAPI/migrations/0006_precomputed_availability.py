@@ -0,0 +1,41 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gcalAPI', '0005_bookingtask'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='availableslots',
+            name='calendar_id',
+            field=models.CharField(default='', max_length=200),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='availableslots',
+            name='slot_type',
+            field=models.FloatField(default=0),
+            preserve_default=False,
+        ),
+        migrations.CreateModel(
+            name='PrecomputedAvailability',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('calendar_id', models.CharField(max_length=200, unique=True)),
+                ('first_date', models.DateField()),
+                ('no_of_days', models.IntegerField(default=0)),
+                ('ledger_version', models.BigIntegerField(default=0)),
+                ('computed_at', models.DateTimeField(blank=True, null=True)),
+                ('refresh_started', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='availableslots',
+            index=models.Index(fields=['calendar_id', 'slot_type', 'start'], name='available_slots_search_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-18 08:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gcalAPI', '0006_precomputed_availability'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='owner_uid',
+            field=models.CharField(blank=True, max_length=128),
+        ),
+    ]
@@ -0,0 +1,98 @@
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from googleapiclient.errors import HttpError
+
+from .events import get_event_period, iter_compact_events, iter_event_pages, to_compact_event
+from .models import CalendarEvent, CalendarSyncState
+
+# Variable: Whether availability may be answered from the local mirror of events
+MIRROR_ENABLED = getattr(settings, 'GCAL_MIRROR_ENABLED', True)
+
+# Variable: Maximum age of the mirror (in seconds) before availability falls back to the Google Calendar API
+MIRROR_MAX_AGE = getattr(settings, 'GCAL_MIRROR_MAX_AGE', 120)
+
+# Function: Check if the mirror of a calendar was synced recently enough to be used
+def is_mirror_fresh(calendar_id):
+    if not MIRROR_ENABLED:
+        return False
+
+    last_synced = CalendarSyncState.objects.filter(calendar_id=calendar_id).values_list('last_synced', flat=True).first()
+    return last_synced is not None and timezone.now() - last_synced <= timedelta(seconds=MIRROR_MAX_AGE)
+
+# Function: List mirrored events between time_min and time_max with an indexed range query
+# Returns compact events
+def list_mirrored_events(calendar_id, time_min, time_max):
+    mirrored_events = CalendarEvent.objects.filter(calendar_id=calendar_id,
+                                                   end__gt=datetime.fromisoformat(time_min),
+                                                   start__lt=datetime.fromisoformat(time_max)).order_by('start')
+    return [mirrored_event.to_compact_event() for mirrored_event in mirrored_events]
+
+# Function: Iterate over the events between time_min and time_max from the mirror, or from the API if the mirror is stale
+# Returns compact events
+def get_events(service, calendar_id, time_min, time_max):
+    if is_mirror_fresh(calendar_id):
+        return list_mirrored_events(calendar_id, time_min, time_max)
+
+    return iter_compact_events(service, calendar_id, time_min, time_max)
+
+# Function: Fetch all events changed since the sync token, or every event if there is no sync token
+# Returns the changed events and the sync token for the next sync
+def fetch_changed_events(service, calendar_id, sync_token):
+    changed_events = []
+
+    for response in iter_event_pages(service, 'id,status,start(date,dateTime),end(date,dateTime)',
+                                     calendarId=calendar_id, singleEvents=True, syncToken=sync_token or None):
+        changed_events.extend(response.get('items', []))
+
+    # The sync token is only returned with the last page
+    return changed_events, response['nextSyncToken']
+
+# Function: Save a changed event to the mirror, or remove it if it was cancelled
+def apply_changed_event(calendar_id, changed_event):
+    if changed_event.get('status') == 'cancelled':
+        CalendarEvent.objects.filter(calendar_id=calendar_id, event_id=changed_event['id']).delete()
+        return
+
+    event_start, event_end = get_event_period(to_compact_event(changed_event))
+    all_day = 'date' in changed_event['start']
+    time_field = 'date' if all_day else 'dateTime'
+
+    CalendarEvent.objects.update_or_create(calendar_id=calendar_id, event_id=changed_event['id'], defaults={
+        'start': event_start,
+        'end': event_end,
+        'start_raw': changed_event['start'][time_field],
+        'end_raw': changed_event['end'][time_field],
+        'all_day': all_day,
+    })
+
+# Function: Bring the mirror of a calendar up to date with incremental sync
+# Returns the number of changed events
+def sync_calendar(service, calendar_id):
+    sync_state, created = CalendarSyncState.objects.get_or_create(calendar_id=calendar_id)
+    full_sync = not sync_state.sync_token
+
+    try:
+        changed_events, next_sync_token = fetch_changed_events(service, calendar_id, sync_state.sync_token)
+
+    except HttpError as error:
+        # The sync token has expired, so the mirror has to be rebuilt with a full sync
+        if error.resp.status != 410 or full_sync:
+            raise
+        full_sync = True
+        changed_events, next_sync_token = fetch_changed_events(service, calendar_id, None)
+
+    with transaction.atomic():
+        if full_sync:
+            CalendarEvent.objects.filter(calendar_id=calendar_id).delete()
+
+        for changed_event in changed_events:
+            apply_changed_event(calendar_id, changed_event)
+
+        sync_state.sync_token = next_sync_token
+        sync_state.last_synced = timezone.now()
+        sync_state.save()
+
+    return len(changed_events)
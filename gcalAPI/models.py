@@ -1,19 +1,140 @@
 from django.db import models
 import uuid
 
+from .events import to_compact_event
+
 # Create your models here.
+# Available slots precomputed by precompute.py, see PrecomputedAvailability
 class AvailableSlots(models.Model):
+    calendar_id = models.CharField(max_length=200)
+    slot_type = models.FloatField()
     start = models.DateTimeField()
     end = models.DateTimeField()
     id = models.UUIDField(default=uuid.uuid4, unique=True, primary_key=True, editable=False)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['calendar_id', 'slot_type', 'start'], name='available_slots_search_idx'),
+        ]
+
+# Snapshot of the available slots of a calendar in AvailableSlots: the no_of_days days from first_date it covers,
+# when it was computed, and the version of those days in the capacity ledger it was computed from
+class PrecomputedAvailability(models.Model):
+    calendar_id = models.CharField(max_length=200, unique=True)
+    first_date = models.DateField()
+    no_of_days = models.IntegerField(default=0)
+    ledger_version = models.BigIntegerField(default=0)
+    computed_at = models.DateTimeField(null=True, blank=True)
+    # Set while a process refreshes the snapshot, so that the others do not refresh it too
+    refresh_started = models.DateTimeField(null=True, blank=True)
+
 class Booking(models.Model):
+    # Capacity ledger: a booking holds capacity from before its Google Calendar event is inserted
+    # until the event can be seen in Google Calendar, the mirror and the availability cache
+    RESERVED = 'reserved'
+    CONFIRMED = 'confirmed'
+    RELEASED = 'released'
+    CAPACITY_STATUS_CHOICES = [
+        (RESERVED, 'Reserved'),
+        (CONFIRMED, 'Confirmed'),
+        (RELEASED, 'Released'),
+    ]
+
     status = models.CharField(max_length=200)
     customer_name = models.CharField(max_length=200)
     product = models.CharField(max_length=500)
     total_price = models.FloatField()
-    customer_contact_no = models.IntegerField()
+    customer_contact_no = models.IntegerField(null=True, blank=True)
     colour = models.CharField(max_length=200)
     colour_code = models.IntegerField()
     add_ons = models.CharField(max_length=500)
-    additional_notes = models.CharField(max_length=500)
\ No newline at end of file
+    additional_notes = models.CharField(max_length=500)
+    # Calendar the event is booked in, and the ID of the event once it is inserted
+    calendar_id = models.CharField(max_length=200, blank=True)
+    event_id = models.CharField(max_length=200, blank=True)
+    start = models.DateTimeField(null=True, blank=True)
+    end = models.DateTimeField(null=True, blank=True)
+    # Start and end of the booked slot as SGT ISOFormat strings, as sent to Google Calendar
+    start_raw = models.CharField(max_length=50, blank=True)
+    end_raw = models.CharField(max_length=50, blank=True)
+    capacity_status = models.CharField(max_length=20, choices=CAPACITY_STATUS_CHOICES, blank=True)
+    capacity_updated = models.DateTimeField(null=True, blank=True)
+    # Firebase uid of the user who made the booking, the only one allowed to update it
+    owner_uid = models.CharField(max_length=128, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['calendar_id', 'capacity_status', 'start', 'end'], name='booking_capacity_idx'),
+        ]
+
+    # Function: Convert to a compact event, in the same way as its event will be fetched from Google Calendar
+    def to_compact_event(self):
+        return to_compact_event({'id': self.event_id or 'booking-%d' % self.pk,
+                                 'start': {'dateTime': self.start_raw}, 'end': {'dateTime': self.end_raw}})
+
+# Day in the capacity ledger of a calendar
+# Bookings lock the rows of their days while checking and reserving capacity, and change their version when they do
+class BookingDay(models.Model):
+    calendar_id = models.CharField(max_length=200)
+    date = models.DateField()
+    version = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['calendar_id', 'date'], name='unique_booking_day'),
+        ]
+
+# Local mirror of the events in a Google Calendar, kept current by the sync_calendar command
+class CalendarEvent(models.Model):
+    calendar_id = models.CharField(max_length=200)
+    event_id = models.CharField(max_length=200)
+    start = models.DateTimeField()
+    end = models.DateTimeField()
+    # Original start and end returned from Google Calendar: a date for all-day events, otherwise an ISOFormat string
+    start_raw = models.CharField(max_length=50)
+    end_raw = models.CharField(max_length=50)
+    all_day = models.BooleanField(default=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['calendar_id', 'event_id'], name='unique_calendar_event'),
+        ]
+        indexes = [
+            models.Index(fields=['calendar_id', 'start', 'end'], name='calendar_event_range_idx'),
+        ]
+
+    # Function: Convert to a compact event, in the same way as events fetched from Google Calendar
+    def to_compact_event(self):
+        time_field = 'date' if self.all_day else 'dateTime'
+        return to_compact_event({'id': self.event_id, 'start': {time_field: self.start_raw}, 'end': {time_field: self.end_raw}})
+
+class CalendarSyncState(models.Model):
+    calendar_id = models.CharField(max_length=200, unique=True)
+    sync_token = models.CharField(max_length=500, blank=True)
+    last_synced = models.DateTimeField(null=True, blank=True)
+
+# Queue of bookings whose Google Calendar event is inserted by the process_booking_queue worker (write-behind booking)
+class BookingTask(models.Model):
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    booking = models.OneToOneField(Booking, on_delete=models.CASCADE, related_name='task')
+    calendar_id = models.CharField(max_length=200)
+    event_request = models.JSONField()
+    # Also used as the ID of the event, so that an insert retried after a timeout cannot create a second event
+    idempotency_key = models.CharField(max_length=64, unique=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    next_attempt = models.DateTimeField()
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt'], name='booking_task_queue_idx'),
+        ]
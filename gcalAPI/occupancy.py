@@ -0,0 +1,122 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from .availability import BOOKING_SLOTS, X_AND_HALF_DAYS_END_TIME, FreeBusyIndex, get_slot_period
+from .utils import SGT_tz
+
+# Class: Remaining capacity of every day in an AvailabilityIndex or FreeBusyIndex as NumPy arrays (day x {morning, afternoon})
+# Multi-day slots are found for every start day at once with windowed sums over the arrays.
+# With a FreeBusyIndex, they are found for each resource (resource x day), as one resource has to be free for the whole slot.
+class OccupancyMatrix:
+    def __init__(self, availability_index):
+        dates = availability_index.dates
+
+        # Sundays are excluded
+        self.open_days = np.array([date.weekday() != 6 for date in dates], dtype=bool)
+
+        # Capacity of the half-day slots
+        self.half_day_capacity = np.array([[availability_index.get_half_day_capacity(date, 'morning'),
+                                            availability_index.get_half_day_capacity(date, 'afternoon')] for date in dates],
+                                          dtype=int).reshape(-1, 2)
+
+        # Capacity of the morning and afternoon of the full-day slots
+        self.full_day_capacity = np.array([availability_index.get_full_day_capacity(date) for date in dates],
+                                          dtype=int).reshape(-1, 2)
+
+        # Running count of available full days, shared by every slot length
+        self.available_full_day_count = np.concatenate(([0], np.cumsum(self.full_day_available())))
+
+        self.resource_calendar_ids = None
+        if isinstance(availability_index, FreeBusyIndex):
+            self.resource_calendar_ids = availability_index.resource_calendar_ids
+
+            # Whether each resource is free for the full-day slot, the morning half-day slot, and overnight after each day
+            resource_full_day_free = self._get_resource_free(availability_index, [date_free['full_day'] for date_free in availability_index.free_calendar_ids.values()])
+            self.resource_morning_free = self._get_resource_free(availability_index, [date_free['morning'] for date_free in availability_index.free_calendar_ids.values()])
+            resource_overnight_free = self._get_resource_free(availability_index, [availability_index.overnight_free_calendar_ids.get(date, []) for date in dates])
+
+            # Running counts of free full days and nights of each resource
+            self.resource_full_day_count = np.concatenate((np.zeros((len(self.resource_calendar_ids), 1), dtype=int),
+                                                           np.cumsum(resource_full_day_free & self.open_days, axis=1)), axis=1)
+            self.resource_overnight_count = np.concatenate((np.zeros((len(self.resource_calendar_ids), 1), dtype=int),
+                                                            np.cumsum(resource_overnight_free, axis=1)), axis=1)
+
+    # Function: Get whether each resource is in the free resource calendar IDs of each day (resource x day)
+    def _get_resource_free(self, availability_index, free_calendar_ids_by_day):
+        return np.array([[resource_calendar_id in free_calendar_ids for free_calendar_ids in free_calendar_ids_by_day]
+                         for resource_calendar_id in availability_index.resource_calendar_ids], dtype=bool).reshape(-1, len(free_calendar_ids_by_day))
+
+    # Function: Get whether the morning and afternoon half-day slots of each day are available
+    def half_day_available(self):
+        return (self.half_day_capacity > 0) & self.open_days[:, np.newaxis]
+
+    # Function: Get whether the full-day slot of each day is available
+    def full_day_available(self):
+        return (self.full_day_capacity > 0).all(axis=1) & self.open_days
+
+    # Function: Find the index of every start day with no_of_full_days consecutive available full days,
+    # followed by an available morning half-day slot if ends_with_morning_slot
+    def find_slot_starts(self, no_of_full_days, ends_with_morning_slot=False):
+        no_of_days = len(self.open_days) - (1 if ends_with_morning_slot else 0)
+        if no_of_full_days > no_of_days:
+            return np.array([], dtype=int)
+
+        # Number of available full days in every window of no_of_full_days days
+        available_full_day_count = self.available_full_day_count[:no_of_days + 1]
+        window_available = available_full_day_count[no_of_full_days:] - available_full_day_count[:no_of_days + 1 - no_of_full_days] == no_of_full_days
+
+        if ends_with_morning_slot:
+            window_available &= self.half_day_available()[no_of_full_days:, 0]
+
+        if self.resource_calendar_ids is not None:
+            window_available &= self._find_resource_windows(no_of_full_days, ends_with_morning_slot, no_of_days)
+
+        return np.flatnonzero(window_available)
+
+    # Function: Get whether one resource is free for the full days of every window of no_of_full_days days and the nights in between,
+    # followed by the night and the morning of the next day if ends_with_morning_slot
+    def _find_resource_windows(self, no_of_full_days, ends_with_morning_slot, no_of_days):
+        no_of_windows = no_of_days + 1 - no_of_full_days
+        no_of_nights = no_of_full_days - 1 + (1 if ends_with_morning_slot else 0)
+
+        resource_full_day_count = self.resource_full_day_count[:, :no_of_days + 1]
+        resource_window_available = resource_full_day_count[:, no_of_full_days:] - resource_full_day_count[:, :no_of_windows] == no_of_full_days
+
+        resource_overnight_count = self.resource_overnight_count[:, :no_of_windows + no_of_nights]
+        resource_window_available &= resource_overnight_count[:, no_of_nights:] - resource_overnight_count[:, :no_of_windows] == no_of_nights
+
+        if ends_with_morning_slot:
+            resource_window_available &= self.resource_morning_free[:, no_of_full_days:]
+
+        return resource_window_available.any(axis=0)
+
+# Function: Generate every available slot lasting no_of_half_days half-days
+# 1 half-day: morning and afternoon slots. Even: consecutive full days from 9AM on the first day to 6PM on the last day.
+# Odd: consecutive full days followed by the next morning, ending at 12:30PM on that day.
+# Returns SGT ISOFormat strings
+def generate_available_slots(occupancy, start_date, no_of_half_days):
+    available_slots = []
+
+    if no_of_half_days == 1:
+        half_day_slot_names = ['morning', 'afternoon']
+
+        for day, slot_index in zip(*np.nonzero(occupancy.half_day_available())):
+            slot_start, slot_end = get_slot_period(start_date + timedelta(days=int(day)), BOOKING_SLOTS[half_day_slot_names[slot_index]])
+            available_slots.append({'start': slot_start.isoformat(), 'end': slot_end.isoformat()})
+
+    elif no_of_half_days > 1:
+        no_of_full_days, ends_with_morning_slot = divmod(no_of_half_days, 2)
+        full_day_start_time = BOOKING_SLOTS['full_day']['start_time']
+        full_day_end_time = (datetime.combine(start_date, full_day_start_time) + BOOKING_SLOTS['full_day']['duration']).time()
+
+        for day in occupancy.find_slot_starts(no_of_full_days, bool(ends_with_morning_slot)):
+            slot_start_date = start_date + timedelta(days=int(day))
+            slot_start = SGT_tz.localize(datetime.combine(slot_start_date, full_day_start_time))
+            if ends_with_morning_slot:
+                slot_end = SGT_tz.localize(datetime.combine(slot_start_date + timedelta(days=no_of_full_days), X_AND_HALF_DAYS_END_TIME))
+            else:
+                slot_end = SGT_tz.localize(datetime.combine(slot_start_date + timedelta(days=no_of_full_days - 1), full_day_end_time))
+            available_slots.append({'start': slot_start.isoformat(), 'end': slot_end.isoformat()})
+
+    return available_slots
@@ -0,0 +1,125 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .availability import DEFAULT_LEAD_DAYS, MAX_HORIZON_DAYS
+from .calendar_service import calendar_service_provider
+from .ledger import get_period_version
+from .models import AvailableSlots, PrecomputedAvailability
+from .serializers import AvailableSlotsSerializer
+from .utils import SGT_tz
+
+# Variable: Settings of the precomputed availability, see GCAL_PRECOMPUTE in settings.py
+PRECOMPUTE_SETTINGS = {
+    'ENABLED': False,
+    'DAYS': DEFAULT_LEAD_DAYS + MAX_HORIZON_DAYS,
+    'MAX_AGE': 60,
+    'MAX_STALE': 900,
+    'REFRESH_TIMEOUT': 300,
+    **getattr(settings, 'GCAL_PRECOMPUTE', {}),
+}
+
+# Variable: Thread refreshing stale snapshots in the background, one at a time
+refresh_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='gcal-precompute')
+
+# Function: Compute the available slots of every slot type over the next DAYS days, and store them as the snapshot of the calendar
+# Returns the number of slots stored, or None if the events cannot be fetched
+def precompute_availability(service, calendar_id):
+    # Imported here, as the views import this module
+    from .views import SLOT_TYPES, find_available_slots_of_slot_types
+
+    first_date = datetime.now().date()
+    no_of_days = PRECOMPUTE_SETTINGS['DAYS']
+
+    # Taken before the slots are computed, so that a booking made meanwhile makes the snapshot stale
+    ledger_version = get_period_version(calendar_id, first_date, no_of_days)
+
+    available_slots = find_available_slots_of_slot_types(service, calendar_id, SLOT_TYPES, first_date, no_of_days)
+    if available_slots is None:
+        PrecomputedAvailability.objects.filter(calendar_id=calendar_id).update(refresh_started=None)
+        return None
+
+    precomputed_slots = [AvailableSlots(calendar_id=calendar_id, slot_type=float(slot_type),
+                                        start=datetime.fromisoformat(slot['start']), end=datetime.fromisoformat(slot['end']))
+                         for slot_type, slots in available_slots.items() for slot in slots]
+
+    with transaction.atomic():
+        AvailableSlots.objects.filter(calendar_id=calendar_id).delete()
+        AvailableSlots.objects.bulk_create(precomputed_slots)
+        PrecomputedAvailability.objects.update_or_create(calendar_id=calendar_id, defaults={
+            'first_date': first_date,
+            'no_of_days': no_of_days,
+            'ledger_version': ledger_version,
+            'computed_at': timezone.now(),
+            'refresh_started': None,
+        })
+
+    return len(precomputed_slots)
+
+# Function: Take the refresh of the snapshot of a calendar, unless another process is refreshing it
+# A refresh that has not finished after REFRESH_TIMEOUT seconds is assumed to have died
+# Returns True if the refresh was taken
+def claim_refresh(calendar_id):
+    PrecomputedAvailability.objects.get_or_create(calendar_id=calendar_id, defaults={'first_date': datetime.now().date()})
+
+    now = timezone.now()
+    not_refreshing = Q(refresh_started__isnull=True) | Q(refresh_started__lt=now - timedelta(seconds=PRECOMPUTE_SETTINGS['REFRESH_TIMEOUT']))
+    return PrecomputedAvailability.objects.filter(not_refreshing, calendar_id=calendar_id).update(refresh_started=now) == 1
+
+# Function: Refresh the snapshot of a calendar on the refresh thread, unless it is already being refreshed
+def refresh_in_background(calendar_id):
+    if claim_refresh(calendar_id):
+        refresh_executor.submit(run_refresh, calendar_id)
+
+def run_refresh(calendar_id):
+    close_old_connections()
+    try:
+        precompute_availability(calendar_service_provider.get_service(), calendar_id)
+
+    except Exception as error:
+        print('An error occurred: %s' % error)
+        PrecomputedAvailability.objects.filter(calendar_id=calendar_id).update(refresh_started=None)
+
+    finally:
+        connection.close()
+
+# Function: Check if a snapshot is stale: older than MAX_AGE seconds, or a booking changed the capacity of its days since
+def is_snapshot_stale(snapshot):
+    if timezone.now() - snapshot.computed_at > timedelta(seconds=PRECOMPUTE_SETTINGS['MAX_AGE']):
+        return True
+    return get_period_version(snapshot.calendar_id, snapshot.first_date, snapshot.no_of_days) != snapshot.ledger_version
+
+# Function: Get the precomputed available slots of the given slot types in the horizon_days days from display_start_date
+# A stale snapshot is still served (up to MAX_STALE seconds old), and refreshed in the background.
+# Returns the slots of each slot type ('%g' % slot_type), or None if they have to be computed on demand
+# (precompute disabled, no snapshot yet, or the search window is not covered by the snapshot)
+def get_precomputed_slots(calendar_id, slot_types, display_start_date, horizon_days):
+    if not PRECOMPUTE_SETTINGS['ENABLED']:
+        return None
+
+    snapshot = PrecomputedAvailability.objects.filter(calendar_id=calendar_id).first()
+    if snapshot is None or snapshot.computed_at is None:
+        refresh_in_background(calendar_id)
+        return None
+
+    if is_snapshot_stale(snapshot):
+        refresh_in_background(calendar_id)
+
+    search_end_date = display_start_date + timedelta(days=horizon_days)
+    if (timezone.now() - snapshot.computed_at > timedelta(seconds=PRECOMPUTE_SETTINGS['MAX_STALE'])
+            or display_start_date < snapshot.first_date or search_end_date > snapshot.first_date + timedelta(days=snapshot.no_of_days)):
+        return None
+
+    # Slots lie within a day or consecutive days, so the slots of the search window are the ones starting and ending in it
+    precomputed_slots = list(AvailableSlots.objects.filter(calendar_id=calendar_id, slot_type__in=[float(slot_type) for slot_type in slot_types],
+                                                           start__gte=SGT_tz.localize(datetime.combine(display_start_date, time())),
+                                                           end__lte=SGT_tz.localize(datetime.combine(search_end_date, time()))).order_by('start'))
+
+    available_slots = {'%g' % slot_type: [] for slot_type in slot_types}
+    for precomputed_slot, slot in zip(precomputed_slots, AvailableSlotsSerializer(precomputed_slots, many=True).data):
+        available_slots['%g' % precomputed_slot.slot_type].append(dict(slot))
+    return available_slots
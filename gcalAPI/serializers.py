@@ -1,8 +1,12 @@
 from rest_framework import serializers
 from .models import AvailableSlots
+from .utils import SGT_tz
 
-# Fix this after creating model
+# Class: Precomputed available slot, in the same format as the slots computed on demand (SGT ISOFormat strings)
 class AvailableSlotsSerializer(serializers.ModelSerializer):
+    start = serializers.DateTimeField(default_timezone=SGT_tz)
+    end = serializers.DateTimeField(default_timezone=SGT_tz)
+
     class Meta:
         model = AvailableSlots
-        fields = '__all__'
\ No newline at end of file
+        fields = ['start', 'end']
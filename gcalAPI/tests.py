@@ -1,3 +1,1087 @@
-from django.test import TestCase
+import asyncio
+import json
+import threading
+import time as time_module
+from datetime import datetime, time, timedelta
+from unittest import mock
 
-# Create your tests here.
+import requests
+from asgiref.sync import async_to_sync, sync_to_async
+from django.http import JsonResponse
+from django.test import AsyncRequestFactory, TestCase
+from django.urls import Resolver404, resolve
+from django.utils import timezone
+from googleapiclient.errors import HttpError
+from pytz import utc
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from . import async_views, authentication, availability, booking_queue, events, metrics, mirror, precompute, upstream, views
+from .async_views import ASYNC_CHUNK_DAYS
+from .authentication import FirebaseUser, InvalidIdTokenError, VerifiedTokenCache
+from .availability import DEFAULT_HORIZON_DAYS, DEFAULT_LEAD_DAYS, MAX_HORIZON_DAYS, MAX_LEAD_DAYS, MAX_RESOURCES, fetch_availability_index
+from .cache import CACHE_SETTINGS, AsyncSingleFlight, AvailabilityCache, LocalMemoryBackend, SingleFlight, availability_cache
+from .calendar_service import calendar_id, calendar_service_provider
+from .fake_calendar import FakeCalendarService, generate_fake_events, make_http_error
+from .ledger import confirm_booking, get_day_versions, get_held_bookings, release_booking, reserve_booking
+from .models import Booking, BookingTask, CalendarEvent, CalendarSyncState, PrecomputedAvailability
+from .transport import SessionHttp
+from .upstream import CircuitBreaker, TokenBucket, UpstreamGuard, UpstreamUnavailableError, calendar_upstream
+from .utils import SGT_tz, convert_datetime_to_SGT_isoformat, get_dates_between
+
+# Variable: Slot types offered on the website, as sent in the slot_type query parameter
+SLOT_TYPES = ['0.5', '1', '1.5', '2', '2.5', '3', '3.5']
+
+# Function: Read the period of an event the way the original per-slot checks did
+# (dateTime strings as UTC, dates as local midnight)
+def get_per_slot_event_period(existing_event):
+    if 'date' in existing_event['start'] and 'date' in existing_event['end']:
+        return (datetime.strptime(existing_event['start']['date'], '%Y-%m-%d').astimezone(SGT_tz),
+                datetime.strptime(existing_event['end']['date'], '%Y-%m-%d').astimezone(SGT_tz))
+    return (datetime.fromisoformat(existing_event['start']['dateTime']).replace(tzinfo=utc).astimezone(SGT_tz),
+            datetime.fromisoformat(existing_event['end']['dateTime']).replace(tzinfo=utc).astimezone(SGT_tz))
+
+# Function: Check a half-day slot with the original per-slot rule, listing its events with one call
+def is_half_day_slot_available_per_slot(service, start_time, end_time):
+    if datetime.fromisoformat(start_time).weekday() == 6:
+        return False
+
+    event_details = service.events().list(calendarId=calendar_id, timeMin=start_time, timeMax=end_time).execute()['items']
+    return len(event_details) < MAX_RESOURCES
+
+# Function: Check a full-day slot with the original per-slot rule, listing its events with one call
+def is_full_day_slot_available_per_slot(service, start_time, end_time):
+    if datetime.fromisoformat(start_time).weekday() == 6:
+        return False
+
+    morning_slot_count = afternoon_slot_count = full_day_count = 0
+    for existing_event in service.events().list(calendarId=calendar_id, timeMin=start_time, timeMax=end_time).execute()['items']:
+        event_start, event_end = get_per_slot_event_period(existing_event)
+        duration = event_end - event_start
+
+        if duration < timedelta(hours=5):
+            if event_end.time() < time(hour=14):
+                morning_slot_count += 1
+            elif event_end.time() > time(hour=14):
+                afternoon_slot_count += 1
+        elif duration > timedelta(hours=5):
+            full_day_count += 1
+
+    return full_day_count + morning_slot_count < MAX_RESOURCES and full_day_count + afternoon_slot_count < MAX_RESOURCES
+
+# Function: Check the slot of a booking with the original per-slot rules, like views.check_booking_slot
+def is_booking_slot_available_per_slot(service, slot_type, start_time, end_time):
+    start_datetime = datetime.fromisoformat(start_time)
+
+    if slot_type == 0.5:
+        return is_half_day_slot_available_per_slot(service, start_time, end_time)
+
+    no_of_full_days = int(slot_type)
+    are_full_day_slots_available = [is_full_day_slot_available_per_slot(service, (start_datetime + timedelta(days=day)).isoformat(),
+                                                                        (start_datetime + timedelta(days=day, hours=9)).isoformat())
+                                    for day in range(no_of_full_days)]
+    if slot_type == no_of_full_days:
+        return all(are_full_day_slots_available)
+
+    morning_slot_start = start_datetime + timedelta(days=no_of_full_days)
+    return all(are_full_day_slots_available) and is_half_day_slot_available_per_slot(service, morning_slot_start.isoformat(),
+                                                                                      (morning_slot_start + timedelta(hours=4)).isoformat())
+
+# Function: List the available slots of a slot type with the original per-slot rules, one check per slot and day
+def get_available_slots_per_slot(service, slot_type, display_start_date, horizon_days):
+    dates = [display_start_date + timedelta(days=day) for day in range(horizon_days)]
+
+    def get_slot(date, start_time, duration):
+        slot_start = SGT_tz.localize(datetime.combine(date, start_time))
+        return slot_start.isoformat(), (slot_start + duration).isoformat()
+
+    if slot_type == 0.5:
+        return [{'start': start_time, 'end': end_time} for date in dates
+                for start_time, end_time in [get_slot(date, time(hour=9), timedelta(hours=4)), get_slot(date, time(hour=14, minute=30), timedelta(hours=4))]
+                if is_half_day_slot_available_per_slot(service, start_time, end_time)]
+
+    available_days = [date for date in dates if is_full_day_slot_available_per_slot(service, *get_slot(date, time(hour=9), timedelta(hours=9)))]
+    available_mornings = [date for date in dates if is_half_day_slot_available_per_slot(service, *get_slot(date, time(hour=9), timedelta(hours=4)))]
+
+    no_of_full_days = int(slot_type)
+    available_slots = []
+    for date in available_days:
+        if not all(date + timedelta(days=day) in available_days for day in range(1, no_of_full_days)):
+            continue
+
+        if slot_type == no_of_full_days:
+            end_time = convert_datetime_to_SGT_isoformat(date + timedelta(days=no_of_full_days - 1), time(hour=18))
+        elif date + timedelta(days=no_of_full_days) in available_mornings:
+            end_time = convert_datetime_to_SGT_isoformat(date + timedelta(days=no_of_full_days), time(hour=12, minute=30))
+        else:
+            continue
+        available_slots.append({'start': convert_datetime_to_SGT_isoformat(date, time(hour=9)), 'end': end_time})
+
+    return available_slots
+
+# Class: Tests running the views against the in-process fake Google Calendar, with an empty availability cache
+class FakeCalendarTestCase(TestCase):
+    def setUp(self):
+        self.service = FakeCalendarService()
+        self.service.load_events(calendar_id, [])
+        previous_service = calendar_service_provider.set_service(self.service)
+        self.addCleanup(calendar_service_provider.set_service, previous_service)
+
+        for cache_backend in ['backend', 'last_known_backend', 'version_backend']:
+            patcher = mock.patch.object(availability_cache, cache_backend, LocalMemoryBackend(CACHE_SETTINGS['TTL'], CACHE_SETTINGS['MAX_ENTRIES']))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.factory = APIRequestFactory()
+        self.display_start_date = datetime.now().date() + timedelta(days=DEFAULT_LEAD_DAYS)
+
+    # Function: Get the first date on or after the first day searched that falls on a weekday (0 is Monday)
+    def get_search_date(self, weekday):
+        return self.display_start_date + timedelta(days=(weekday - self.display_start_date.weekday()) % 7)
+
+    # Function: Add an event from start_time to end_time (SGT datetimes) to a calendar of the fake service
+    def add_event(self, start_time, end_time, event_calendar_id=calendar_id):
+        self.service.load_events(event_calendar_id, [{'id': 'event%d' % self.service.sequence, 'summary': '[confirmed] Test',
+                                                      'start': {'dateTime': start_time.isoformat()}, 'end': {'dateTime': end_time.isoformat()}}])
+
+    # Function: Fill up all but one of the resources on the morning of a date
+    def fill_morning_but_one(self, date):
+        morning_start = SGT_tz.localize(datetime.combine(date, time(hour=9)))
+        for resource in range(MAX_RESOURCES - 1):
+            self.add_event(morning_start, morning_start + timedelta(hours=4))
+
+    # Function: Fetch the availability index of a window of days from the fake service, for views.check_booking_slot
+    def fetch_index(self, start_date, no_of_days, booking_slots):
+        return fetch_availability_index(self.service, calendar_id, start_date, no_of_days, booking_slots)
+
+    def get_available_slots(self, slot_type, query_params=None, **headers):
+        return views.get_available_slots(self.factory.get('/available_slots', {'slot_type': slot_type, **(query_params or {})}, **headers))
+
+    # Function: Get the available slots from the async view, as a list like get_available_slots(...).data
+    def get_available_slots_async(self, slot_type, query_params=None):
+        request = AsyncRequestFactory().get('/available_slots_async', {'slot_type': slot_type, **(query_params or {})})
+        return json.loads(async_to_sync(async_views.get_available_slots_async)(request).content)
+
+    def generate_booking_data(self, start_time, end_time, slot_type=0.5, product_name='Test booking'):
+        return {
+            'slot_type': slot_type,
+            'selectedTimeslot': {'start': start_time, 'end': end_time},
+            'selectedOptions': {},
+            'status': 'pending',
+            'customer_name': 'Test',
+            'product_name': product_name,
+            'totalPrice': 10,
+        }
+
+    def generate_morning_booking_data(self, date, product_name='Test booking'):
+        return self.generate_booking_data(convert_datetime_to_SGT_isoformat(date, time(hour=9)),
+                                          convert_datetime_to_SGT_isoformat(date, time(hour=13)), product_name=product_name)
+
+    def post(self, view, data, uid='owner'):
+        request = self.factory.post('/', data, format='json')
+        force_authenticate(request, user=FirebaseUser({'uid': uid}))
+        return view(request)
+
+class AvailableSlotsTests(FakeCalendarTestCase):
+    # Function: Check the available slots of every slot type in a calendar of events_per_day events per day
+    def check_available_slots(self, seed, events_per_day):
+        self.service.load_events(calendar_id, generate_fake_events(seed, datetime.now().date(), DEFAULT_LEAD_DAYS + DEFAULT_HORIZON_DAYS + 2, events_per_day))
+
+        for slot_type in SLOT_TYPES:
+            with self.subTest(slot_type=slot_type):
+                self.assertEqual(self.get_available_slots(slot_type).data,
+                                 get_available_slots_per_slot(self.service, float(slot_type), self.display_start_date, DEFAULT_HORIZON_DAYS))
+
+    def test_available_slots_of_sparse_calendar(self):
+        self.check_available_slots(0, 0.5)
+
+    def test_available_slots_of_busy_calendar(self):
+        self.check_available_slots(1, 2)
+
+    def test_available_slots_of_full_calendar(self):
+        self.check_available_slots(2, 4)
+
+    def test_available_slots_of_saturated_calendar(self):
+        self.check_available_slots(3, 8)
+
+    def test_slot_checks_match_per_slot_rules(self):
+        self.service.load_events(calendar_id, generate_fake_events(1, datetime.now().date(), DEFAULT_LEAD_DAYS + DEFAULT_HORIZON_DAYS + 6, 4))
+
+        durations = {0.5: timedelta(hours=4), 1: timedelta(hours=9), 2: timedelta(days=1, hours=9), 3: timedelta(days=2, hours=9),
+                     1.5: timedelta(days=1, hours=3, minutes=30), 2.5: timedelta(days=2, hours=3, minutes=30), 3.5: timedelta(days=3, hours=3, minutes=30)}
+        for day in range(DEFAULT_HORIZON_DAYS):
+            for start_time in [time(hour=9), time(hour=14, minute=30), time(hour=20)]:
+                slot_start = SGT_tz.localize(datetime.combine(self.display_start_date + timedelta(days=day), start_time))
+                for slot_type, duration in durations.items():
+                    slot_start_time, slot_end_time = slot_start.isoformat(), (slot_start + duration).isoformat()
+                    with self.subTest(slot_type=slot_type, start=slot_start_time):
+                        self.assertEqual(bool(views.check_booking_slot(self.fetch_index, slot_type, slot_start_time, slot_end_time)),
+                                         is_booking_slot_available_per_slot(self.service, slot_type, slot_start_time, slot_end_time))
+
+    def test_not_modified_until_slots_change(self):
+        monday = self.get_search_date(0)
+        self.fill_morning_but_one(monday)
+
+        response = self.get_available_slots('0.5')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('max-age', response['Cache-Control'])
+        etag = response['ETag']
+
+        self.assertEqual(self.get_available_slots('0.5', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # Booking the last resource on Monday morning removes its slot
+        self.assertEqual(self.post(views.book_slot, self.generate_morning_booking_data(monday)).status_code, 200)
+
+        response = self.get_available_slots('0.5', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertNotIn(convert_datetime_to_SGT_isoformat(monday, time(hour=9)), [slot['start'] for slot in response.data])
+
+    def test_rejects_search_windows_out_of_bounds(self):
+        for query_params in [{'lead_days': 'soon'}, {'lead_days': -1}, {'lead_days': MAX_LEAD_DAYS + 1},
+                             {'horizon_days': 0}, {'horizon_days': MAX_HORIZON_DAYS + 1}, {'horizon_days': '1.5'}]:
+            with self.subTest(query_params=query_params):
+                response = self.get_available_slots('1', query_params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.data)
+
+        self.assertEqual(self.get_available_slots('1', {'lead_days': MAX_LEAD_DAYS, 'horizon_days': 1}).status_code, 200)
+        self.assertEqual(self.get_available_slots('1', {'lead_days': 0, 'horizon_days': MAX_HORIZON_DAYS}).status_code, 200)
+
+    def test_service_is_only_built_to_compute_slots(self):
+        with mock.patch.object(views, 'initialise_service', return_value=self.service) as initialise_service:
+            self.assertEqual(self.get_available_slots('half').status_code, 400)
+            self.assertEqual(initialise_service.call_count, 0)
+
+            etag = self.get_available_slots('0.5')['ETag']
+            self.assertEqual(initialise_service.call_count, 1)
+
+            # Cached and not modified slots are served without the service
+            self.assertEqual(self.get_available_slots('0.5').status_code, 200)
+            self.assertEqual(self.get_available_slots('0.5', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            self.assertEqual(initialise_service.call_count, 1)
+
+    def test_multi_day_slots_need_one_free_resource(self):
+        monday = self.get_search_date(0)
+        tuesday = monday + timedelta(days=1)
+        monday_slot = {'start': convert_datetime_to_SGT_isoformat(monday, time(hour=9)),
+                       'end': convert_datetime_to_SGT_isoformat(tuesday, time(hour=18))}
+
+        with mock.patch.object(availability, 'RESOURCE_CALENDAR_IDS', ['crewA', 'crewB']), \
+             mock.patch.object(views, 'RESOURCE_CALENDAR_IDS', ['crewA', 'crewB']):
+            # Each crew is busy on one of the days
+            self.add_event(SGT_tz.localize(datetime.combine(tuesday, time(hour=10))), SGT_tz.localize(datetime.combine(tuesday, time(hour=11))), 'crewA')
+            self.add_event(SGT_tz.localize(datetime.combine(monday, time(hour=10))), SGT_tz.localize(datetime.combine(monday, time(hour=11))), 'crewB')
+
+            self.assertNotIn(monday_slot, self.get_available_slots('2').data)
+            self.assertFalse(views.check_booking_slot(self.fetch_index, 2, monday_slot['start'], monday_slot['end']))
+            response = self.post(views.book_slot, self.generate_booking_data(monday_slot['start'], monday_slot['end'], slot_type=2))
+            self.assertEqual(response.status_code, 409)
+
+            # Crew B is free on both days once its Monday event is cancelled
+            self.service.calendars['crewB'].clear()
+            availability_cache.invalidate_period(calendar_id, monday_slot['start'], monday_slot['end'])
+
+            self.assertIn(monday_slot, self.get_available_slots('2').data)
+            self.assertEqual(self.post(views.book_slot, self.generate_booking_data(monday_slot['start'], monday_slot['end'], slot_type=2)).status_code, 200)
+            self.assertEqual(Booking.objects.get().calendar_id, 'crewB')
+
+    def test_async_slots_need_crew_free_overnight_between_chunks(self):
+        # Starts on a Tuesday, so that the last day of the first chunk is a Monday
+        lead_days = (self.get_search_date(1) - datetime.now().date()).days
+        query_params = {'lead_days': lead_days, 'horizon_days': 2 * ASYNC_CHUNK_DAYS}
+        last_day = datetime.now().date() + timedelta(days=lead_days + ASYNC_CHUNK_DAYS - 1)
+        overnight_slot = {'start': convert_datetime_to_SGT_isoformat(last_day, time(hour=9)),
+                          'end': convert_datetime_to_SGT_isoformat(last_day + timedelta(days=1), time(hour=18))}
+
+        with mock.patch.object(availability, 'RESOURCE_CALENDAR_IDS', ['crewA']):
+            # The only crew is busy on the evening between the two chunks
+            self.add_event(SGT_tz.localize(datetime.combine(last_day, time(hour=20))), SGT_tz.localize(datetime.combine(last_day, time(hour=22))), 'crewA')
+
+            async_slots = self.get_available_slots_async('2', query_params)
+            availability_cache.invalidate_period(calendar_id, overnight_slot['start'], overnight_slot['end'])
+            sync_slots = self.get_available_slots('2', query_params).data
+
+        self.assertNotIn(overnight_slot, sync_slots)
+        self.assertEqual(async_slots, sync_slots)
+
+class AllAvailableSlotsTests(FakeCalendarTestCase):
+    def setUp(self):
+        super().setUp()
+        self.service.load_events(calendar_id, generate_fake_events(1, datetime.now().date(), DEFAULT_LEAD_DAYS + DEFAULT_HORIZON_DAYS + 2, 2))
+
+    def get_all_available_slots(self, query_params=None):
+        return views.get_all_available_slots(self.factory.get('/available_slots/all', query_params or {}))
+
+    def test_matches_available_slots_of_each_slot_type(self):
+        self.service.reset_counts()
+        response = self.get_all_available_slots()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(response.data), sorted(SLOT_TYPES))
+        # The events are fetched once for every slot type
+        self.assertEqual(self.service.request_count, 1)
+
+        for slot_type in SLOT_TYPES:
+            with self.subTest(slot_type=slot_type):
+                self.assertEqual(response.data[slot_type], self.get_available_slots(slot_type).data)
+
+    def test_only_returns_the_requested_slot_types(self):
+        response = self.get_all_available_slots({'slot_types': '0.5,2,0.7'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(response.data), ['0.5', '0.7', '2'])
+        self.assertEqual(response.data['0.7'], [])
+        self.assertEqual(response.data['2'], self.get_available_slots('2').data)
+
+    def test_rejects_invalid_slot_types(self):
+        for query_params in [{'slot_types': 'half,1'}, {'slot_types': ''}, {'horizon_days': 0}]:
+            with self.subTest(query_params=query_params):
+                self.assertEqual(self.get_all_available_slots(query_params).status_code, 400)
+
+    def test_answers_304_while_the_slots_are_unchanged(self):
+        etag = self.get_all_available_slots()['ETag']
+        self.assertEqual(views.get_all_available_slots(self.factory.get('/available_slots/all', HTTP_IF_NONE_MATCH=etag)).status_code, 304)
+
+class LedgerTests(FakeCalendarTestCase):
+    def setUp(self):
+        super().setUp()
+        self.monday = self.get_search_date(0)
+        self.start_time = convert_datetime_to_SGT_isoformat(self.monday, time(hour=9))
+        self.end_time = convert_datetime_to_SGT_isoformat(self.monday, time(hour=13))
+
+    def reserve(self):
+        return reserve_booking(calendar_id, self.start_time, self.end_time, lambda: calendar_id, status='pending', customer_name='Test',
+                               product='Test booking', total_price=10, colour='', colour_code=1, add_ons='', additional_notes='')
+
+    def get_held_booking_ids(self):
+        return [booking.pk for booking in get_held_bookings([calendar_id], self.start_time, self.end_time)]
+
+    def test_reserve_holds_capacity(self):
+        dates = get_dates_between(self.start_time, self.end_time)
+        versions = get_day_versions(calendar_id, dates)
+
+        booking = self.reserve()
+        self.assertEqual(booking.capacity_status, Booking.RESERVED)
+        self.assertEqual(self.get_held_booking_ids(), [booking.pk])
+        self.assertNotEqual(get_day_versions(calendar_id, dates), versions)
+
+    def test_reserve_is_refused_when_not_available(self):
+        booking = reserve_booking(calendar_id, self.start_time, self.end_time, lambda: None, status='pending', customer_name='Test',
+                                  product='Test booking', total_price=10, colour='', colour_code=1, add_ons='', additional_notes='')
+        self.assertIsNone(booking)
+        self.assertFalse(Booking.objects.exists())
+
+    def test_confirm_keeps_holding_capacity(self):
+        booking = self.reserve()
+        confirm_booking(booking, 'event1')
+
+        booking.refresh_from_db()
+        self.assertEqual((booking.capacity_status, booking.event_id), (Booking.CONFIRMED, 'event1'))
+        self.assertEqual(self.get_held_booking_ids(), [booking.pk])
+
+    def test_release_frees_capacity(self):
+        booking = self.reserve()
+        dates = get_dates_between(self.start_time, self.end_time)
+        versions = get_day_versions(calendar_id, dates)
+
+        release_booking(calendar_id, booking)
+        self.assertEqual(Booking.objects.get().capacity_status, Booking.RELEASED)
+        self.assertEqual(self.get_held_booking_ids(), [])
+        self.assertNotEqual(get_day_versions(calendar_id, dates), versions)
+
+    def test_reserved_bookings_take_up_capacity_before_their_events_are_inserted(self):
+        self.fill_morning_but_one(self.monday)
+
+        with mock.patch.object(views, 'BOOKING_WRITE_BEHIND', True):
+            self.assertEqual(self.post(views.book_slot, self.generate_morning_booking_data(self.monday)).status_code, 202)
+            response = self.post(views.book_slot, self.generate_morning_booking_data(self.monday))
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Booking.objects.count(), 1)
+
+    def test_only_the_owner_can_update_a_booking(self):
+        response = self.post(views.book_slot, self.generate_morning_booking_data(self.monday))
+        booking = Booking.objects.get()
+        self.assertEqual(booking.event_id, response.data['id'])
+
+        self.assertEqual(self.post(views.update_booking, {'booking_id': booking.pk}, uid='someone else').status_code, 404)
+        self.assertEqual(Booking.objects.get().status, 'pending')
+
+        self.assertEqual(self.post(views.update_booking, {'booking_id': booking.pk}).status_code, 200)
+        self.assertEqual(Booking.objects.get().status, 'completed')
+
+class BookSlotsTests(FakeCalendarTestCase):
+    def setUp(self):
+        super().setUp()
+        self.monday = self.get_search_date(0)
+
+    def get_event_count(self):
+        return len(self.service.calendars[calendar_id])
+
+    def test_books_every_slot(self):
+        response = self.post(views.book_slots, [self.generate_morning_booking_data(self.monday),
+                                                self.generate_morning_booking_data(self.monday + timedelta(days=1))])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_event_count(), 2)
+        self.assertEqual(list(Booking.objects.values_list('capacity_status', flat=True)), [Booking.CONFIRMED] * 2)
+
+    def test_books_nothing_when_a_slot_is_not_available(self):
+        self.fill_morning_but_one(self.monday)
+        event_count = self.get_event_count()
+
+        # The second booking takes up the resource left by the first one
+        response = self.post(views.book_slots, [self.generate_morning_booking_data(self.monday + timedelta(days=1)),
+                                                self.generate_morning_booking_data(self.monday),
+                                                self.generate_morning_booking_data(self.monday)])
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.get_event_count(), event_count)
+        self.assertFalse(Booking.objects.exists())
+
+    def test_releases_every_booking_when_an_event_cannot_be_added(self):
+        with mock.patch.object(views, 'insert_booking_events', side_effect=make_http_error(500, 'Backend Error')):
+            response = self.post(views.book_slots, [self.generate_morning_booking_data(self.monday),
+                                                    self.generate_morning_booking_data(self.monday + timedelta(days=1))])
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(list(Booking.objects.values_list('capacity_status', flat=True)), [Booking.RELEASED] * 2)
+        self.assertEqual(self.get_event_count(), 0)
+
+    def test_answers_503_while_the_circuit_is_open(self):
+        circuit_breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+        circuit_breaker.record_failure()
+
+        with mock.patch.object(calendar_upstream, 'circuit_breaker', circuit_breaker), \
+             mock.patch.object(views.AvailabilitySnapshot, 'fetch', side_effect=UpstreamUnavailableError('Google Calendar API circuit is open')):
+            for view, data in [(views.book_slot, self.generate_morning_booking_data(self.monday)),
+                               (views.book_slots, [self.generate_morning_booking_data(self.monday)])]:
+                with self.subTest(view=view.__name__):
+                    response = self.post(view, data)
+                    self.assertEqual(response.status_code, 503)
+                    self.assertEqual(response['Retry-After'], '30')
+
+            request = AsyncRequestFactory().post('/book_slot_async', self.generate_morning_booking_data(self.monday),
+                                                 content_type='application/json', authorization='Bearer token')
+            with mock.patch.object(async_views, 'verify_id_token', return_value={'uid': 'owner'}):
+                response = async_to_sync(async_views.book_slot_async)(request)
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Retry-After'], '30')
+
+        self.assertFalse(Booking.objects.exists())
+
+    def test_rejects_an_empty_cart(self):
+        self.assertEqual(self.post(views.book_slots, []).status_code, 400)
+
+    def test_rejects_malformed_bookings_before_reserving_any(self):
+        booking_data = self.generate_morning_booking_data(self.monday)
+        for cart in [[1, 2], [{}], [booking_data, {**booking_data, 'slot_type': 4}], [booking_data, {**booking_data, 'selectedTimeslot': {'start': 'noon'}}],
+                     [booking_data, {**booking_data, 'totalPrice': 'free'}], [booking_data, {**booking_data, 'selectedOptions': ['wax']}]]:
+            with self.subTest(cart=cart):
+                self.assertEqual(self.post(views.book_slots, cart).status_code, 400)
+
+        self.assertEqual(self.post(views.book_slot, {**booking_data, 'customer_name': None}).status_code, 400)
+        self.assertFalse(Booking.objects.exists())
+        self.assertEqual(self.get_event_count(), 0)
+
+    def test_async_booking_rejects_invalid_json(self):
+        request = AsyncRequestFactory().post('/book_slot_async', b'{"slot_type": ', content_type='application/json', authorization='Bearer token')
+        with mock.patch.object(async_views, 'verify_id_token', return_value={'uid': 'owner'}):
+            response = async_to_sync(async_views.book_slot_async)(request)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Booking.objects.exists())
+
+class BookingQueueTests(FakeCalendarTestCase):
+    def setUp(self):
+        super().setUp()
+        with mock.patch.object(views, 'BOOKING_WRITE_BEHIND', True):
+            response = self.post(views.book_slot, self.generate_morning_booking_data(self.get_search_date(0)))
+
+        self.assertEqual(response.status_code, 202)
+        self.task = BookingTask.objects.get()
+
+    def drain(self):
+        return booking_queue.drain_booking_queue(self.service, calendar_id)
+
+    def make_task_due(self):
+        BookingTask.objects.filter(pk=self.task.pk).update(next_attempt=timezone.now())
+
+    def test_inserts_queued_event(self):
+        self.assertEqual(self.drain(), (1, 0))
+
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.status, BookingTask.DONE)
+        self.assertEqual(Booking.objects.get().capacity_status, Booking.CONFIRMED)
+        self.assertIn(self.task.idempotency_key, self.service.calendars[calendar_id])
+
+    def test_retries_failed_insert(self):
+        with mock.patch.object(booking_queue, 'insert_booking_event', side_effect=make_http_error(503, 'Backend Error')):
+            self.assertEqual(self.drain(), (0, 1))
+
+        self.task.refresh_from_db()
+        self.assertEqual((self.task.status, self.task.attempts), (BookingTask.PENDING, 1))
+        self.assertGreater(self.task.next_attempt, timezone.now())
+        self.assertEqual(Booking.objects.get().capacity_status, Booking.RESERVED)
+
+        # Not due yet
+        self.assertEqual(self.drain(), (0, 0))
+
+        self.make_task_due()
+        self.assertEqual(self.drain(), (1, 0))
+        self.assertEqual(Booking.objects.get().capacity_status, Booking.CONFIRMED)
+
+    def test_event_inserted_by_an_earlier_attempt_is_confirmed(self):
+        # The insert went through, but its response was lost
+        self.service.events().insert(calendarId=calendar_id, body=self.task.event_request).execute()
+
+        self.assertEqual(self.drain(), (1, 0))
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.status, BookingTask.DONE)
+        self.assertEqual(Booking.objects.get().event_id, self.task.idempotency_key)
+        self.assertEqual(len(self.service.calendars[calendar_id]), 1)
+
+    def test_releases_booking_after_last_attempt(self):
+        with mock.patch.object(booking_queue, 'BOOKING_QUEUE_MAX_ATTEMPTS', 2), \
+             mock.patch.object(booking_queue, 'insert_booking_event', side_effect=make_http_error(503, 'Backend Error')):
+            self.assertEqual(self.drain(), (0, 1))
+            self.make_task_due()
+            self.assertEqual(self.drain(), (0, 1))
+
+        self.task.refresh_from_db()
+        self.assertEqual(self.task.status, BookingTask.FAILED)
+        self.assertEqual(Booking.objects.get().capacity_status, Booking.RELEASED)
+
+# Class: Local memory backend taking as long as a round trip to a shared cache, so that concurrent requests interleave
+class SlowLocalMemoryBackend(LocalMemoryBackend):
+    def get_many(self, keys):
+        values = super().get_many(keys)
+        time_module.sleep(0.01)
+        return values
+
+# Class: Tests of the availability cache, with its own local memory backends
+class AvailabilityCacheTests(TestCase):
+    def setUp(self):
+        self.cache = AvailabilityCache(LocalMemoryBackend(60, 1024), LocalMemoryBackend(3600, 1024),
+                                       version_backend=SlowLocalMemoryBackend(86400, 1024))
+        self.dates = [datetime(2030, 1, 7).date() + timedelta(days=day) for day in range(7)]
+        self.computations = 0
+
+    def compute(self):
+        self.computations += 1
+        time_module.sleep(0.1)
+        return ['slot']
+
+    def test_concurrent_misses_on_cold_cache_share_one_computation(self):
+        barrier = threading.Barrier(50)
+        results = []
+
+        def get_slots():
+            barrier.wait()
+            results.append(self.cache.get_or_compute(calendar_id, self.dates, ('slots',), self.compute))
+
+        threads = [threading.Thread(target=get_slots) for _ in range(50)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.computations, 1)
+        self.assertEqual(results, [['slot']] * 50)
+
+    def test_invalidated_day_is_computed_again(self):
+        self.cache.get_or_compute(calendar_id, self.dates, ('slots',), self.compute)
+        self.cache.get_or_compute(calendar_id, self.dates, ('slots',), self.compute)
+        self.assertEqual(self.computations, 1)
+
+        self.cache.invalidate_days(calendar_id, self.dates[3:4])
+        self.cache.get_or_compute(calendar_id, self.dates, ('slots',), self.compute)
+        self.assertEqual(self.computations, 2)
+
+class MirrorTests(FakeCalendarTestCase):
+    def setUp(self):
+        super().setUp()
+        self.monday = self.get_search_date(0)
+        for day in range(3):
+            morning_start = SGT_tz.localize(datetime.combine(self.monday + timedelta(days=day), time(hour=9)))
+            self.add_event(morning_start, morning_start + timedelta(hours=4))
+
+        self.time_min = convert_datetime_to_SGT_isoformat(self.monday, time())
+        self.time_max = convert_datetime_to_SGT_isoformat(self.monday + timedelta(days=7), time())
+
+    def get_mirrored_event_ids(self):
+        return sorted(mirrored_event.id for mirrored_event in mirror.list_mirrored_events(calendar_id, self.time_min, self.time_max))
+
+    def test_full_sync_mirrors_every_event(self):
+        self.assertFalse(mirror.is_mirror_fresh(calendar_id))
+        self.assertEqual(mirror.sync_calendar(self.service, calendar_id), 3)
+        self.assertTrue(mirror.is_mirror_fresh(calendar_id))
+        self.assertEqual(CalendarSyncState.objects.get(calendar_id=calendar_id).sync_token, str(self.service.sequence))
+
+        # Fresh mirrors answer without calling the API
+        self.service.reset_counts()
+        self.assertEqual(sorted(compact_event.id for compact_event in mirror.get_events(self.service, calendar_id, self.time_min, self.time_max)),
+                         self.get_mirrored_event_ids())
+        self.assertEqual(self.service.request_count, 0)
+
+    def test_incremental_sync_only_fetches_changes(self):
+        mirror.sync_calendar(self.service, calendar_id)
+        self.service.events().delete(calendarId=calendar_id, eventId='event1').execute()
+        self.add_event(SGT_tz.localize(datetime.combine(self.monday, time(hour=14, minute=30))),
+                       SGT_tz.localize(datetime.combine(self.monday, time(hour=18, minute=30))))
+
+        self.assertEqual(mirror.sync_calendar(self.service, calendar_id), 2)
+        self.assertEqual(self.get_mirrored_event_ids(), ['event0', 'event2', 'event4'])
+
+    def test_expired_sync_token_rebuilds_the_mirror(self):
+        mirror.sync_calendar(self.service, calendar_id)
+        CalendarEvent.objects.filter(event_id='event0').update(event_id='stale')
+        CalendarSyncState.objects.filter(calendar_id=calendar_id).update(sync_token='999999')
+
+        self.assertEqual(mirror.sync_calendar(self.service, calendar_id), 3)
+        self.assertEqual(self.get_mirrored_event_ids(), ['event0', 'event1', 'event2'])
+        self.assertEqual(self.service.call_counts['calendar.events.list'], 3)
+
+    def test_stale_mirror_falls_back_to_the_api(self):
+        mirror.sync_calendar(self.service, calendar_id)
+        CalendarSyncState.objects.filter(calendar_id=calendar_id).update(last_synced=timezone.now() - timedelta(seconds=mirror.MIRROR_MAX_AGE + 1))
+        self.add_event(SGT_tz.localize(datetime.combine(self.monday, time(hour=14, minute=30))),
+                       SGT_tz.localize(datetime.combine(self.monday, time(hour=18, minute=30))))
+
+        self.assertEqual(len(list(mirror.get_events(self.service, calendar_id, self.time_min, self.time_max))), 4)
+
+class AsyncViewsTests(FakeCalendarTestCase):
+    def setUp(self):
+        super().setUp()
+        # The upstream calls run on the thread of the test instead of the pool, so that they see the bookings made
+        # in the database transaction of the test
+        patcher = mock.patch.object(async_views, 'run_upstream', lambda func, *args: sync_to_async(func)(*args))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    # Function: Post a booking to the async view as the signed-in user uid
+    def post_async(self, data, uid='owner'):
+        request = AsyncRequestFactory().post('/book_slot_async', data, content_type='application/json', authorization='Bearer token')
+        with mock.patch.object(async_views, 'verify_id_token', return_value={'uid': uid}):
+            return async_to_sync(async_views.book_slot_async)(request)
+
+    def test_async_slots_match_sync_slots(self):
+        self.service.load_events(calendar_id, generate_fake_events(1, datetime.now().date(), DEFAULT_LEAD_DAYS + DEFAULT_HORIZON_DAYS + 2, 2))
+        search_dates = [self.display_start_date + timedelta(days=day) for day in range(DEFAULT_HORIZON_DAYS)]
+
+        for slot_type in SLOT_TYPES:
+            with self.subTest(slot_type=slot_type):
+                async_slots = self.get_available_slots_async(slot_type)
+                # The async view shares the cached slots of the sync view, so they are computed again
+                availability_cache.invalidate_days(calendar_id, search_dates)
+                self.assertEqual(async_slots, self.get_available_slots(slot_type).data)
+
+    def test_async_slots_reject_invalid_requests(self):
+        request = AsyncRequestFactory().get('/available_slots_async', {'slot_type': 'half'})
+        self.assertEqual(async_to_sync(async_views.get_available_slots_async)(request).status_code, 400)
+
+        request = AsyncRequestFactory().post('/available_slots_async', {})
+        self.assertEqual(async_to_sync(async_views.get_available_slots_async)(request).status_code, 405)
+
+    def test_async_booking_needs_a_valid_id_token(self):
+        request = AsyncRequestFactory().post('/book_slot_async', self.generate_morning_booking_data(self.get_search_date(0)), content_type='application/json')
+        self.assertEqual(async_to_sync(async_views.book_slot_async)(request).status_code, 401)
+
+        request = AsyncRequestFactory().post('/book_slot_async', self.generate_morning_booking_data(self.get_search_date(0)),
+                                             content_type='application/json', authorization='Bearer token')
+        with mock.patch.object(async_views, 'verify_id_token', side_effect=InvalidIdTokenError):
+            self.assertEqual(async_to_sync(async_views.book_slot_async)(request).status_code, 401)
+
+    def test_async_booking_takes_the_last_resource_once(self):
+        monday = self.get_search_date(0)
+        self.fill_morning_but_one(monday)
+
+        response = self.post_async(self.generate_morning_booking_data(monday))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Booking.objects.get().owner_uid, 'owner')
+
+        self.assertEqual(self.post_async(self.generate_morning_booking_data(monday)).status_code, 409)
+        self.assertNotIn(convert_datetime_to_SGT_isoformat(monday, time(hour=9)), [slot['start'] for slot in self.get_available_slots_async('0.5')])
+
+class EventPagesTests(FakeCalendarTestCase):
+    def setUp(self):
+        super().setUp()
+        # Small pages, so that a few days of events span several of them
+        patcher = mock.patch.object(events, 'EVENTS_PAGE_SIZE', 5)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.service.load_events(calendar_id, generate_fake_events(2, datetime.now().date(), DEFAULT_LEAD_DAYS + DEFAULT_HORIZON_DAYS + 2, 4))
+        self.time_min = convert_datetime_to_SGT_isoformat(self.display_start_date, time())
+        self.time_max = convert_datetime_to_SGT_isoformat(self.display_start_date + timedelta(days=DEFAULT_HORIZON_DAYS), time())
+
+    def test_pages_are_only_requested_when_needed(self):
+        event_pages = events.iter_event_pages(self.service, events.EVENT_TIME_FIELDS, calendarId=calendar_id,
+                                              timeMin=self.time_min, timeMax=self.time_max, singleEvents=True)
+        first_page = next(event_pages)
+        self.assertEqual(len(first_page['items']), 5)
+        self.assertIn('nextPageToken', first_page)
+        self.assertEqual(self.service.call_counts['calendar.events.list'], 1)
+
+        pages = [first_page] + list(event_pages)
+        self.assertEqual(self.service.call_counts['calendar.events.list'], len(pages))
+        self.assertNotIn('nextPageToken', pages[-1])
+        self.assertIn('nextSyncToken', pages[-1])
+
+    def test_every_page_is_read(self):
+        listed_events = self.service.events().list(calendarId=calendar_id, timeMin=self.time_min, timeMax=self.time_max, maxResults=2500).execute()['items']
+        self.assertGreater(len(listed_events), 10)
+
+        compact_events = list(events.iter_compact_events(self.service, calendar_id, self.time_min, self.time_max))
+        self.assertEqual([compact_event.id for compact_event in compact_events], [listed_event['id'] for listed_event in listed_events])
+
+    def test_available_slots_do_not_depend_on_page_size(self):
+        for slot_type in SLOT_TYPES:
+            with self.subTest(slot_type=slot_type):
+                self.assertEqual(self.get_available_slots(slot_type).data,
+                                 get_available_slots_per_slot(self.service, float(slot_type), self.display_start_date, DEFAULT_HORIZON_DAYS))
+
+class FirebaseAuthenticationTests(FakeCalendarTestCase):
+    def setUp(self):
+        super().setUp()
+        from firebase_admin import auth
+
+        self.claims = {'uid': 'customer', 'exp': time_module.time() + 3600}
+        for patcher in [mock.patch.object(authentication, 'verified_token_cache', VerifiedTokenCache(16)),
+                        mock.patch.object(authentication, 'get_firebase_app', return_value=None)]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        patcher = mock.patch.object(auth, 'verify_id_token', side_effect=lambda id_token, app=None: self.claims)
+        self.firebase_verify_id_token = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post_with_token(self, view, data, id_token):
+        return view(self.factory.post('/', data, format='json', **({'HTTP_AUTHORIZATION': 'Bearer ' + id_token} if id_token else {})))
+
+    def test_token_is_only_verified_until_it_expires(self):
+        self.assertEqual(authentication.verify_id_token('token'), self.claims)
+        self.assertEqual(authentication.verify_id_token('token'), self.claims)
+        self.assertEqual(self.firebase_verify_id_token.call_count, 1)
+
+        self.claims = {'uid': 'customer', 'exp': time_module.time() - 1}
+        authentication.verify_id_token('expired token')
+        authentication.verify_id_token('expired token')
+        self.assertEqual(self.firebase_verify_id_token.call_count, 3)
+
+    def test_invalid_token_is_not_cached(self):
+        self.firebase_verify_id_token.side_effect = ValueError('Token expired')
+        for attempt in range(2):
+            with self.assertRaises(InvalidIdTokenError):
+                authentication.verify_id_token('token')
+        self.assertEqual(self.firebase_verify_id_token.call_count, 2)
+
+    def test_bookings_are_owned_by_the_user_of_the_token(self):
+        booking_data = self.generate_morning_booking_data(self.get_search_date(0))
+        self.assertEqual(self.post_with_token(views.book_slot, booking_data, None).status_code, 401)
+
+        self.firebase_verify_id_token.side_effect = ValueError('Token expired')
+        self.assertEqual(self.post_with_token(views.book_slot, booking_data, 'invalid token').status_code, 401)
+        self.assertFalse(Booking.objects.exists())
+
+        self.firebase_verify_id_token.side_effect = lambda id_token, app=None: self.claims
+        self.assertEqual(self.post_with_token(views.book_slot, booking_data, 'token').status_code, 200)
+        self.assertEqual(Booking.objects.get().owner_uid, 'customer')
+
+class UpstreamGuardTests(TestCase):
+    def setUp(self):
+        self.guard = UpstreamGuard(TokenBucket(1000, 1000), CircuitBreaker(failure_threshold=2, reset_timeout=0.2), max_wait=1, max_retries=2)
+        patcher = mock.patch.object(upstream, 'get_retry_delay', return_value=0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    # Function: Get a function failing with each error in turn, then returning 'ok', and counting its calls
+    def fail_with(self, *errors):
+        remaining_errors = list(errors)
+        api_call = mock.Mock()
+
+        def side_effect():
+            if remaining_errors:
+                raise remaining_errors.pop(0)
+            return 'ok'
+
+        api_call.side_effect = side_effect
+        return api_call
+
+    def test_temporary_errors_are_retried(self):
+        api_call = self.fail_with(make_http_error(503, 'Backend Error'), TimeoutError())
+        self.assertEqual(self.guard.call(api_call), 'ok')
+        self.assertEqual(api_call.call_count, 3)
+
+    def test_inserts_are_only_retried_when_the_quota_was_exceeded(self):
+        api_call = self.fail_with(make_http_error(500, 'Backend Error'))
+        with self.assertRaises(HttpError):
+            self.guard.call(api_call, idempotent=False)
+        self.assertEqual(api_call.call_count, 1)
+
+        api_call = self.fail_with(make_http_error(429, 'Rate Limit Exceeded'))
+        self.assertEqual(self.guard.call(api_call, idempotent=False), 'ok')
+        self.assertEqual(api_call.call_count, 2)
+
+    def test_client_errors_are_not_retried(self):
+        api_call = self.fail_with(make_http_error(404, 'Not Found'))
+        with self.assertRaises(HttpError):
+            self.guard.call(api_call)
+        self.assertEqual(api_call.call_count, 1)
+        self.assertTrue(self.guard.circuit_breaker.allow_request())
+
+    def test_circuit_opens_after_failures_and_closes_after_a_successful_trial(self):
+        for failure in range(2):
+            with self.assertRaises(HttpError):
+                self.guard.call(self.fail_with(*[make_http_error(503, 'Backend Error')] * 3))
+
+        api_call = self.fail_with()
+        with self.assertRaises(UpstreamUnavailableError):
+            self.guard.call(api_call)
+        self.assertEqual(api_call.call_count, 0)
+
+        time_module.sleep(0.2)
+        self.assertEqual(self.guard.call(api_call), 'ok')
+        self.assertEqual(self.guard.call(api_call), 'ok')
+
+    def test_calls_fail_fast_when_the_quota_is_exhausted(self):
+        guard = UpstreamGuard(TokenBucket(1, 1), CircuitBreaker(failure_threshold=2, reset_timeout=30), max_wait=0.1, max_retries=2)
+        api_call = self.fail_with()
+
+        self.assertEqual(guard.call(api_call), 'ok')
+        with self.assertRaises(UpstreamUnavailableError):
+            guard.call(api_call)
+        self.assertEqual(api_call.call_count, 1)
+
+class SingleFlightTests(TestCase):
+    def run_concurrently(self, func, thread_count=20):
+        barrier = threading.Barrier(thread_count)
+        outcomes = []
+
+        def run():
+            barrier.wait()
+            try:
+                outcomes.append(func())
+            except Exception as error:
+                outcomes.append(error)
+
+        threads = [threading.Thread(target=run) for _ in range(thread_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return outcomes
+
+    def test_concurrent_calls_share_one_result(self):
+        single_flight = SingleFlight()
+        computations = []
+
+        def compute():
+            computations.append(1)
+            time_module.sleep(0.1)
+            return 'slots'
+
+        self.assertEqual(self.run_concurrently(lambda: single_flight.do('key', compute)), ['slots'] * 20)
+        self.assertEqual(len(computations), 1)
+
+        # Later calls compute again
+        self.assertEqual(single_flight.do('key', compute), 'slots')
+        self.assertEqual(len(computations), 2)
+
+    def test_concurrent_calls_share_one_error(self):
+        single_flight = SingleFlight()
+        error = make_http_error(503, 'Backend Error')
+        computations = []
+
+        def compute():
+            computations.append(1)
+            time_module.sleep(0.1)
+            raise error
+
+        self.assertEqual(self.run_concurrently(lambda: single_flight.do('key', compute)), [error] * 20)
+        self.assertEqual(len(computations), 1)
+
+    def test_concurrent_coroutines_share_one_result(self):
+        single_flight = AsyncSingleFlight()
+        computations = []
+
+        async def compute():
+            computations.append(1)
+            await asyncio.sleep(0.1)
+            return 'slots'
+
+        async def run():
+            waiters = [asyncio.ensure_future(single_flight.do('key', compute)) for _ in range(10)]
+            await asyncio.sleep(0)
+            # A client disconnecting does not cancel the computation the others wait for
+            waiters[0].cancel()
+            return await asyncio.gather(*waiters[1:])
+
+        self.assertEqual(async_to_sync(run)(), ['slots'] * 9)
+        self.assertEqual(len(computations), 1)
+
+class MetricsTests(FakeCalendarTestCase):
+    def get_metrics(self, **headers):
+        return metrics.metrics_view(self.factory.get('/metrics', **headers))
+
+    def test_server_timing_reports_compute_and_total(self):
+        middleware = metrics.ServerTimingMiddleware(views.get_available_slots)
+        response = middleware(self.factory.get('/available_slots', {'slot_type': '1'}))
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response['Server-Timing'], r'compute;dur=[0-9.]+;desc="1"')
+        self.assertRegex(response['Server-Timing'], r'total;dur=[0-9.]+$')
+
+        # Only the total is reported for cached slots
+        self.assertRegex(middleware(self.factory.get('/available_slots', {'slot_type': '1'}))['Server-Timing'], r'^total;dur=[0-9.]+$')
+
+    def test_server_timing_of_async_views(self):
+        async def get_response(request):
+            metrics.add_request_timing('upstream', 0.25)
+            return JsonResponse([], safe=False)
+
+        middleware = metrics.ServerTimingMiddleware(get_response)
+        response = async_to_sync(middleware)(AsyncRequestFactory().get('/async/available_slots'))
+        self.assertRegex(response['Server-Timing'], r'^upstream;dur=250\.0;desc="1", total;dur=[0-9.]+$')
+
+    def test_metrics_need_the_token(self):
+        with mock.patch.dict(metrics.METRICS_SETTINGS, {'TOKEN': 'secret'}):
+            self.assertEqual(self.get_metrics().status_code, 401)
+            self.assertEqual(self.get_metrics(HTTP_AUTHORIZATION='Bearer guess').status_code, 401)
+
+            response = self.get_metrics(HTTP_AUTHORIZATION='Bearer secret')
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('gcal_http_request_seconds', response.content.decode())
+
+    def test_metrics_do_not_publish_calendar_ids(self):
+        with metrics.time_upstream_call('calendar.events.list', 'private-calendar@group.calendar.google.com'):
+            pass
+        with mock.patch.dict(metrics.METRICS_SETTINGS, {'CALENDAR_LABELS': {'crew@group.calendar.google.com': 'crew'}}):
+            with metrics.time_upstream_call('calendar.events.list', 'crew@group.calendar.google.com'):
+                pass
+            content = self.get_metrics().content.decode()
+
+        self.assertNotIn('private-calendar', content)
+        self.assertIn('calendar="sha256:', content)
+        self.assertIn('calendar="crew"', content)
+
+    def test_metrics_are_not_mounted_unless_enabled(self):
+        self.assertFalse(metrics.METRICS_SETTINGS['ENABLED'])
+        with self.assertRaises(Resolver404):
+            resolve('/metrics')
+
+class PrecomputeTests(FakeCalendarTestCase):
+    def setUp(self):
+        super().setUp()
+        self.service.load_events(calendar_id, generate_fake_events(1, datetime.now().date(), DEFAULT_LEAD_DAYS + DEFAULT_HORIZON_DAYS + 2, 2))
+
+        patcher = mock.patch.dict(precompute.PRECOMPUTE_SETTINGS, {'ENABLED': True, 'DAYS': DEFAULT_LEAD_DAYS + DEFAULT_HORIZON_DAYS + 7})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # Refreshes are run by the tests, instead of the refresh thread
+        patcher = mock.patch.object(precompute.refresh_executor, 'submit')
+        self.submit_refresh = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_first_request_starts_one_refresh(self):
+        self.assertIsNone(precompute.get_precomputed_slots(calendar_id, [1], self.display_start_date, DEFAULT_HORIZON_DAYS))
+        self.assertIsNone(precompute.get_precomputed_slots(calendar_id, [1], self.display_start_date, DEFAULT_HORIZON_DAYS))
+        self.submit_refresh.assert_called_once_with(precompute.run_refresh, calendar_id)
+
+        # The refresh is taken again once it has not finished in time
+        PrecomputedAvailability.objects.update(refresh_started=timezone.now() - timedelta(seconds=precompute.PRECOMPUTE_SETTINGS['REFRESH_TIMEOUT'] + 1))
+        self.assertTrue(precompute.claim_refresh(calendar_id))
+        self.assertFalse(precompute.claim_refresh(calendar_id))
+
+    def test_serves_precomputed_slots_without_calling_the_api(self):
+        precomputed_slots = {}
+        precompute.precompute_availability(self.service, calendar_id)
+        self.service.reset_counts()
+        for slot_type in SLOT_TYPES:
+            precomputed_slots[slot_type] = self.get_available_slots(slot_type).data
+        self.assertEqual(self.service.request_count, 0)
+
+        with mock.patch.dict(precompute.PRECOMPUTE_SETTINGS, {'ENABLED': False}):
+            for slot_type in SLOT_TYPES:
+                with self.subTest(slot_type=slot_type):
+                    self.assertEqual(precomputed_slots[slot_type], self.get_available_slots(slot_type).data)
+
+    def test_booking_makes_the_snapshot_stale(self):
+        monday = self.get_search_date(0)
+        self.service.calendars[calendar_id].clear()
+        self.fill_morning_but_one(monday)
+        precompute.precompute_availability(self.service, calendar_id)
+        self.assertFalse(precompute.is_snapshot_stale(PrecomputedAvailability.objects.get()))
+
+        self.assertEqual(self.post(views.book_slot, self.generate_morning_booking_data(monday)).status_code, 200)
+        self.assertTrue(precompute.is_snapshot_stale(PrecomputedAvailability.objects.get()))
+
+        # The stale snapshot is still served while it is refreshed
+        monday_morning = convert_datetime_to_SGT_isoformat(monday, time(hour=9))
+        self.assertIn(monday_morning, [slot['start'] for slot in self.get_available_slots('0.5').data])
+        self.submit_refresh.assert_called_once_with(precompute.run_refresh, calendar_id)
+
+        precompute.precompute_availability(self.service, calendar_id)
+        self.assertNotIn(monday_morning, [slot['start'] for slot in self.get_available_slots('0.5').data])
+
+    def test_search_windows_outside_the_snapshot_are_computed_on_demand(self):
+        precompute.precompute_availability(self.service, calendar_id)
+        self.assertIsNotNone(precompute.get_precomputed_slots(calendar_id, [1], self.display_start_date, DEFAULT_HORIZON_DAYS))
+        self.assertIsNone(precompute.get_precomputed_slots(calendar_id, [1], self.display_start_date, precompute.PRECOMPUTE_SETTINGS['DAYS']))
+
+# Class: requests adapter answering every request with respond(request, timeout), instead of sending it
+class CannedResponseAdapter(requests.adapters.BaseAdapter):
+    def __init__(self, respond):
+        super().__init__()
+        self.respond = respond
+        self.sent_requests = []
+
+    def send(self, request, timeout=None, **kwargs):
+        self.sent_requests.append((request, timeout))
+        return self.respond(request, timeout)
+
+    def close(self):
+        pass
+
+class SessionHttpTests(TestCase):
+    def create_http(self, respond):
+        session = requests.Session()
+        adapter = CannedResponseAdapter(respond)
+        session.mount('https://', adapter)
+        return SessionHttp(session, timeout=7), adapter
+
+    # Function: Build the response of a request, as sent by Google (gzip already decoded by requests)
+    def make_response(self, request, status_code, content):
+        response = requests.Response()
+        response.status_code = status_code
+        response.reason = 'OK' if status_code == 200 else 'Not Found'
+        response.headers = requests.structures.CaseInsensitiveDict({'Content-Type': 'application/json', 'Content-Encoding': 'gzip'})
+        response._content = content
+        response.request = request
+        response.url = request.url
+        return response
+
+    def test_responses_are_returned_like_httplib2(self):
+        http, adapter = self.create_http(lambda request, timeout: self.make_response(request, 200, b'{"items": []}'))
+
+        response, content = http.request('https://www.googleapis.com/calendar/v3/calendars/primary/events', 'POST', body='{}',
+                                         headers={'content-type': 'application/json'})
+        self.assertEqual((response.status, response['content-length'], content), (200, '13', b'{"items": []}'))
+        self.assertNotIn('content-encoding', response)
+        self.assertEqual(adapter.sent_requests[0][0].method, 'POST')
+        self.assertEqual(adapter.sent_requests[0][1], 7)
+
+    def test_errors_are_raised_by_googleapiclient(self):
+        from googleapiclient.http import HttpRequest
+
+        http, adapter = self.create_http(lambda request, timeout: self.make_response(request, 404, b'{"error": {"code": 404}}'))
+        with self.assertRaises(HttpError) as raised:
+            HttpRequest(http, lambda response, content: json.loads(content), 'https://www.googleapis.com/calendar/v3/calendars/x/events').execute()
+        self.assertEqual(raised.exception.resp.status, 404)
+
+    def test_network_errors_are_raised_as_builtin_errors(self):
+        for requests_error, error_class in [(requests.exceptions.ConnectTimeout, TimeoutError), (requests.exceptions.ReadTimeout, TimeoutError),
+                                            (requests.exceptions.ConnectionError, ConnectionError)]:
+            with self.subTest(requests_error=requests_error.__name__):
+                http, adapter = self.create_http(mock.Mock(side_effect=requests_error('Network is unreachable')))
+                with self.assertRaises(error_class):
+                    http.request('https://www.googleapis.com/calendar/v3/calendars/primary/events')
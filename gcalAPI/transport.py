@@ -0,0 +1,93 @@
+import functools
+import threading
+
+from django.conf import settings
+
+# The HTTP libraries are only imported when the first connection is made, to keep cold starts fast
+
+# Variable: Settings of the HTTP connections to Google APIs, see GCAL_HTTP_TRANSPORT in settings.py
+TRANSPORT_SETTINGS = {
+    'POOL_CONNECTIONS': 4,
+    'POOL_MAXSIZE': 10,
+    'TIMEOUT': 30,
+    **getattr(settings, 'GCAL_HTTP_TRANSPORT', {}),
+}
+
+# Function: Get the options of the keep-alive connection pools of a requests adapter
+# pool_connections is the number of hosts with a pool, pool_maxsize the number of connections kept open to each host
+def get_pool_options():
+    return {'pool_connections': TRANSPORT_SETTINGS['POOL_CONNECTIONS'], 'pool_maxsize': TRANSPORT_SETTINGS['POOL_MAXSIZE']}
+
+# Function: Mount connection pools sized in settings on a requests session
+def mount_pools(session):
+    from requests.adapters import HTTPAdapter
+
+    adapter = HTTPAdapter(**get_pool_options())
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+# Function: Get the requests session shared by the process for calls to Google without credentials (e.g. refreshing OAuth tokens)
+def get_http_session():
+    global _http_session
+
+    if _http_session is None:
+        with _http_session_lock:
+            if _http_session is None:
+                import requests
+
+                _http_session = mount_pools(requests.Session())
+    return _http_session
+
+# Class: httplib2.Http-like transport sending the requests of googleapiclient through a requests session
+# The session is shared by every thread, so connections are kept alive and reused across requests and threads.
+# Network errors are raised as ConnectionError and TimeoutError, which googleapiclient and the upstream guard retry.
+class SessionHttp:
+    def __init__(self, session, timeout):
+        self.session = session
+        self.timeout = timeout
+
+    def request(self, uri, method='GET', body=None, headers=None, redirections=5, connection_type=None):
+        import httplib2
+        import requests
+
+        try:
+            response = self.session.request(method, uri, data=body, headers=headers, timeout=self.timeout,
+                                            allow_redirects=redirections > 0)
+
+        except requests.exceptions.Timeout as error:
+            raise TimeoutError(str(error)) from error
+
+        except requests.exceptions.ConnectionError as error:
+            raise ConnectionError(str(error)) from error
+
+        # requests decompresses gzip responses, so the headers describe the content returned, as httplib2 does
+        response_headers = {key.lower(): value for key, value in response.headers.items() if key.lower() != 'content-encoding'}
+        response_headers['status'] = str(response.status_code)
+        response_headers['content-length'] = str(len(response.content))
+
+        http_response = httplib2.Response(response_headers)
+        http_response.reason = response.reason
+        return http_response, response.content
+
+# Function: Create the transport of the Google Calendar API calls, authorised with the credentials
+# Tokens are refreshed on the shared session (see get_http_session)
+def create_authorized_http(credentials):
+    from google.auth.transport.requests import AuthorizedSession, Request
+
+    session = mount_pools(AuthorizedSession(credentials, auth_request=Request(get_http_session())))
+    return SessionHttp(session, TRANSPORT_SETTINGS['TIMEOUT'])
+
+# Function: Create the google-auth request fetching the public keys of Firebase ID tokens through connection pools sized in
+# settings, caching the keys for as long as Google allows (as firebase_admin does)
+def create_certificate_request(timeout):
+    import cachecontrol
+    import requests
+    from cachecontrol.adapter import CacheControlAdapter
+    from google.auth.transport.requests import Request
+
+    session = cachecontrol.CacheControl(requests.Session(), adapter_class=functools.partial(CacheControlAdapter, **get_pool_options()))
+    return functools.partial(Request(session), timeout=timeout)
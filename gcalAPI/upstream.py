@@ -0,0 +1,255 @@
+import functools
+import json
+import math
+import random
+import re
+import threading
+import time
+from urllib.parse import unquote
+
+from django.conf import settings
+from googleapiclient.errors import HttpError
+
+from .metrics import UPSTREAM_RESPONSE_BYTES, time_upstream_call
+
+# Variable: Settings of the guard around Google Calendar API calls, see GCAL_UPSTREAM in settings.py
+UPSTREAM_SETTINGS = {
+    'REQUESTS_PER_SECOND': 5,
+    'BURST': 10,
+    'MAX_WAIT': 10,
+    'MAX_RETRIES': 4,
+    'BACKOFF_BASE': 0.5,
+    'BACKOFF_MAX': 16,
+    'FAILURE_THRESHOLD': 5,
+    'RESET_TIMEOUT': 30,
+    **getattr(settings, 'GCAL_UPSTREAM', {}),
+}
+
+# Variable: HTTP statuses of errors that are worth retrying
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+# Variable: Pattern of the calendar ID in the URI of an API request
+CALENDAR_ID_PATTERN = re.compile(r'/calendars/([^/?]+)')
+
+# Variable: Reasons of 403 errors returned when the quota is exceeded
+RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded'}
+
+# Class: Response of an API call that was not sent, because the circuit is open or the quota was not available in time
+class UnsentResponse(dict):
+    def __init__(self, status, reason):
+        super().__init__(status=str(status))
+        self.status = status
+        self.reason = reason
+
+# Class: Error raised instead of calling the Google Calendar API when it is unavailable
+# It is an HttpError (503), so every caller handles it like any other failed call
+class UpstreamUnavailableError(HttpError):
+    def __init__(self, reason):
+        super().__init__(UnsentResponse(503, reason), b'')
+
+# Class: Token bucket limiting the rate of API calls to the quota
+# Holds up to burst tokens, refilled at rate tokens per second
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    # Function: Take tokens from the bucket, waiting up to max_wait seconds for them
+    # Returns False if the tokens would not be available in time
+    def acquire(self, tokens=1, max_wait=None):
+        tokens = min(tokens, self.burst)
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+            wait = max(0, (tokens - self._tokens) / self.rate)
+            if max_wait is not None and wait > max_wait:
+                return False
+
+            # Take the tokens now (possibly going below zero), so that later callers queue up behind this one
+            self._tokens -= tokens
+
+        if wait:
+            time.sleep(wait)
+        return True
+
+# Class: Circuit breaker that stops calling the API after failure_threshold failures in a row
+# After reset_timeout seconds, one trial call is let through: the circuit closes again if it succeeds.
+class CircuitBreaker:
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    # Function: Check if a call can be made now
+    def allow_request(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+
+            if self._trial_running or time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+
+            self._trial_running = True
+            return True
+
+    # Function: Get the number of seconds until a trial call is let through, or 0 if calls can be made now
+    def get_time_until_trial(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 0
+            return max(0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    # Function: Let another call be the trial call, when the trial call was not made after all
+    def cancel_trial(self):
+        with self._lock:
+            self._trial_running = False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+# Function: Check if an error is caused by the quota being exceeded
+def is_rate_limit_error(error):
+    if not isinstance(error, HttpError):
+        return False
+
+    if error.resp.status == 429:
+        return True
+
+    details = error.error_details if isinstance(error.error_details, list) else []
+    return error.resp.status == 403 and any(isinstance(detail, dict) and detail.get('reason') in RATE_LIMIT_REASONS for detail in details)
+
+# Function: Check if an error is temporary (quota, server or network errors), so the call can be retried
+def is_retryable_error(error):
+    if isinstance(error, UpstreamUnavailableError):
+        return False
+
+    if isinstance(error, HttpError):
+        return error.resp.status in RETRYABLE_STATUSES or is_rate_limit_error(error)
+
+    return isinstance(error, (ConnectionError, TimeoutError))
+
+# Function: Get the number of seconds to wait before retrying, with full jitter on an exponential backoff
+# A Retry-After header sent with the error is respected
+def get_retry_delay(error, attempt):
+    delay = random.uniform(0, min(UPSTREAM_SETTINGS['BACKOFF_MAX'], UPSTREAM_SETTINGS['BACKOFF_BASE'] * 2 ** attempt))
+
+    retry_after = error.resp.get('retry-after') if isinstance(error, HttpError) else None
+    if retry_after and retry_after.isdigit():
+        delay = max(delay, min(UPSTREAM_SETTINGS['BACKOFF_MAX'], int(retry_after)))
+    return delay
+
+# Function: Get the number of seconds a client should wait before retrying a request that failed with an API error
+# (for the Retry-After header of a 503 response): until the circuit breaker lets calls through again,
+# or longer if the API asked for it, and at least 1
+def get_client_retry_after(error):
+    retry_after = calendar_upstream.circuit_breaker.get_time_until_trial()
+
+    error_retry_after = error.resp.get('retry-after') if isinstance(error, HttpError) else None
+    if error_retry_after and error_retry_after.isdigit():
+        retry_after = max(retry_after, int(error_retry_after))
+    return max(1, math.ceil(retry_after))
+
+# Function: Get the status of a failed API call for the metrics: the HTTP status, or the type of the error
+def get_error_status(error):
+    if isinstance(error, HttpError):
+        return str(error.resp.status)
+    return type(error).__name__
+
+# Class: Guard around the calls to the Google Calendar API, shared by every thread of the process
+# Calls wait for the rate limiter, temporary errors are retried with backoff, and the circuit breaker fails calls fast
+# while the API keeps failing.
+class UpstreamGuard:
+    def __init__(self, rate_limiter, circuit_breaker, max_wait, max_retries):
+        self.rate_limiter = rate_limiter
+        self.circuit_breaker = circuit_breaker
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+
+    # Function: Make an API call through the guard
+    # cost is the number of requests the call counts for in the quota (e.g. the size of a batch request).
+    # Calls that are not idempotent (e.g. inserting an event without an ID) are only retried when the quota was exceeded,
+    # as the API did not process them.
+    # A call only counts as one failure for the circuit breaker once all its retries have failed.
+    # The call is recorded in the metrics under method (e.g. calendar.events.list) and calendar_id.
+    def call(self, func, cost=1, idempotent=True, method='unknown', calendar_id=''):
+        with time_upstream_call(method, calendar_id) as upstream_call:
+            upstream_call['status'] = 'unsent'
+            if not self.circuit_breaker.allow_request():
+                raise UpstreamUnavailableError('Google Calendar API circuit is open')
+
+            attempt = 0
+            while True:
+                if not self.rate_limiter.acquire(cost, self.max_wait):
+                    self.circuit_breaker.cancel_trial()
+                    raise UpstreamUnavailableError('Google Calendar API quota is exhausted')
+
+                try:
+                    response = func()
+
+                except Exception as error:
+                    upstream_call['status'] = get_error_status(error)
+                    if not is_retryable_error(error):
+                        # The API answered (e.g. 404 or 409), so it is up
+                        self.circuit_breaker.record_success()
+                        raise
+
+                    if attempt >= self.max_retries or not (idempotent or is_rate_limit_error(error)):
+                        self.circuit_breaker.record_failure()
+                        raise
+
+                    time.sleep(get_retry_delay(error, attempt))
+                    attempt += 1
+                    upstream_call['retries'] = attempt
+                    continue
+
+                upstream_call['status'] = '200'
+                self.circuit_breaker.record_success()
+                return response
+
+# Variable: Guard shared by every Google Calendar API call of the process
+# The rate limit is per process: with several workers, REQUESTS_PER_SECOND should be the quota divided by the number of workers
+calendar_upstream = UpstreamGuard(TokenBucket(UPSTREAM_SETTINGS['REQUESTS_PER_SECOND'], UPSTREAM_SETTINGS['BURST']),
+                                  CircuitBreaker(UPSTREAM_SETTINGS['FAILURE_THRESHOLD'], UPSTREAM_SETTINGS['RESET_TIMEOUT']),
+                                  UPSTREAM_SETTINGS['MAX_WAIT'], UPSTREAM_SETTINGS['MAX_RETRIES'])
+
+# Function: Get the class of the API requests built by the Calendar service, which execute through calendar_upstream
+# googleapiclient.http is only imported when the service is first built
+@functools.lru_cache(maxsize=None)
+def get_guarded_request_class():
+    from googleapiclient.http import HttpRequest
+
+    class GuardedHttpRequest(HttpRequest):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.add_response_callback(self._record_response_bytes)
+
+        # Function: Record the size of the response (httplib2 sets content-length to the size after decompression)
+        def _record_response_bytes(self, resp):
+            UPSTREAM_RESPONSE_BYTES.inc(int(resp.get('content-length', 0)), method=self.methodId)
+
+        def execute(self, http=None, num_retries=0):
+            # Inserts are only idempotent when the event has a client-assigned ID
+            idempotent = not self.methodId.endswith('.insert') or 'id' in json.loads(self.body or '{}')
+            calendar_id_match = CALENDAR_ID_PATTERN.search(self.uri)
+            return calendar_upstream.call(functools.partial(super().execute, http=http, num_retries=num_retries), idempotent=idempotent,
+                                          method=self.methodId, calendar_id=unquote(calendar_id_match.group(1)) if calendar_id_match else '')
+
+    return GuardedHttpRequest
@@ -1,9 +1,17 @@
 from django.urls import path
-from . import views
+from . import views, async_views, metrics
 
 urlpatterns = [
     path('available_slots', views.get_available_slots),
+    path('available_slots/all', views.get_all_available_slots),
     path('book_slot', views.book_slot),
+    path('book_slots', views.book_slots),
     path('update_booking', views.update_booking),
-    path('auth', views.auth_test)
+    path('auth', views.auth_test),
+    path('async/available_slots', async_views.get_available_slots_async),
+    path('async/book_slot', async_views.book_slot_async),
 ]
+
+# The metrics are only published when enabled in settings (GCAL_METRICS)
+if metrics.METRICS_SETTINGS['ENABLED']:
+    urlpatterns.append(path('metrics', metrics.metrics_view))
@@ -0,0 +1,22 @@
+from datetime import datetime, timedelta
+from pytz import timezone
+
+# Variable: Define timezone we are in
+SGT_tz = timezone('Asia/Singapore')
+
+# Function: Convert SGT ISOFormat string to SGT datetime object
+def convert_SGT_isoformat_to_SGT_datetime(isoformat_string):
+    SGT_datetime = datetime.fromisoformat(isoformat_string)
+    SGT_datetime = SGT_datetime.astimezone(SGT_tz)
+    return SGT_datetime
+
+# Function: Convert datetime object to SGT ISOFormat string
+def convert_datetime_to_SGT_isoformat(date, time):
+    SGT_isoformat = SGT_tz.localize(datetime.combine(date, time)).isoformat()
+    return SGT_isoformat
+
+# Function: Get every SGT date from the start to the end (inclusive) of a period given as SGT ISOFormat strings
+def get_dates_between(start_time, end_time):
+    start_date = convert_SGT_isoformat_to_SGT_datetime(start_time).date()
+    end_date = convert_SGT_isoformat_to_SGT_datetime(end_time).date()
+    return [start_date + timedelta(days=day) for day in range((end_date - start_date).days + 1)]
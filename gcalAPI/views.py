@@ -1,455 +1,697 @@
 from __future__ import print_function
 
 # Packages for Django
+from django.conf import settings
 from django.shortcuts import render
+from django.db import transaction
 from django.http import JsonResponse
-from rest_framework.decorators import api_view
+from django.utils.cache import get_conditional_response, patch_cache_control
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
 # Packages for GCal API
+import hashlib
+import math
 from pprint import pprint
 from datetime import datetime, time, timedelta
-from pytz import timezone, utc
 
-import os.path
-
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
-import firebase_admin
-from firebase_admin import auth
-from firebase_admin import credentials
-
-cred = credentials.Certificate("service-account-private-key.json") # Removed: service-account-private-key.json
-
-# Initialise the Firebase admin SDK
-default_app = firebase_admin.initialize_app(cred)
+from .calendar_service import calendar_id, calendar_service_provider
+from .cache import availability_cache, get_value_tag
+from .authentication import FirebaseAuthentication, InvalidIdTokenError, verify_id_token
+from .booking_queue import BOOKING_WRITE_BEHIND, enqueue_booking
+from .events import find_booking_event_id, insert_booking_event, insert_booking_events, tag_booking_event
+from .ledger import confirm_booking, release_booking, reserve_booking, reserve_bookings
+from .availability import (AvailabilitySnapshot, DEFAULT_HORIZON_DAYS, DEFAULT_LEAD_DAYS, MAX_HORIZON_DAYS, MAX_LEAD_DAYS, RESOURCE_CALENDAR_IDS,
+                           fetch_availability_index)
+from .metrics import time_availability_compute
+from .upstream import get_client_retry_after
+from .precompute import get_precomputed_slots
+from .models import Booking, BookingTask
+from .utils import convert_SGT_isoformat_to_SGT_datetime, convert_datetime_to_SGT_isoformat
+
+# The Firebase admin SDK is initialised on first use, see firebase_app.py
 
 # Function: Initialise Google Calendar API service
+# Returns the service shared by the process, which is only built on first use
 def initialise_service():
-    SCOPES = ['https://www.googleapis.com/auth/calendar']
-
-    creds = None
-    # The file token.json stores the user's access and refresh tokens, and is
-    # created automatically when the authorization flow completes for the first time.
-
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES) # Removed: token.json from file
-
-    # If there are no (valid) credentials available, let the user log in.
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                'credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-        # Save the credentials for the next run
-        with open('token.json', 'w') as token:
-            token.write(creds.to_json())
-
     try:
-        service = build('calendar', 'v3', credentials=creds)
-        print('service created successfully')
-        return service
+        return calendar_service_provider.get_service()
 
     except HttpError as error:
         print('An error occurred: %s' % error)
 
-# Variable: Define calendar_id
-calendar_id = "" # Removed: calendar ID
-
-# Variable: Define timezone we are in
-SGT_tz = timezone('Asia/Singapore')
-
-# Function: Convert UTC ISOFormat string returned from Google Calendar to SGT datetime object
-def convert_UTC_isoformat_to_SGT_datetime(isoformat_string):
-    UTC_datetime = datetime.fromisoformat(isoformat_string)
-    SGT_datetime = UTC_datetime.replace(tzinfo=utc).astimezone(SGT_tz)
-    return SGT_datetime
-
-# Function: Convert UTC date string returned from Google Calendar to SGT datetime object
-def convert_UTC_date_string_to_SGT_datetime(date_string):
-    date = datetime.strptime(date_string, '%Y-%m-%d').astimezone(SGT_tz)
-    SGT_datetime = date + timedelta(hours=0, minutes=0)
-
-    return SGT_datetime
-
-# Function: Convert SGT ISOFormat string to SGT datetime object
-def convert_SGT_isoformat_to_SGT_datetime(isoformat_string):
-    SGT_datetime = datetime.fromisoformat(isoformat_string)
-    SGT_datetime = SGT_datetime.astimezone(SGT_tz)
-    return SGT_datetime
-
-# Function: Convert datetime object to SGT ISOFormat string
-def convert_datetime_to_SGT_isoformat(date, time):
-    SGT_isoformat = SGT_tz.localize(datetime.combine(date, time)).isoformat()
-    return SGT_isoformat
-
-# Function: Generate slot to be evaluated
-def generate_slot_for_evaluation(start_date, booking_slot):
-    # Combine date and time for datetime slot to be evaluated
-    start_datetime = SGT_tz.localize(datetime.combine(start_date, booking_slot['start_time']))
-    end_datetime = start_datetime + booking_slot['duration']
-    event = {
-        'start': {
-            'dateTime': start_datetime.isoformat(),
-            'timeZone': 'Asia/Singapore',
-        },
-        'end': {
-            'dateTime': end_datetime.isoformat(),
-            'timeZone': 'Asia/Singapore',
-        },
-    }
-
-    return event
-
-# Function: Check if half-day slot is available (for GET and POST requests)
+# Function: Check if half-day slot is available on the index returned by fetch_index(start_date, no_of_days, booking_slots)
 # Returns a boolean
-def is_half_day_slot_available(service, calendar_id, start_time, end_time):
+def check_half_day_slot(fetch_index, start_time, end_time):
+    start_time_SGT_datetime = convert_SGT_isoformat_to_SGT_datetime(start_time)
+
     # Exclude all Sundays
-    if convert_SGT_isoformat_to_SGT_datetime(start_time).weekday() != 6:
+    if start_time_SGT_datetime.weekday() != 6:
+        booking_slots = {'half_day': {'start_time': start_time_SGT_datetime.time(),
+                                      'duration': convert_SGT_isoformat_to_SGT_datetime(end_time) - start_time_SGT_datetime}}
         try:
-            # List all events during this period
-            event_details = service.events().list(calendarId=calendar_id,
-                                                    timeMin=start_time, timeMax=end_time).execute().get('items')
-                        
-            if len(event_details) < 4:
-                return True
+            # Evaluate all bookings during this period
+            availability_index = fetch_index(start_time_SGT_datetime.date(), 1, booking_slots)
 
-            else:  
-                return False
+            return availability_index.is_half_day_slot_available(start_time_SGT_datetime.date(), 'half_day')
 
         except HttpError as error:
             print(f'An error occurred: {error}')
     else:
         return False
 
-# Function: Generate available half-day slots (for GET request only)
-# Returns SGT ISOFormat string
-def generate_available_half_day_slots(service, calendar_id, start_date, booking_slot, available_slots):
-        # Generate slot for evaluation of availability
-        event = generate_slot_for_evaluation(start_date, booking_slot)
-
-        if is_half_day_slot_available(service, calendar_id, event['start']['dateTime'], event['end']['dateTime']) == True:
-            available_slots.append(
-                    {'start': event['start']['dateTime'], 'end': event['end']['dateTime']})
-
-# Function: Check if full-day slot is available (for GET and POST requests)
+# Function: Check if full-day slot is available on the index returned by fetch_index(start_date, no_of_days, booking_slots)
 # Returns a boolean
-def is_full_day_slot_available(service, calendar_id, start_time, end_time):
-    # Exclude all Sundays
-    if convert_SGT_isoformat_to_SGT_datetime(start_time).weekday() != 6:
-        morning_slot_count = 0
-        afternoon_slot_count = 0
-        full_day_count = 0
+def check_full_day_slot(fetch_index, start_time, end_time):
+    start_time_SGT_datetime = convert_SGT_isoformat_to_SGT_datetime(start_time)
 
+    # Exclude all Sundays
+    if start_time_SGT_datetime.weekday() != 6:
+        booking_slots = {'full_day': {'start_time': start_time_SGT_datetime.time(),
+                                      'duration': convert_SGT_isoformat_to_SGT_datetime(end_time) - start_time_SGT_datetime}}
         try:
-            # List all events during this period
-            event_details = service.events().list(calendarId=calendar_id,
-                                                timeMin=start_time, timeMax=end_time).execute().get('items')
-
-            for existing_event in event_details:
-                if 'start' in existing_event and 'date' in existing_event['start'] and 'end' in existing_event and 'date' in existing_event['end']:
-                    existing_booking_start_datetime = convert_UTC_date_string_to_SGT_datetime(existing_event['start']['date'])
-                    existing_booking_end_datetime = convert_UTC_date_string_to_SGT_datetime(existing_event['end']['date'])
-                else: 
-                    existing_booking_start_datetime = convert_UTC_isoformat_to_SGT_datetime(existing_event['start']['dateTime'])
-                    existing_booking_end_datetime = convert_UTC_isoformat_to_SGT_datetime(existing_event['end']['dateTime'])
-
-                duration = existing_booking_end_datetime - existing_booking_start_datetime
-
-                if duration < timedelta(hours=5):
-                    if existing_booking_end_datetime.time() < time(hour=14):
-                        morning_slot_count += 1
-                    elif existing_booking_end_datetime.time() > time(hour=14):
-                        afternoon_slot_count += 1
-                elif duration > timedelta(hours=5):
-                    full_day_count += 1
-
-            if full_day_count + morning_slot_count < 4 and full_day_count + afternoon_slot_count < 4:
-                return True
-            
-            else:  
-                return False
-        
+            # Evaluate all bookings during this period
+            availability_index = fetch_index(start_time_SGT_datetime.date(), 1, booking_slots)
+
+            return availability_index.is_full_day_slot_available(start_time_SGT_datetime.date())
+
         except HttpError as error:
             print(f'An error occurred: {error}')
     else:
         return False
-    
-# Function: Generate available full-day slots (for GET request only)
-# Returns a date object
-def generate_available_full_day_slots(service, calendar_id, start_date, booking_slot, available_days):
-    # Generate slot for evaluation of availability
-    event = generate_slot_for_evaluation(start_date, booking_slot)
 
-    if is_full_day_slot_available(service, calendar_id, event['start']['dateTime'], event['end']['dateTime']) == True:
-        available_days.append(start_date)
-
-# Function: Check if consecutive-day slot is available (for POST request only)
-def is_consecutive_days_slot_available(service, calendar_id, start_time, no_of_days):
+# Function: Check if consecutive-day slot is available on the index returned by fetch_index(start_date, no_of_days, booking_slots)
+# The events of all the days are fetched with one call, and each day is evaluated in memory
+def check_consecutive_days_slot(fetch_index, start_time, no_of_days):
     start_time_SGT_datetime = convert_SGT_isoformat_to_SGT_datetime(start_time)
-    proceed_with_booking_array = []
-    for day in range(no_of_days):
-        slot_start_time = start_time_SGT_datetime + timedelta(days=day)
-        slot_end_time = slot_start_time + timedelta(hours=9)
-        proceed_with_booking_array.append(is_full_day_slot_available(service, calendar_id, datetime.isoformat(slot_start_time), datetime.isoformat(slot_end_time)))
-    proceed_with_booking = all(proceed_with_booking_array)
-    
-    return proceed_with_booking
+    booking_slots = {'full_day': {'start_time': start_time_SGT_datetime.time(), 'duration': timedelta(hours=9)}}
+
+    try:
+        availability_index = fetch_index(start_time_SGT_datetime.date(), no_of_days, booking_slots)
+
+    except HttpError as error:
+        print(f'An error occurred: {error}')
+        return False
+
+    return availability_index.are_consecutive_slots_available(start_time_SGT_datetime.date(), no_of_days)
 
-# Function: Check if x.5-day slot is available (for POST request only)
-def is_x_and_half_days_slot_available(service, calendar_id, start_time, no_of_days):
+# Function: Check if x.5-day slot is available on the index returned by fetch_index(start_date, no_of_days, booking_slots)
+# The events of all the days are fetched with one call, and each day is evaluated in memory
+def check_x_and_half_days_slot(fetch_index, start_time, no_of_days):
     start_time_SGT_datetime = convert_SGT_isoformat_to_SGT_datetime(start_time)
+    booking_slots = {'full_day': {'start_time': start_time_SGT_datetime.time(), 'duration': timedelta(hours=9)},
+                     'morning': {'start_time': start_time_SGT_datetime.time(), 'duration': timedelta(hours=4)}}
 
-    # Evaluate availability of full-day slots
-    # Create interim array to store boolean for whether full-day slots are available, equivalent of proceed_with_booking_array in the other functions
-    are_full_day_slots_available = []
-    for day in range(no_of_days):
-        full_day_slot_start_time = start_time_SGT_datetime + timedelta(days=day)
-        full_day_slot_end_time = full_day_slot_start_time + timedelta(hours=9)
-        are_full_day_slots_available.append(is_full_day_slot_available(service, calendar_id, datetime.isoformat(full_day_slot_start_time), datetime.isoformat(full_day_slot_end_time)))
-    
-    # Evaluate availability of last morning half-day slot
-    morning_slot_start_time = start_time_SGT_datetime + timedelta(days=no_of_days)
-    morning_slot_end_time = morning_slot_start_time + timedelta(hours=4)
-    is_morning_slot_available = is_half_day_slot_available(service, calendar_id, datetime.isoformat(morning_slot_start_time), datetime.isoformat(morning_slot_end_time))
+    try:
+        availability_index = fetch_index(start_time_SGT_datetime.date(), no_of_days + 1, booking_slots)
 
-    if all(are_full_day_slots_available) and is_morning_slot_available:
-        proceed_with_booking = True
-    else:
-        proceed_with_booking = False
-    
-    return proceed_with_booking
+    except HttpError as error:
+        print(f'An error occurred: {error}')
+        return False
+
+    # Evaluate availability of the full-day slots, and of the last morning half-day slot
+    return availability_index.are_consecutive_slots_available(start_time_SGT_datetime.date(), no_of_days, ends_with_morning_slot=True)
+
+# Variable: Slot types offered on the website, returned together by /available_slots/all
+SLOT_TYPES = [0.5, 1, 1.5, 2, 2.5, 3, 3.5]
+
+# Function: Extract the slot type from the query parameters of a GET request: 0.5, 1, 1.5, 2, 2.5, 3, 3.5 days,
+# or any other number of half-days. Raises ValueError if the parameter is missing or not a number.
+def get_slot_type_parameter(query_params):
+    try:
+        slot_type = float(query_params['slot_type'])
+
+    except (KeyError, ValueError):
+        raise ValueError('slot_type must be a number of days')
+
+    if not math.isfinite(slot_type):
+        raise ValueError('slot_type must be a number of days')
+    return slot_type
+
+# Function: Extract the search window from the query parameters of a GET request
+# Search for availability starting lead_days (default 4) days from today, for the next horizon_days (default 14) days
+# Returns the first date and the number of days to search. Raises ValueError if the parameters are invalid.
+def get_search_window_parameters(query_params):
+    try:
+        lead_days = int(query_params.get('lead_days', DEFAULT_LEAD_DAYS))
+        horizon_days = int(query_params.get('horizon_days', DEFAULT_HORIZON_DAYS))
+
+    except ValueError:
+        raise ValueError('lead_days and horizon_days must be integers')
+
+    if not 0 <= lead_days <= MAX_LEAD_DAYS:
+        raise ValueError('lead_days must be between 0 and %d' % MAX_LEAD_DAYS)
+
+    if not 1 <= horizon_days <= MAX_HORIZON_DAYS:
+        raise ValueError('horizon_days must be between 1 and %d' % MAX_HORIZON_DAYS)
+
+    display_start_date = datetime.now().date() + timedelta(days=lead_days)
+    return display_start_date, horizon_days
+
+# Function: Find available slots of a slot type in the horizon_days days from display_start_date (for GET request only)
+# Returns None if the events cannot be fetched
+@time_availability_compute('available_slots')
+def find_available_slots(service, calendar_id, slot_type, display_start_date, horizon_days):
+    # Fetch all events in the search window once, and evaluate every slot against them in memory
+    try:
+        availability_index = fetch_availability_index(service, calendar_id, display_start_date, horizon_days)
+
+    except HttpError as error:
+        print(f'An error occurred: {error}')
+        return None
+
+    return generate_available_slots_of_slot_type(availability_index, slot_type, display_start_date)
+
+# Function: Generate the available slots of a slot type from the availability of every slot in the search window
+# Returns SGT ISOFormat strings
+def generate_available_slots_of_slot_type(availability_index, slot_type, display_start_date):
+    if not (slot_type * 2).is_integer():
+        return []
+
+    # NumPy is only loaded by the processes that search for slots
+    from .occupancy import OccupancyMatrix, generate_available_slots
+
+    occupancy = OccupancyMatrix(availability_index)
+    return generate_available_slots(occupancy, display_start_date, int(slot_type * 2))
+
+# Variable: Cache-Control of the available slots, see GCAL_AVAILABLE_SLOTS_CACHE_CONTROL in settings.py
+AVAILABLE_SLOTS_CACHE_CONTROL = {
+    'MAX_AGE': 15,
+    'STALE_WHILE_REVALIDATE': 60,
+    **getattr(settings, 'GCAL_AVAILABLE_SLOTS_CACHE_CONTROL', {}),
+}
+
+# Function: Get the strong ETag of the available slots of a query, from the tag of the slots (see get_value_tag)
+def get_available_slots_etag(key_parts, slots_tag):
+    return '"%s"' % hashlib.sha256(repr((calendar_id, key_parts, slots_tag)).encode()).hexdigest()[:32]
+
+# Function: Set the ETag and Cache-Control of a response with available slots, so that browsers and CDNs can reuse it
+def add_available_slots_headers(response, etag):
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=AVAILABLE_SLOTS_CACHE_CONTROL['MAX_AGE'],
+                        stale_while_revalidate=AVAILABLE_SLOTS_CACHE_CONTROL['STALE_WHILE_REVALIDATE'])
+    return response
+
+# Function: Answer a GET request for available slots with 304 if If-None-Match has the ETag of the cached slots
+# slots_tag is the tag of the cached slots, or None if they are not cached
+# Returns None if the slots have to be computed (or taken from the cache) and sent
+def get_not_modified_response(request, key_parts, slots_tag):
+    if slots_tag is None:
+        return None
+
+    etag = get_available_slots_etag(key_parts, slots_tag)
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        add_available_slots_headers(response, etag)
+    return response
+
+# Function: Respond to a GET request with available slots, with their ETag and Cache-Control
+# Answers 304 if If-None-Match has the ETag of the slots. make_response builds the response of the slots otherwise.
+def get_available_slots_response(request, key_parts, available_slots, make_response):
+    etag = get_available_slots_etag(key_parts, get_value_tag(available_slots))
+    response = get_conditional_response(request, etag=etag) or make_response(available_slots)
+    return add_available_slots_headers(response, etag)
+
+# Function: Extract the slot types from the query parameters of a GET request (default: every slot type in SLOT_TYPES)
+# Raises ValueError if the parameter is invalid
+def get_slot_types_parameter(query_params):
+    if 'slot_types' not in query_params:
+        return SLOT_TYPES
+
+    try:
+        return [float(slot_type) for slot_type in query_params['slot_types'].split(',')]
+
+    except ValueError:
+        raise ValueError('slot_types must be a comma-separated list of numbers')
+
+# Function: Find available slots of several slot types in the horizon_days days from display_start_date (for GET request only)
+# The events are fetched, and the capacity of every day is computed, once for all the slot types
+# Returns the available slots keyed by slot type (e.g. '0.5', '1'), or None if the events cannot be fetched
+@time_availability_compute('all_available_slots')
+def find_available_slots_of_slot_types(service, calendar_id, slot_types, display_start_date, horizon_days):
+    try:
+        availability_index = fetch_availability_index(service, calendar_id, display_start_date, horizon_days)
+
+    except HttpError as error:
+        print(f'An error occurred: {error}')
+        return None
+
+    from .occupancy import OccupancyMatrix, generate_available_slots
+
+    occupancy = OccupancyMatrix(availability_index)
+
+    available_slots = {}
+    for slot_type in slot_types:
+        no_of_half_days = float(slot_type) * 2
+        available_slots['%g' % slot_type] = generate_available_slots(occupancy, display_start_date, int(no_of_half_days)) if no_of_half_days.is_integer() else []
+    return available_slots
 
 # View: Get available timeslots from the calendar if there are more than 1 resource
 @api_view(['GET'])
 def get_available_slots(request):
-    service = initialise_service()
+    try:
+        slot_type = get_slot_type_parameter(request.GET)
+        display_start_date, horizon_days = get_search_window_parameters(request.GET)
+
+    except ValueError as error:
+        return Response({'error': str(error)}, status=400)
+
+    search_dates = [display_start_date + timedelta(days=day) for day in range(horizon_days)]
+    key_parts = ('available_slots', slot_type, display_start_date.isoformat(), horizon_days)
+
+    # Serve the precomputed slots if there are any, see precompute.py
+    if slot_type in SLOT_TYPES:
+        precomputed_slots = get_precomputed_slots(calendar_id, [slot_type], display_start_date, horizon_days)
+        if precomputed_slots is not None:
+            return get_available_slots_response(request, key_parts, precomputed_slots['%g' % slot_type], Response)
+
+    # Clients revalidating slots that are still cached get a 304, without the slots being looked up
+    response = get_not_modified_response(request, key_parts, availability_cache.get_cached_tag(calendar_id, search_dates, key_parts))
+    if response is not None:
+        return response
+
+    # Reuse the slots computed for the same search until a booking changes one of the days searched,
+    # and show the last known slots while Google Calendar is unavailable.
+    # The Google Calendar service is only needed (and built on first use) when the slots are computed.
+    available_slots = availability_cache.get_or_compute(
+        calendar_id, search_dates, key_parts,
+        lambda: find_available_slots(initialise_service(), calendar_id, slot_type, display_start_date, horizon_days), serve_last_known=True)
+
+    # Not cached by clients, as there are no slots to show until Google Calendar is available again
+    if available_slots is None:
+        return Response([])
+
+    return get_available_slots_response(request, key_parts, available_slots, Response)
+
+# View: Get available timeslots of every slot type at once, computed from one pass over the events
+# The optional slot_types query parameter (e.g. 0.5,1,1.5) limits the slot types returned
+@api_view(['GET'])
+def get_all_available_slots(request):
+    try:
+        slot_types = get_slot_types_parameter(request.GET)
+        display_start_date, horizon_days = get_search_window_parameters(request.GET)
+
+    except ValueError as error:
+        return Response({'error': str(error)}, status=400)
+
+    search_dates = [display_start_date + timedelta(days=day) for day in range(horizon_days)]
+    key_parts = ('all_available_slots', tuple(slot_types), display_start_date.isoformat(), horizon_days)
 
-    # Extract slot type from POST request: 0.5, 1, 2, 3, 1.5, 2.5, 3.5 days
-    slot_type = float(request.GET.get('slot_type'))
+    if all(slot_type in SLOT_TYPES for slot_type in slot_types):
+        precomputed_slots = get_precomputed_slots(calendar_id, slot_types, display_start_date, horizon_days)
+        if precomputed_slots is not None:
+            return get_available_slots_response(request, key_parts, precomputed_slots, Response)
 
-    # Search for availability starting 4 days from today
-    display_start_date = datetime.now().date() + timedelta(days=4)
+    response = get_not_modified_response(request, key_parts, availability_cache.get_cached_tag(calendar_id, search_dates, key_parts))
+    if response is not None:
+        return response
 
-    # Create array to store available slots
-    available_slots = []
-    # Create interim array to store available days to evaluate available full-day slots
-    available_days = []
-    # Create interim array to store available morning slots to evaluate available x.5-day slots
-    available_morning_slots = []
+    available_slots = availability_cache.get_or_compute(
+        calendar_id, search_dates, key_parts,
+        lambda: find_available_slots_of_slot_types(initialise_service(), calendar_id, slot_types, display_start_date, horizon_days),
+        serve_last_known=True)
 
-    # Returns ISOFormat string
+    if available_slots is None:
+        return Response({'%g' % slot_type: [] for slot_type in slot_types})
+
+    return get_available_slots_response(request, key_parts, available_slots, Response)
+
+# Function: Check if the slot of a booking is available on the index returned by fetch_index, based on its slot type
+# (for POST request only)
+# Returns a boolean
+def check_booking_slot(fetch_index, slot_type, start_time, end_time):
     if slot_type == 0.5:
-        # The timeslots start at either 9AM or 2:30PM and each slot lasts for 4 hours.
-        booking_slots = [{'start_time': time(hour=9), 'duration': timedelta(hours=4)},
-                         {'start_time': time(hour=14, minute=30), 'duration': timedelta(hours=4)}]
-
-        # Find available half-day slots for the next 14 days from display_start_date
-        for day in range(14):
-            for booking_slot in booking_slots:
-                # Start date
-                start_date = display_start_date + timedelta(days=day)
-
-                generate_available_half_day_slots(service, calendar_id, start_date, booking_slot, available_slots)
-
-    elif slot_type == 1 or slot_type == 2 or slot_type == 3:
-
-        # The timeslots start at 9AM and each slot lasts for 9 hours.
-        booking_slot = {'start_time': time(hour=9), 'duration': timedelta(hours=9)}
-
-        # Find available full-day slots for the next 14 days
-        for day in range(14):
-            # Start date
-            start_date = display_start_date + timedelta(days=day)
-
-            generate_available_full_day_slots(service, calendar_id, start_date, booking_slot, available_days)
-        
-        if slot_type == 1: 
-            for day in available_days:
-                start_SGT_isoformat = convert_datetime_to_SGT_isoformat(day, time(hour=9))
-                end_SGT_isoformat = convert_datetime_to_SGT_isoformat(day, time(hour=18))
-                available_slots.append({'start': start_SGT_isoformat, 'end': end_SGT_isoformat})
-
-        elif slot_type == 2:
-            for day in available_days:
-                if day + timedelta(days=1) in available_days:
-                    start_SGT_isoformat = convert_datetime_to_SGT_isoformat(day, time(hour=9))
-                    end_SGT_isoformat = convert_datetime_to_SGT_isoformat(day + timedelta(days=1), time(hour=18))
-                    available_slots.append({'start': start_SGT_isoformat, 'end': end_SGT_isoformat})
-
-        elif slot_type == 3:
-            for day in available_days:
-                if day + timedelta(days=1) in available_days and day + timedelta(days=2) in available_days:
-                    start_SGT_isoformat = convert_datetime_to_SGT_isoformat(day, time(hour=9))
-                    end_SGT_isoformat = convert_datetime_to_SGT_isoformat(day + timedelta(days=2), time(hour=18))
-                    available_slots.append({'start': start_SGT_isoformat, 'end': end_SGT_isoformat})
-
-                
-    # Returns date object
+        return bool(check_half_day_slot(fetch_index, start_time, end_time))
+
+    elif slot_type == 1:
+        return bool(check_full_day_slot(fetch_index, start_time, end_time))
+
+    elif slot_type == 2 or slot_type == 3:
+        return check_consecutive_days_slot(fetch_index, start_time, int(slot_type))
+
     elif slot_type == 1.5 or slot_type == 2.5 or slot_type == 3.5:
+        return check_x_and_half_days_slot(fetch_index, start_time, int(slot_type - 0.5))
 
-        # There are 2 parts to this: 
-        # 1. I need to first create an array of all available full consecutive day slots.
-        # 2. I also need to create an array of all available morning half-day slots.
-
-        # 1. I need to first create an array of all available full consecutive day slots.
-        # The timeslots start at 9AM and each slot lasts for 9 hours.
-        full_day_booking_slot = {'start_time': time(hour=9), 'duration': timedelta(hours=9)}
-
-        # Find available full-day slots for the next 14 days
-        for day in range(14):
-            # Start date
-            start_date = display_start_date + timedelta(days=day)
-
-            generate_available_full_day_slots(service, calendar_id, start_date, full_day_booking_slot, available_days)
-        
-        # 2. I also need to create an array of all available morning half-day slots.
-        # The timeslots start at 9AM and each slot lasts for 4 hours.
-        morning_half_day_booking_slot = {'start_time': time(hour=9), 'duration': timedelta(hours=4)}
-
-        # Find available half-day slots for the next 14 days from display_start_date
-        for day in range(14):
-            # Start date
-            start_date = display_start_date + timedelta(days=day)
-
-            generate_available_half_day_slots(service, calendar_id, start_date, morning_half_day_booking_slot, available_morning_slots)
-
-        if slot_type == 1.5:
-            # I need to evaluate for each available day, whether there is a corresponding available morning half-day slot the next day.
-            for day in available_days:
-                next_morning_slot_in_SGT_ISOFormat = convert_datetime_to_SGT_isoformat(day + timedelta(days=1), morning_half_day_booking_slot['start_time'])
-                for slot in available_morning_slots:
-                    if next_morning_slot_in_SGT_ISOFormat == slot['start']:
-                        start_SGT_isoformat = convert_datetime_to_SGT_isoformat(day, time(hour=9))
-                        end_SGT_isoformat = convert_datetime_to_SGT_isoformat(day + timedelta(days=1), time(hour=12, minute=30))
-                        available_slots.append({'start': start_SGT_isoformat, 'end': end_SGT_isoformat})
-                    
-        # Returns date object
-        elif slot_type == 2.5:
-            # I need to evaluate for each available day, whether there is a corresponding available morning half-day slot the next day.               
-            for day in available_days:
-                # Evaluate if 2nd consecutive day is available.
-                if day + timedelta(days=1) in available_days:
-                    # Evaluate if 3rd consecutive morning slot is available.
-                    next_morning_slot_in_SGT_ISOFormat = convert_datetime_to_SGT_isoformat(day + timedelta(days=2), morning_half_day_booking_slot['start_time'])
-                    for slot in available_morning_slots:
-                        if next_morning_slot_in_SGT_ISOFormat == slot['start']:
-                            start_SGT_isoformat = convert_datetime_to_SGT_isoformat(day, time(hour=9))
-                            end_SGT_isoformat = convert_datetime_to_SGT_isoformat(day + timedelta(days=2), time(hour=12, minute=30))
-                            available_slots.append({'start': start_SGT_isoformat, 'end': end_SGT_isoformat})
-                            
-        elif slot_type == 3.5:
-            # I need to evaluate for each available day, whether there is a corresponding available morning half-day slot the next day.               
-            for day in available_days:
-                # Evaluate if 2nd and 3rd consecutive day are available.
-                if day + timedelta(days=1) in available_days and day + timedelta(days=2) in available_days:
-                    # Evaluate if 4th consecutive morning slot is available.
-                    next_morning_slot_in_SGT_ISOFormat = convert_datetime_to_SGT_isoformat(day + timedelta(days=3), morning_half_day_booking_slot['start_time'])
-                    for slot in available_morning_slots:
-                        if next_morning_slot_in_SGT_ISOFormat == slot['start']:
-                            start_SGT_isoformat = convert_datetime_to_SGT_isoformat(day, time(hour=9))
-                            end_SGT_isoformat = convert_datetime_to_SGT_isoformat(day + timedelta(days=3), time(hour=12, minute=30))
-                            available_slots.append({'start': start_SGT_isoformat, 'end': end_SGT_isoformat})
-                        
-    return Response(available_slots)
+    return False
 
-# View: Post booking
-@api_view(['POST'])
-def book_slot(request):
-    service = initialise_service()
+# Variable: Text fields of the booking information sent by the website
+BOOKING_TEXT_FIELDS = ['status', 'customer_name', 'product_name']
 
-    # Extract booking information from POST request
-    request_data = request.data
+# Function: Check the booking information of a POST request, before any capacity is reserved for it
+# Raises ValueError if it is not in the format sent by the website, or if its slot type is not offered
+def check_booking_data(request_data):
+    if not isinstance(request_data, dict):
+        raise ValueError('Each booking must be an object')
 
-    slot_type = float(request_data['slot_type'])
+    missing_fields = [field for field in ['slot_type', 'selectedTimeslot', 'selectedOptions', 'totalPrice'] + BOOKING_TEXT_FIELDS
+                      if field not in request_data]
+    if missing_fields:
+        raise ValueError('Missing booking fields: %s' % ', '.join(missing_fields))
+
+    if not all(isinstance(request_data[field], str) for field in BOOKING_TEXT_FIELDS):
+        raise ValueError('%s must be strings' % ', '.join(BOOKING_TEXT_FIELDS))
+
+    timeslot = request_data['selectedTimeslot']
+    try:
+        if not isinstance(timeslot, dict) or convert_SGT_isoformat_to_SGT_datetime(timeslot['start']) >= convert_SGT_isoformat_to_SGT_datetime(timeslot['end']):
+            raise ValueError
+
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('selectedTimeslot must have a start before its end, as ISO 8601 date-times')
+
+    selected_options = request_data['selectedOptions']
+    if not isinstance(selected_options, dict) or not all(isinstance(value, dict) for value in selected_options.values()):
+        raise ValueError('selectedOptions must be an object of add-ons')
+
+    try:
+        if not math.isfinite(float(request_data['totalPrice'])) or float(request_data['slot_type']) not in SLOT_TYPES:
+            raise ValueError
+
+    except (TypeError, ValueError):
+        raise ValueError('totalPrice must be a number, and slot_type one of %s' % ', '.join('%g' % slot_type for slot_type in SLOT_TYPES))
 
+# Function: Get the add-ons selected for a booking, one per line
+def get_addons(request_data):
     addons_array = []
     for key, value in request_data["selectedOptions"].items():
         if 'add_on_title' in value and 'option' in value:
             addons_array.append(value['add_on_title'] + ': ' + value['option'])
 
-    addons = '\n'.join(addons_array)  
-    
-    # Check against Google Calendar if slot is available
-    if slot_type == 0.5:
-        proceed_with_booking = is_half_day_slot_available(service, calendar_id, request_data['selectedTimeslot']['start'], request_data['selectedTimeslot']['end'])
-    
-    elif slot_type == 1:
-        proceed_with_booking = is_full_day_slot_available(service, calendar_id, request_data['selectedTimeslot']['start'], request_data['selectedTimeslot']['end'])
+    return '\n'.join(addons_array)
 
-    elif slot_type == 2 or slot_type == 3:
-        proceed_with_booking = is_consecutive_days_slot_available(service, calendar_id, request_data['selectedTimeslot']['start'], int(slot_type))
+# Function: Generate the Google Calendar event for a booking (for POST request only)
+def generate_event_request(request_data):
+    addons = get_addons(request_data)
 
-    elif slot_type == 1.5 or slot_type == 2.5 or slot_type == 3.5:
-        proceed_with_booking = is_x_and_half_days_slot_available(service, calendar_id, request_data['selectedTimeslot']['start'], int(slot_type - 0.5))
-    
-    # Proceed with booking only if slot is still available. Otherwise, throw an error.
-    if proceed_with_booking:
-        event_request = {
-            'start': {
-                'dateTime': request_data['selectedTimeslot']['start'],
-                'timeZone': 'Asia/Singapore'
-            },
-            'end': {
-                'dateTime': request_data['selectedTimeslot']['end'],
-                'timeZone': 'Asia/Singapore'
-            },
-            'summary': '[' + request_data['status'] + '] ' + request_data['customer_name'] + ": " + request_data['product_name'],
-            'description':  'Customer Name: ' + request_data['customer_name'] + '\nProduct: ' + request_data['product_name'] + '\nAdd-ons:\n' + addons + '\nPrice: $' + str(request_data['totalPrice']) + "\nBooked from website",
-            # + '\nAdditional notes: ' + request_data['additional_notes']
-            # '\nCustomer HP: ' + request_data['customer_hp'] +
-            'colorId': 1,
-            'status': 'confirmed',
-            'transparency': 'opaque',
-            'visibility': 'private',
-        }
-
-        send_notifications = True
-        send_updates = 'all'    
-        created_event = service.events().insert(
-            calendarId=calendar_id,
-            sendNotifications=send_notifications,
-            sendUpdates=send_updates,
-            body=event_request
-        ).execute()
+    event_request = {
+        'start': {
+            'dateTime': request_data['selectedTimeslot']['start'],
+            'timeZone': 'Asia/Singapore'
+        },
+        'end': {
+            'dateTime': request_data['selectedTimeslot']['end'],
+            'timeZone': 'Asia/Singapore'
+        },
+        'summary': '[' + request_data['status'] + '] ' + request_data['customer_name'] + ": " + request_data['product_name'],
+        'description':  'Customer Name: ' + request_data['customer_name'] + '\nProduct: ' + request_data['product_name'] + '\nAdd-ons:\n' + addons + '\nPrice: $' + str(request_data['totalPrice']) + "\nBooked from website",
+        # + '\nAdditional notes: ' + request_data['additional_notes']
+        # '\nCustomer HP: ' + request_data['customer_hp'] +
+        'colorId': 1,
+        'status': 'confirmed',
+        'transparency': 'opaque',
+        'visibility': 'private',
+    }
 
-    else:
-        raise Exception("The slot is not available.")
+    return event_request
+
+# Function: Generate the fields of the Booking kept in the capacity ledger for a booking made by the user owner_uid (for POST request only)
+def generate_booking_fields(request_data, event_request, owner_uid):
+    return {
+        'owner_uid': owner_uid,
+        'status': request_data['status'],
+        'customer_name': request_data['customer_name'],
+        'product': request_data['product_name'],
+        'total_price': float(request_data['totalPrice']),
+        'colour': '',
+        'colour_code': event_request['colorId'],
+        'add_ons': get_addons(request_data)[:500],
+        'additional_notes': request_data.get('additional_notes', ''),
+    }
 
-    return Response(created_event)
+# Class: Error raised when the slot of a booking is not available (any more), answered with 409 Conflict
+class SlotUnavailableError(Exception):
+    pass
+
+# Variable: Errors of Google Calendar API calls that failed or was not sent (see upstream.py), answered with 503 when booking
+UPSTREAM_ERRORS = (HttpError, ConnectionError, TimeoutError)
+
+# Function: Build the 503 response of a booking that failed because the Google Calendar API is unavailable
+# make_response builds the response of the error (e.g. Response or JsonResponse). Nothing is booked when this happens.
+def get_upstream_error_response(error, make_response):
+    print('An error occurred: %s' % error)
+    response = make_response({'error': 'Google Calendar is unavailable, please try again later.'}, status=503)
+    response['Retry-After'] = str(get_client_retry_after(error))
+    return response
+
+# Function: Book a slot: reserve its capacity in the ledger, then add its event to Google Calendar (for POST request only)
+# The booking is owned by the user owner_uid (a Firebase uid), see update_booking.
+# The reserved capacity is released if the event cannot be added. Raises SlotUnavailableError if the slot is not available.
+# With write-behind booking, the event is queued for the process_booking_queue worker instead, and the queued booking is returned.
+def place_booking(service, request_data, owner_uid):
+    slot_type = float(request_data['slot_type'])
+    start_time = request_data['selectedTimeslot']['start']
+    end_time = request_data['selectedTimeslot']['end']
 
-# View: Update booking that is already added to cart, but payment not made
+    event_request = generate_event_request(request_data)
+
+    # Fetched from Google Calendar before the days are locked in the ledger, and checked again with the bookings held in the ledger
+    # once they are (see reserve_bookings)
+    snapshot = fetch_booking_snapshot(service, [(start_time, end_time, None)])
+
+    def find_booking_calendar_id():
+        snapshot.add_ledger_bookings()
+        return find_snapshot_booking_calendar_id(snapshot, slot_type, start_time, end_time)
+
+    with transaction.atomic():
+        booking = reserve_booking(calendar_id, start_time, end_time, find_booking_calendar_id,
+                                  **generate_booking_fields(request_data, event_request, owner_uid))
+
+        # Proceed with booking only if slot is still available. Otherwise, throw an error.
+        if booking is None:
+            raise SlotUnavailableError("The slot is not available.")
+
+        event_request = tag_booking_event(event_request, booking.pk)
+
+        if BOOKING_WRITE_BEHIND:
+            task = enqueue_booking(booking, event_request)
+
+    if BOOKING_WRITE_BEHIND:
+        # The booked days have less capacity now
+        availability_cache.invalidate_period(calendar_id, start_time, end_time)
+
+        return {'booking_id': booking.pk, 'event_id': task.idempotency_key, 'status': 'queued'}
+
+    try:
+        created_event = insert_booking_event(service, booking.calendar_id, event_request)
+
+    except Exception:
+        release_booking(calendar_id, booking)
+        raise
+
+    confirm_booking(booking, created_event['id'])
+
+    # The booked days have less capacity now
+    availability_cache.invalidate_period(calendar_id, start_time, end_time)
+
+    return created_event
+
+# Function: Fetch one snapshot of the availability in the days spanned by the slots of several bookings
+# (for POST request only)
+def fetch_booking_snapshot(service, booked_slots):
+    start_date = min(convert_SGT_isoformat_to_SGT_datetime(start_time).date() for start_time, end_time, booking_fields in booked_slots)
+    end_date = max(convert_SGT_isoformat_to_SGT_datetime(end_time).date() for start_time, end_time, booking_fields in booked_slots)
+
+    # The slots checked for a booking can end on the day after it (e.g. the last morning of an x.5-day booking)
+    return AvailabilitySnapshot.fetch(service, calendar_id,
+                                      convert_datetime_to_SGT_isoformat(start_date, time()),
+                                      convert_datetime_to_SGT_isoformat(end_date + timedelta(days=2), time()))
+
+# Function: Find the calendar to book a slot in on an availability snapshot, or None if the slot is not available (for POST request only)
+# When each resource has its own calendar, book the first resource that is free for the whole slot
+@time_availability_compute('slot_check')
+def find_snapshot_booking_calendar_id(snapshot, slot_type, start_time, end_time):
+    if not check_booking_slot(snapshot.get_availability_index, slot_type, start_time, end_time):
+        return None
+
+    if RESOURCE_CALENDAR_IDS:
+        return snapshot.find_free_resource_calendar_id(start_time, end_time)
+
+    return calendar_id
+
+# Function: Book the slots of several bookings, all or none of them (for POST request only)
+# The bookings are checked one after another against one snapshot of the availability, so that each one also sees
+# the capacity taken up by the ones before it, and their events are added to Google Calendar with batch requests.
+# Raises SlotUnavailableError if any slot is not available, or an exception if any event cannot be added, after releasing every booking.
+# With write-behind booking, the events are queued for the process_booking_queue worker instead, and the queued bookings are returned.
+def place_bookings(service, bookings_data, owner_uid):
+    event_requests = [generate_event_request(request_data) for request_data in bookings_data]
+    booked_slots = [(request_data['selectedTimeslot']['start'], request_data['selectedTimeslot']['end'], generate_booking_fields(request_data, event_request, owner_uid))
+                    for request_data, event_request in zip(bookings_data, event_requests)]
+
+    # Fetched from Google Calendar before the days are locked in the ledger, and checked again with the bookings held in the ledger
+    # once they are (see reserve_bookings)
+    snapshot = fetch_booking_snapshot(service, booked_slots)
+
+    def find_booking_calendar_ids():
+        snapshot.add_ledger_bookings()
+
+        booking_calendar_ids = []
+        for request_data, (start_time, end_time, booking_fields) in zip(bookings_data, booked_slots):
+            booking_calendar_id = find_snapshot_booking_calendar_id(snapshot, float(request_data['slot_type']), start_time, end_time)
+            if booking_calendar_id is None:
+                return None
+
+            snapshot.add_booking(booking_calendar_id, start_time, end_time)
+            booking_calendar_ids.append(booking_calendar_id)
+
+        return booking_calendar_ids
+
+    with transaction.atomic():
+        bookings = reserve_bookings(calendar_id, booked_slots, find_booking_calendar_ids)
+
+        # Proceed with booking only if every slot is still available. Otherwise, throw an error.
+        if bookings is None:
+            raise SlotUnavailableError("The slot is not available.")
+
+        event_requests = [tag_booking_event(event_request, booking.pk) for booking, event_request in zip(bookings, event_requests)]
+
+        if BOOKING_WRITE_BEHIND:
+            tasks = [enqueue_booking(booking, event_request) for booking, event_request in zip(bookings, event_requests)]
+
+    if not BOOKING_WRITE_BEHIND:
+        try:
+            created_events = insert_booking_events(service, [(booking.calendar_id, event_request) for booking, event_request in zip(bookings, event_requests)])
+
+        except Exception:
+            for booking in bookings:
+                release_booking(calendar_id, booking)
+            raise
+
+        for booking, created_event in zip(bookings, created_events):
+            confirm_booking(booking, created_event['id'])
+
+    # The booked days have less capacity now
+    for start_time, end_time, booking_fields in booked_slots:
+        availability_cache.invalidate_period(calendar_id, start_time, end_time)
+
+    if BOOKING_WRITE_BEHIND:
+        return [{'booking_id': booking.pk, 'event_id': task.idempotency_key, 'status': 'queued'} for booking, task in zip(bookings, tasks)]
+
+    return created_events
+
+# View: Post booking
 @api_view(['POST'])
-def update_booking(request):
+@authentication_classes([FirebaseAuthentication])
+@permission_classes([IsAuthenticated])
+def book_slot(request):
+    # Extract booking information from POST request
+    request_data = request.data
+
+    try:
+        check_booking_data(request_data)
+
+    except ValueError as error:
+        return Response({'error': str(error)}, status=400)
+
+    service = initialise_service()
+
+    try:
+        created_event = place_booking(service, request_data, request.user.uid)
+
+    except SlotUnavailableError as error:
+        return Response({'error': str(error)}, status=409)
+
+    except UPSTREAM_ERRORS as error:
+        return get_upstream_error_response(error, Response)
+
+    # With write-behind booking, the booking is only accepted here
+    return Response(created_event, status=202 if BOOKING_WRITE_BEHIND else 200)
+
+# View: Post several bookings at once (e.g. every item in a cart), booking all of them or none
+@api_view(['POST'])
+@authentication_classes([FirebaseAuthentication])
+@permission_classes([IsAuthenticated])
+def book_slots(request):
+    # Extract the list of bookings from POST request, each in the same format as for book_slot
+    bookings_data = request.data
+
+    if not isinstance(bookings_data, list) or not bookings_data:
+        return Response({'error': 'Expected a non-empty list of bookings'}, status=400)
+
+    # Every booking is checked before any of them is reserved
+    try:
+        for request_data in bookings_data:
+            check_booking_data(request_data)
+
+    except ValueError as error:
+        return Response({'error': str(error)}, status=400)
+
     service = initialise_service()
 
+    try:
+        created_events = place_bookings(service, bookings_data, request.user.uid)
+
+    except SlotUnavailableError as error:
+        return Response({'error': str(error)}, status=409)
+
+    except UPSTREAM_ERRORS as error:
+        return get_upstream_error_response(error, Response)
+
+    # With write-behind booking, the bookings are only accepted here
+    return Response(created_events, status=202 if BOOKING_WRITE_BEHIND else 200)
+
+# Function: Find the ID of the event of a booking (for POST request only)
+# The ID is kept with the booking in the ledger once its event is inserted. If it is not (e.g. the process stopped
+# right after the insert), the event is found by the booking ID in its private extended properties.
+# Returns None if the event is not found
+def find_booking_event_id_of(service, booking):
+    if booking.event_id:
+        return booking.event_id
+
+    event_id = find_booking_event_id(service, booking.calendar_id, booking.pk)
+    if event_id is not None:
+        confirm_booking(booking, event_id)
+    return event_id
+
+# View: Update booking that is already added to cart, but payment not made
+@api_view(['POST'])
+@authentication_classes([FirebaseAuthentication])
+@permission_classes([IsAuthenticated])
+def update_booking(request):
     # Extract booking information from POST request
     request_data = request.data
 
-    # List all events to look for the one that you want to update
-    event_details = service.events().list(calendarId=calendar_id, timeMin=request_data['start'], timeMax=request_data['end']).execute().get('items')
+    # Only the user who made the booking can update it, and the bookings of other users are not found
+    try:
+        booking = Booking.objects.select_related('task').filter(pk=int(request_data['booking_id']), owner_uid=request.user.uid).first()
 
-    # Find the event
-    # To-do: I have no idea what will be the reference point
-    updating_event = filter(lambda x: '1234567890' in x['description'], event_details)
-    updating_event = next(updating_event)
+    except (KeyError, TypeError, ValueError):
+        return Response({'error': 'booking_id must be an integer'}, status=400)
 
-    # Update the event
-    updating_event['summary'] = '[completed] simple toilet reno'
-    updating_event['colorId'] = 2
+    if booking is None:
+        return Response({'error': 'Booking not found'}, status=404)
+
+    # Only the changed fields are sent
+    booking.status = 'completed'
+    booking.save(update_fields=['status'])
+    event_changes = {'summary': '[' + booking.status + '] ' + booking.customer_name + ': ' + booking.product, 'colorId': 2}
 
-    service.events().update(
-        calendarId=calendar_id,
-        eventId=updating_event['id'],
-        body=updating_event
+    # With write-behind booking, an event that is still queued is inserted with the changes
+    task = getattr(booking, 'task', None)
+    if task is not None:
+        if BookingTask.objects.filter(pk=task.pk, status=BookingTask.PENDING).update(event_request={**task.event_request, **event_changes}):
+            return Response({'booking_id': booking.pk, 'event_id': task.idempotency_key, 'status': 'queued'}, status=202)
+
+        # The event was inserted in the meantime
+        booking.refresh_from_db()
+
+    service = initialise_service()
+    event_id = find_booking_event_id_of(service, booking)
+    if event_id is None:
+        return Response({'error': 'Booking not found'}, status=404)
+
+    # Update the event
+    updated_event = service.events().patch(
+        calendarId=booking.calendar_id,
+        eventId=event_id,
+        body=event_changes
     ).execute()
 
+    return Response(updated_event)
+
 # Test View: Do something if the user is authenticated
 @api_view(['GET'])
 def auth_test(request):
@@ -464,8 +706,8 @@ def auth_test(request):
     id_token = auth_header.split(' ')[1]
 
     try:
-        # Verify the user ID token using the Firebase Admin SDK
-        decoded_token = auth.verify_id_token(id_token)
+        # Verify the user ID token using the Firebase Admin SDK, or reuse the result for a token verified before
+        decoded_token = verify_id_token(id_token)
 
         # Extract the user ID from the decoded token
         user_id = decoded_token['uid']
@@ -474,6 +716,6 @@ def auth_test(request):
         # You can add your API logic here
         return JsonResponse({'message': 'Authenticated user', 'user_id': user_id})
 
-    except auth.InvalidIdTokenError:
+    except InvalidIdTokenError:
         # Return an error response if the user ID token is invalid
         return JsonResponse({'error': 'Invalid user ID token'}, status=401)
\ No newline at end of file
@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'gcalAPI.metrics.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -131,3 +132,114 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 CORS_ORIGIN_WHITELIST = [
     # Removed: Allowed CORS origins, i.e. domain of website
 ]
+
+# Google Calendar event mirror, kept current by `python manage.py sync_calendar --interval 60`
+# Availability falls back to the Google Calendar API when the mirror is older than GCAL_MIRROR_MAX_AGE seconds
+GCAL_MIRROR_ENABLED = True
+GCAL_MIRROR_MAX_AGE = 120
+
+# Maximum number of days /available_slots can search with the horizon_days query parameter,
+# and the maximum number of days from today it can start searching with lead_days
+GCAL_MAX_HORIZON_DAYS = 90
+GCAL_MAX_LEAD_DAYS = 365
+
+# Cache of availability results, invalidated per day when a booking is made or updated
+# BACKEND is 'local' (in-process LRU with MAX_ENTRIES) or 'django' (the Django cache named CACHE_ALIAS, shared across workers)
+GCAL_AVAILABILITY_CACHE = {
+    'BACKEND': 'local',
+    'TTL': 60,
+    'MAX_ENTRIES': 1024,
+    'CACHE_ALIAS': 'default',
+    # Number of seconds the last known available slots are kept, to be shown while Google Calendar is unavailable
+    'LAST_KNOWN_TTL': 3600,
+    # Concurrent identical queries share one computation in each process. With the 'django' backend, SHARED_LOCK
+    # also makes the workers wait for the one computing a query (for up to SHARED_LOCK_TIMEOUT seconds)
+    'SHARED_LOCK': False,
+    'SHARED_LOCK_TIMEOUT': 30,
+    # Number of seconds the version of each day is kept, longer than TTL so that no entry outlives the versions it was computed from
+    'VERSION_TTL': 86400,
+}
+
+# Calendars of the resources (crews), if each resource has its own calendar
+# Availability then comes from one freebusy query over these calendars, and a slot is available if at least one resource is free
+GCAL_RESOURCE_CALENDAR_IDS = []
+
+# Async views (async/available_slots, async/book_slot): size of the thread pool for Google Calendar API calls,
+# and the number of days fetched by each concurrent call
+GCAL_UPSTREAM_MAX_WORKERS = 8
+GCAL_ASYNC_CHUNK_DAYS = 7
+
+# Number of events requested per page of events.list (up to 2500)
+GCAL_EVENTS_PAGE_SIZE = 2500
+
+# Capacity ledger: number of seconds a booking holds capacity after it is reserved or confirmed,
+# until its event shows up in the mirror and the availability cache
+GCAL_LEDGER_HOLD_SECONDS = 300
+
+# Write-behind booking: book_slot only reserves the booking and queues its event, and responds with 202.
+# The events are inserted by `python manage.py process_booking_queue --interval 5`, which retries failed inserts
+# GCAL_BOOKING_QUEUE_MAX_ATTEMPTS times, waiting GCAL_BOOKING_QUEUE_RETRY_DELAY seconds (doubled every time) in between
+GCAL_BOOKING_WRITE_BEHIND = False
+GCAL_BOOKING_QUEUE_MAX_ATTEMPTS = 8
+GCAL_BOOKING_QUEUE_RETRY_DELAY = 5
+
+# Maximum number of verified Firebase ID tokens cached in memory (each until it expires)
+# book_slot, book_slots and update_booking require "Authorization: Bearer <Firebase ID token>"
+GCAL_AUTH_TOKEN_CACHE_SIZE = 1024
+
+# Service account key of the Firebase project, loaded the first time an ID token is verified
+GCAL_FIREBASE_CREDENTIALS_FILE = 'service-account-private-key.json' # Removed: service-account-private-key.json
+
+# Guard around every Google Calendar API call: a token bucket of BURST calls refilled at REQUESTS_PER_SECOND
+# (per process, so divide the quota by the number of workers), waiting up to MAX_WAIT seconds for the quota.
+# 429, 5xx and quota errors are retried up to MAX_RETRIES times with jittered exponential backoff
+# (BACKOFF_BASE doubled every attempt, up to BACKOFF_MAX seconds). After FAILURE_THRESHOLD failed calls in a row,
+# calls fail fast for RESET_TIMEOUT seconds, and /available_slots shows the last known slots.
+GCAL_UPSTREAM = {
+    'REQUESTS_PER_SECOND': 5,
+    'BURST': 10,
+    'MAX_WAIT': 10,
+    'MAX_RETRIES': 4,
+    'BACKOFF_BASE': 0.5,
+    'BACKOFF_MAX': 16,
+    'FAILURE_THRESHOLD': 5,
+    'RESET_TIMEOUT': 30,
+}
+
+# Cache-Control of /available_slots and /available_slots/all, which also send a strong ETag and answer If-None-Match with 304.
+# Browsers and CDNs reuse the slots for MAX_AGE seconds, then show them for up to STALE_WHILE_REVALIDATE more seconds
+# while revalidating. Keep MAX_AGE short: a slot booked meanwhile keeps showing (book_slot still rejects it)
+GCAL_AVAILABLE_SLOTS_CACHE_CONTROL = {
+    'MAX_AGE': 15,
+    'STALE_WHILE_REVALIDATE': 60,
+}
+
+# Precomputed availability: /available_slots serves the slots of every slot type over the next DAYS days from a snapshot
+# in the AvailableSlots table, kept current by `python manage.py precompute_availability --interval 30`.
+# A snapshot older than MAX_AGE seconds (or older than a booking on its days) is still served, and refreshed in the background;
+# one older than MAX_STALE seconds is not served. Searches outside the snapshot are computed on demand
+GCAL_PRECOMPUTE = {
+    'ENABLED': False,
+    'DAYS': 94,
+    'MAX_AGE': 60,
+    'MAX_STALE': 900,
+    # Number of seconds after which a refresh that has not finished is assumed to have died
+    'REFRESH_TIMEOUT': 300,
+}
+
+# HTTP connections to Google (Calendar API, OAuth and the public keys of Firebase ID tokens): keep-alive pools for up to
+# POOL_CONNECTIONS hosts, keeping POOL_MAXSIZE connections open to each. POOL_MAXSIZE should be at least the number of threads
+# of a worker (and GCAL_UPSTREAM_MAX_WORKERS with the async views), or connections are closed after use. TIMEOUT in seconds
+GCAL_HTTP_TRANSPORT = {
+    'POOL_CONNECTIONS': 4,
+    'POOL_MAXSIZE': 10,
+    'TIMEOUT': 30,
+}
+
+# Prometheus metrics at /metrics, only mounted when ENABLED. Set TOKEN to require an `Authorization: Bearer <TOKEN>` header.
+# Calendars are labelled with their alias in CALENDAR_LABELS ({calendar ID: alias}), or a hash of their ID
+GCAL_METRICS = {
+    'ENABLED': False,
+    'TOKEN': '', # Removed: metrics token
+    'CALENDAR_LABELS': {},
+}